@@ -0,0 +1,341 @@
+"""
+JSON API for timesheets, for kiosk / mobile clock-in clients and integrations.
+
+    app.register_blueprint(create_api(get_db, punch_buffer=PunchBuffer(get_pool)))
+
+Every endpoint below /api/v1 except token creation needs
+`Authorization: Bearer <token>`. A token is obtained with the account's
+email and password (POST /api/v1/tokens) and is only stored as a SHA-256;
+it stops working when revoked or when the user's password is reset.
+
+    GET    /api/v1/logs                 page of logs (per_page, before, after,
+                                        date_from, date_to, user_id)
+    POST   /api/v1/logs                 {work_date, clock_in, clock_out, task_description}
+    PUT    /api/v1/logs/<id>            same fields, all required
+    DELETE /api/v1/logs/<id>
+    POST   /api/v1/logs/batch           {"operations": [...], "atomic": false}
+    POST   /api/v1/punches              {"kind": "in" | "out", "at": optional ISO time}
+                                        or {"punches": [...], "source": "kiosk-3"}
+
+A batch runs in one transaction. Each operation gets its own savepoint, so
+a failed item is reported and skipped while the others commit together;
+with "atomic": true any failure rolls the whole batch back.
+
+Punches are group-committed through punches.PunchBuffer and folded into
+timesheet rows later by the compact_punches job.
+"""
+import hashlib
+import os
+import secrets
+from datetime import date, datetime, timedelta
+from functools import wraps
+
+from flask import Blueprint, g, jsonify, request
+
+import passwords
+import punches
+import ratelimit
+from db import parse_clock
+
+API_PAGE_SIZES = (10, 25, 50, 100, 500)
+BATCH_MAX_OPERATIONS = int(os.getenv('API_BATCH_MAX', 200))
+# Tolerated clock skew for client-supplied punch times
+PUNCH_MAX_SKEW = timedelta(minutes=2)
+
+
+def token_hash(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class ApiError(Exception):
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class _BatchAborted(Exception):
+    """Raised inside an atomic batch to roll the transaction back."""
+
+
+def _parse_date(value, name):
+    try:
+        return date.fromisoformat(str(value).strip())
+    except (TypeError, ValueError):
+        raise ApiError(400, f"{name} must be a YYYY-MM-DD date")
+
+
+def parse_log_fields(data):
+    """
+    Validate a log payload the way the dashboard form does.
+    :return: (clock_in, clock_out, work_date, task_description)
+    """
+    if not isinstance(data, dict):
+        raise ApiError(400, "expected a JSON object")
+    work_date = _parse_date(data.get('work_date'), 'work_date')
+    if work_date > date.today():
+        raise ApiError(400, "future dates are not allowed")
+    clocks = []
+    for name in ('clock_in', 'clock_out'):
+        try:
+            clocks.append(parse_clock(str(data.get(name) or '').strip()))
+        except ValueError:
+            raise ApiError(400, f"{name} must be HH:MM or HH:MM:SS")
+    return clocks[0], clocks[1], work_date, data.get('task_description') or ''
+
+
+def parse_punch(data, user, now):
+    """:return: (user_id, kind, punched_at) for one punch payload"""
+    if not isinstance(data, dict):
+        raise ApiError(400, "each punch must be a JSON object")
+    kind = data.get('kind')
+    if kind not in ('in', 'out'):
+        raise ApiError(400, "kind must be in or out")
+
+    punched_at = now
+    if data.get('at'):
+        try:
+            punched_at = datetime.fromisoformat(str(data['at']).strip())
+        except ValueError:
+            raise ApiError(400, "at must be an ISO 8601 date and time")
+        if punched_at.tzinfo is not None:
+            # Stored like every other timestamp here: server local time
+            punched_at = punched_at.astimezone().replace(tzinfo=None)
+        if punched_at > now + PUNCH_MAX_SKEW:
+            raise ApiError(400, "punches cannot be in the future")
+
+    user_id = user['user_id']
+    if data.get('user_id') is not None:
+        try:
+            target = int(data['user_id'])
+        except (TypeError, ValueError):
+            raise ApiError(400, "user_id must be an integer")
+        if target != user_id:
+            # A shared kiosk punches for everyone with an admin token
+            if user['role'] != 'admin':
+                raise ApiError(403, "not allowed to punch for another user")
+            user_id = target
+    return user_id, kind, punched_at
+
+
+def create_api(db_factory, punch_buffer=None):
+    """
+    :param db_factory: Returns the request's DatabaseManager (app.get_db)
+    :param punch_buffer: punches.PunchBuffer for /punches; without one the
+                         endpoint answers 404
+    :return: The /api/v1 Blueprint
+    """
+    bp = Blueprint('api', __name__, url_prefix='/api/v1')
+
+    @bp.errorhandler(ApiError)
+    def api_error(exc):
+        return jsonify(error=exc.message), exc.status
+
+    @bp.errorhandler(passwords.HasherBusy)
+    def hasher_busy(exc):
+        return jsonify(error="server busy"), 503, {'Retry-After': '2'}
+
+    def json_body():
+        data = request.get_json(silent=True)
+        if data is None:
+            raise ApiError(400, "request body must be JSON")
+        return data
+
+    def token_required(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+            if scheme.lower() != 'bearer' or not token.strip():
+                raise ApiError(401, "missing bearer token")
+            user = db_factory().get_api_token_user(token_hash(token.strip()))
+            if user is None:
+                raise ApiError(401, "invalid or revoked token")
+            g.api_user = user
+            return view(*args, **kwargs)
+        return wrapper
+
+    # TOKENS
+
+    @bp.route('/tokens', methods=['POST'])
+    def create_token():
+        data = json_body()
+        email = str(data.get('email') or '').strip()
+        retry_after = ratelimit.check(('login_ip', request.remote_addr), ('login_email', email))
+        if retry_after:
+            return jsonify(error="too many attempts"), 429, {'Retry-After': str(retry_after)}
+
+        db = db_factory()
+        success, result = db.login_user(email, data.get('password') or '')
+        if not success:
+            raise ApiError(401, result)
+        token = secrets.token_urlsafe(32)
+        name = str(data.get('name') or 'api')[:100]
+        token_id = db.create_api_token(result['id'], name, token_hash(token))
+        return jsonify(id=token_id, token=token, name=name), 201
+
+    @bp.route('/tokens/current', methods=['DELETE'])
+    @token_required
+    def revoke_token():
+        db_factory().revoke_api_token(g.api_user['token_id'], g.api_user['user_id'])
+        return '', 204
+
+    # LOGS
+
+    @bp.route('/logs', methods=['GET'])
+    @token_required
+    def list_logs():
+        user = g.api_user
+        db = db_factory()
+        args = request.args
+
+        user_id = args.get('user_id', user['user_id'], type=int)
+        if user_id != user['user_id']:
+            # Same rule as the dashboard: admin sees everyone, senior normal users
+            target = db.get_user_by_id(user_id)
+            allowed = target is not None and (
+                user['role'] == 'admin' or (user['role'] == 'senior' and target['role'] == 'user')
+            )
+            if not allowed:
+                raise ApiError(403, "not allowed to view this user's logs")
+
+        per_page = args.get('per_page', 25, type=int)
+        if per_page not in API_PAGE_SIZES:
+            raise ApiError(400, f"per_page must be one of {', '.join(map(str, API_PAGE_SIZES))}")
+        dates = {
+            name: _parse_date(args[name], name) if args.get(name) else None
+            for name in ('before', 'after', 'date_from', 'date_to')
+        }
+        logs, newer, older = db.get_logs_page(user_id, page_size=per_page, **dates)
+        return jsonify(
+            logs=[log._asdict() for log in logs],
+            newer=newer,
+            older=older,
+        )
+
+    def create_one(db, user, data):
+        clock_in, clock_out, work_date, task_description = parse_log_fields(data)
+        result = db.add_log(user['user_id'], clock_in, clock_out, work_date, task_description)
+        if result == "duplicate":
+            raise ApiError(409, "a log for this date already exists")
+        if result == "archived":
+            raise ApiError(409, "this year is archived")
+        if result != "success":
+            raise ApiError(500, "could not add log")
+        log = db.get_log_rows(user['user_id'], limit=1, date_from=work_date, date_to=work_date)
+        return log[0]._asdict() if log else None
+
+    def update_one(db, user, log_id, data):
+        clock_in, clock_out, work_date, task_description = parse_log_fields(data)
+        result = db.update_log(log_id, user['user_id'], clock_in, clock_out, work_date,
+                               task_description, user['role'])
+        if result == "duplicate":
+            raise ApiError(409, "a log for this date already exists")
+        if result == "archived":
+            raise ApiError(409, "this year is archived")
+        if result != "success":
+            # update_log does not tell a missing row from a forbidden one
+            raise ApiError(404, "log not found")
+        return {'id': log_id}
+
+    def delete_one(db, user, log_id):
+        if not db.delete_log(log_id, user['user_id'], user['role']):
+            raise ApiError(404, "log not found")
+        return {'id': log_id}
+
+    @bp.route('/logs', methods=['POST'])
+    @token_required
+    def create_log():
+        return jsonify(log=create_one(db_factory(), g.api_user, json_body())), 201
+
+    @bp.route('/logs/<int:log_id>', methods=['PUT'])
+    @token_required
+    def update_log(log_id):
+        return jsonify(log=update_one(db_factory(), g.api_user, log_id, json_body()))
+
+    @bp.route('/logs/<int:log_id>', methods=['DELETE'])
+    @token_required
+    def delete_log(log_id):
+        delete_one(db_factory(), g.api_user, log_id)
+        return '', 204
+
+    @bp.route('/logs/batch', methods=['POST'])
+    @token_required
+    def batch():
+        """
+        {"operations": [{"op": "create", "log": {...}},
+                        {"op": "update", "id": 7, "log": {...}},
+                        {"op": "delete", "id": 9}],
+         "atomic": false}
+
+        :return: {"results": [{"index", "op", "status", "log" | "error"}],
+                  "committed": bool}; HTTP 200 even when items fail
+        """
+        data = json_body()
+        operations = data.get('operations') if isinstance(data, dict) else None
+        if not isinstance(operations, list) or not operations:
+            raise ApiError(400, "operations must be a non-empty list")
+        if len(operations) > BATCH_MAX_OPERATIONS:
+            raise ApiError(413, f"at most {BATCH_MAX_OPERATIONS} operations per batch")
+        atomic = bool(data.get('atomic'))
+
+        db = db_factory()
+        user = g.api_user
+        results = []
+        try:
+            with db.transaction():
+                for index, item in enumerate(operations):
+                    op = item.get('op') if isinstance(item, dict) else None
+                    result = {'index': index, 'op': op}
+                    try:
+                        if op == 'create':
+                            log = create_one(db, user, item.get('log'))
+                        elif op == 'update':
+                            log = update_one(db, user, _item_id(item), item.get('log'))
+                        elif op == 'delete':
+                            log = delete_one(db, user, _item_id(item))
+                        else:
+                            raise ApiError(400, "op must be create, update or delete")
+                        result.update(status=200 if op != 'create' else 201, log=log)
+                    except ApiError as exc:
+                        result.update(status=exc.status, error=exc.message)
+                    results.append(result)
+                if atomic and any(r['status'] >= 400 for r in results):
+                    raise _BatchAborted()
+        except _BatchAborted:
+            return jsonify(results=results, committed=False), 409
+        return jsonify(results=results, committed=True)
+
+    # PUNCHES
+
+    @bp.route('/punches', methods=['POST'])
+    @token_required
+    def punch():
+        if punch_buffer is None:
+            raise ApiError(404, "punch ingest is not enabled")
+        data = json_body()
+        if not isinstance(data, dict):
+            raise ApiError(400, "expected a JSON object")
+        items = data.get('punches', [data])
+        if not isinstance(items, list) or not items:
+            raise ApiError(400, "punches must be a non-empty list")
+        if len(items) > BATCH_MAX_OPERATIONS:
+            raise ApiError(413, f"at most {BATCH_MAX_OPERATIONS} punches per request")
+
+        now = datetime.now()
+        source = str(data.get('source') or '')[:100] or None
+        rows = [parse_punch(item, g.api_user, now) + (source,) for item in items]
+        try:
+            punch_buffer.submit(rows)
+        except punches.PunchNotCommitted:
+            return jsonify(error="punch not recorded, retry"), 503, {'Retry-After': '1'}
+        return jsonify(accepted=len(rows)), 202
+
+    return bp
+
+
+def _item_id(item):
+    try:
+        return int(item['id'])
+    except (KeyError, TypeError, ValueError):
+        raise ApiError(400, "id must be an integer")
@@ -1,53 +1,275 @@
 from datetime import date, datetime, timedelta
-from email.message import EmailMessage
+from functools import wraps
+import hmac
+import io
+import logging
 import os
-import smtplib
-from flask import Flask, render_template, request, redirect, url_for, flash, session
-from db import DatabaseManager
+import time
+from flask import (
+    Flask, render_template, request, redirect, url_for, flash, session, g, jsonify,
+    Response
+)
+from db import (
+    DatabaseManager, init_pool, init_replicas, get_pool as initialized_pool,
+    get_replicas as initialized_replicas
+)
+from statements import registry as statements
+from api import create_api
+import exporter
+import httpcache
+import importer
+import jobs
+import mailer
+import passwords
+import punches
+import ratelimit
+import sessions
+from metrics import registry as metrics
 
 app = Flask(__name__)
-app.secret_key = "secret"
+logger = logging.getLogger('worklog.app')
+app.secret_key = os.getenv('SECRET_KEY', "secret")
+# Static URLs carry a content hash (asset_url), so browsers may keep them a year
+app.config['SEND_FILE_MAX_AGE_DEFAULT'] = httpcache.STATIC_MAX_AGE
+
+DB_CONFIG = {
+    'host': "localhost",
+    'dbname': "log_tracker",   # MUST MATCH
+    'user': "postgres",
+    'password': "pyp123",
+}
+
+POOL_CONFIG = {
+    'minconn': int(os.getenv('DB_POOL_MIN', 1)),
+    'maxconn': int(os.getenv('DB_POOL_MAX', 10)),
+    'timeout': float(os.getenv('DB_POOL_TIMEOUT', 5)),
+}
+
+# Read replicas for dashboard / search / report reads, ';'-separated libpq
+# strings; settings they leave out come from DB_CONFIG:
+#   DB_REPLICAS="host=replica1;host=replica2 port=5433"
+REPLICA_DSNS = [dsn.strip() for dsn in os.getenv('DB_REPLICAS', '').split(';') if dsn.strip()]
 
 #DB helper
+def get_pool():
+    return init_pool(**POOL_CONFIG, **DB_CONFIG)
+
+def get_replicas():
+    if not REPLICA_DSNS:
+        return None
+    return init_replicas(REPLICA_DSNS, defaults=DB_CONFIG,
+                         maxconn=POOL_CONFIG['maxconn'], timeout=POOL_CONFIG['timeout'])
+
 def get_db():
-    return DatabaseManager(
-        host="localhost",
-        dbname="log_tracker",   # MUST MATCH
-        user="postgres",
-        password="pyp123"
-    )
+    """One pooled DatabaseManager per app context, released at teardown."""
+    if 'db' not in g:
+        g.db = DatabaseManager(pool=get_pool(), replicas=get_replicas())
+    return g.db
+
+@app.teardown_appcontext
+def release_db(exc):
+    db = g.pop('db', None)
+    if db is not None:
+        db.close()
+
+# Read-your-writes: after a logged-in user writes, the session keeps the
+# primary's WAL position and replicas only serve them once they replayed it
+@app.before_request
+def pin_reads_to_last_write():
+    if REPLICA_DSNS and session.get('write_lsn'):
+        get_db().min_lsn = session['write_lsn']
+
+@app.after_request
+def remember_write_lsn(response):
+    db = g.get('db')
+    if REPLICA_DSNS and db is not None and db.wrote and 'user_id' in session:
+        session['write_lsn'] = db.write_lsn()
+    return response
+
+# Session data lives in user_sessions; the cookie only holds an opaque id
+app.session_interface = sessions.ServerSideSessionInterface(
+    get_db, lifetime=timedelta(seconds=int(os.getenv('SESSION_LIFETIME', 12 * 3600)))
+)
+
+# JSON API for kiosk / mobile clients (api.py), bearer-token authenticated
+app.register_blueprint(create_api(get_db, punch_buffer=punches.PunchBuffer(get_pool)))
 
 # ------------------------------------------
 
-# SMTP HANDLER
-def send_email(to_email, message, subject):
-
-    EMAIL_ADDRESS = os.getenv('SENDER_EMAIL')
-    EMAIL_PASSWORD = os.getenv('SENDER_PASSWORD')
+# REQUEST INSTRUMENTATION: SQL count/time per request, histograms per route
+
+request_logger = logging.getLogger('worklog.requests')
+
+metrics.describe('http_request_duration_seconds', 'Request latency by endpoint')
+metrics.describe('http_request_db_seconds', 'Time spent in SQL per request, by endpoint')
+metrics.describe('http_request_db_queries', 'SQL statements per request, by endpoint',
+                 buckets=(1, 2, 3, 4, 5, 8, 13, 21, 34, 55, 89))
+metrics.describe('http_request_db_commits', 'COMMITs per request, by endpoint',
+                 buckets=(0, 1, 2, 3, 5, 8))
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    started = g.get('request_started')
+    if started is None:
+        return response
+    endpoint = request.endpoint or 'unmatched'
+    elapsed = time.perf_counter() - started
+    metrics.observe('http_request_duration_seconds', elapsed,
+                    {'endpoint': endpoint, 'method': request.method})
+
+    db = g.get('db')
+    queries = db.query_stats if db is not None else {'count': 0, 'seconds': 0.0, 'commits': 0, 'statements': []}
+    metrics.observe('http_request_db_seconds', queries['seconds'], {'endpoint': endpoint})
+    metrics.observe('http_request_db_queries', queries['count'], {'endpoint': endpoint})
+    metrics.observe('http_request_db_commits', queries['commits'], {'endpoint': endpoint})
+
+    response.headers['Server-Timing'] = (
+        f'db;dur={queries["seconds"] * 1000:.1f};desc="{queries["count"]} queries", '
+        f'app;dur={elapsed * 1000:.1f}'
+    )
+    if request_logger.isEnabledFor(logging.DEBUG):
+        request_logger.debug(
+            "%s %s -> %s in %.1fms, %d queries / %.1fms, %d commits: %s",
+            request.method, request.path, response.status_code, elapsed * 1000,
+            queries['count'], queries['seconds'] * 1000, queries['commits'],
+            ", ".join(f"{m} {t * 1000:.1f}ms" for m, t in queries['statements'])
+        )
+    return response
+
+# HTTP CACHING / COMPRESSION (httpcache.py)
+
+@app.template_global()
+def asset_url(filename):
+    """Versioned URL of a file in static/, safe to cache forever."""
+    return httpcache.static_url(url_for, app.static_folder, filename)
+
+@app.after_request
+def cache_and_compress(response):
+    if request.endpoint == 'static' and 'v' in request.args:
+        response.headers['Cache-Control'] = f'public, max-age={httpcache.STATIC_MAX_AGE}, immutable'
+
+    response.vary.add('Accept-Encoding')
+    if (response.direct_passthrough or response.is_streamed or response.status_code != 200
+            or 'Content-Encoding' in response.headers):
+        return response
+    encoding = httpcache.choose_encoding(request.accept_encodings)
+    if encoding and httpcache.compressible(response.mimetype, response.content_length or 0):
+        response.set_data(httpcache.compress(response.get_data(), encoding))
+        response.headers['Content-Encoding'] = encoding
+        if response.headers.get('ETag'):
+            # Same entity, different bytes: keep validators weak
+            etag, _ = response.get_etag()
+            response.set_etag(etag, weak=True)
+    return response
+
+def pool_gauges():
+    pool = initialized_pool()
+    if pool is None:
+        return
+    stats = pool.stats()
+    for key in ('size', 'idle', 'in_use', 'waiting', 'maxconn'):
+        yield f'db_pool_{key}', 'gauge', {}, stats[key]
+    for key in ('checkouts', 'timeouts', 'health_check_failures'):
+        yield f'db_pool_{key}_total', 'counter', {}, stats[key]
+
+metrics.register_collector(pool_gauges)
+
+def replica_gauges():
+    replicas = initialized_replicas()
+    for stats in replicas.stats() if replicas is not None else ():
+        labels = {'replica': stats['name']}
+        yield 'db_replica_healthy', 'gauge', labels, int(stats['healthy'])
+        for key in ('size', 'in_use'):
+            yield f'db_replica_pool_{key}', 'gauge', labels, stats[key]
+
+metrics.register_collector(replica_gauges)
+
+def statement_counters():
+    for name, stats in statements.stats().items():
+        yield 'db_statement_executions_total', 'counter', {'statement': name}, stats['executions']
+
+metrics.register_collector(statement_counters)
+
+def hashing_gauges():
+    stats = passwords.default_pool().stats
+    yield 'password_hash_in_flight', 'gauge', {}, stats['in_flight']
+    for key in ('completed', 'rejected', 'timeouts'):
+        yield f'password_hash_{key}_total', 'counter', {}, stats[key]
+
+metrics.register_collector(hashing_gauges)
+
+@app.errorhandler(passwords.HasherBusy)
+def hasher_busy(exc):
+    # Registration / password reset under a login storm: shed load, don't queue
+    return "Server busy, please try again in a moment.", 503, {'Retry-After': '2'}
 
-    msg = EmailMessage()
-    msg['Subject'] = subject
-    msg['From'] = EMAIL_ADDRESS
-    msg['To'] = to_email
-    
-    msg.set_content(message)
+# ------------------------------------------
 
-    with smtplib.SMTP_SSL('smtp.gmail.com', 465) as smtp:
-        smtp.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-        smtp.send_message(msg)
-        print(f"OTP is send to {to_email}")
+# EMAIL: queued here, delivered in the background by mailer.MailWorker
+def send_email(to_email, message, subject):
+    db = get_db()
+    db.enqueue_email(to_email, subject, message)
+    # Inside db.transaction() the row is only visible to workers after COMMIT
+    db.on_commit(mailer.notify)
+
+# RATE LIMITS: checked before any DB or hashing work
+
+def rate_limited(*hits):
+    """Charge the (rule, identity) buckets; flash and return Retry-After seconds if over."""
+    retry_after = ratelimit.check(*hits)
+    if retry_after:
+        flash(f"Too many attempts. Please try again in {retry_after} seconds.", "danger")
+    return retry_after
+
+# OPS ENDPOINTS: admins only, or a scraper sending Authorization: Bearer $OPS_TOKEN
+OPS_TOKEN = os.getenv('OPS_TOKEN')
+
+def ops_only(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        auth = request.headers.get('Authorization', '')
+        if OPS_TOKEN and auth.startswith('Bearer ') and hmac.compare_digest(auth[7:].encode(), OPS_TOKEN.encode()):
+            return view(*args, **kwargs)
+        if session.get('user_role') == 'admin':
+            return view(*args, **kwargs)
+        return "Forbidden", 403
+    return wrapper
 
 # -----------------------------------------------------------------------------------
 
+@app.route('/pool/stats')
+@ops_only
+def pool_stats():
+    stats = get_pool().stats()
+    if get_replicas() is not None:
+        stats['replicas'] = get_replicas().stats()
+    return jsonify(stats)
+
+@app.route('/db/statements')
+@ops_only
+def statement_stats():
+    """Prepared statement registry, plus the plan cache of one pooled connection."""
+    return jsonify(statements=statements.stats(), connection=get_db().get_prepared_statements())
+
+@app.route('/metrics')
+@ops_only
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/')
+@httpcache.cache_anonymous
 def home():
     return render_template('home.html')
 
 # ================= REGISTER =================
 
 @app.route('/register', methods=['GET', 'POST'])
+@httpcache.cache_anonymous
 def register():
-    db = DatabaseManager()
     message = None
 
     # Default to step 1
@@ -61,13 +283,21 @@ def register():
             email = request.form.get('email')
             password = request.form.get('password')
 
+            # Either branch below sends an OTP email
+            retry_after = rate_limited(('otp_send_ip', request.remote_addr), ('otp_send_email', email))
+            if retry_after:
+                return render_template('register.html', step=1, message=None), 429, {'Retry-After': str(retry_after)}
+
+            db = get_db()
             if db.email_exists(email):
                 verified = db.is_verified(email)
                 if not verified:
                     user = db.get_user_by_email(email)
-                    otp = db.generate_otp(user['id'], purpose='verify_email')
-                    send_email(email, f"Your OTP is {otp}. It expires in 10 minutes.", "Email Verification OTP")
+                    with db.transaction():
+                        otp = db.generate_otp(user['id'], purpose='verify_email')
+                        send_email(email, f"Your OTP is {otp}. It expires in 10 minutes.", "Email Verification OTP")
                     session['email'] = email
+                    session['register_user_id'] = user['id']
                     session['step'] = 2
                     flash('OTP sent to your registered email.', 'success')
                     return redirect(url_for('register'))
@@ -76,12 +306,15 @@ def register():
                     return redirect(url_for('login'))
 
             else:
-                success, result = db.register_user(username, email, password)
+                # User row, OTP and outbox message: one transaction, one commit
+                with db.transaction():
+                    success, result = db.register_user(username, email, password)
+                    if success:
+                        otp = db.generate_otp(result['id'], purpose='verify_email')
+                        send_email(email, f"Your OTP is {otp}. It expires in 10 minutes.", "User Registration OTP")
                 if success:
-                    user = db.get_user_by_email(email)
-                    otp = db.generate_otp(user['id'], purpose='verify_email')
-                    send_email(email, f"Your OTP is {otp}. It expires in 10 minutes.", "User Registration OTP")
                     session['email'] = email
+                    session['register_user_id'] = result['id']
                     session['step'] = 2
                     flash('OTP sent to your registered email.', 'success')
                     return redirect(url_for('register'))
@@ -90,16 +323,27 @@ def register():
 
         elif step == 2:
             email = session.get('email')
-            if not email:
+            user_id = session.get('register_user_id')
+            if not email or not user_id:
                 flash("Session expired. Please start again.", "danger")
                 return redirect(url_for('register'))
 
-            user = db.get_user_by_email(email)
             action = request.form.get('action', 'verify')
+            if action == 'resend':
+                retry_after = rate_limited(('otp_send_ip', request.remote_addr), ('otp_send_email', email))
+            else:
+                # Same key as the password reset flow: one OTP budget per account
+                retry_after = rate_limited(('otp_verify_user', user_id))
+            if retry_after:
+                return render_template('register.html', step=2, message=None), 429, {'Retry-After': str(retry_after)}
+
+            db = get_db()
+            user = db.get_user_by_email(email)
 
             if action == 'resend':
-                otp = db.generate_otp(user['id'], purpose='verify_email')
-                send_email(email, f"Your new OTP is {otp}", "Resend OTP")
+                with db.transaction():
+                    otp = db.generate_otp(user['id'], purpose='verify_email')
+                    send_email(email, f"Your new OTP is {otp}", "Resend OTP")
                 flash("OTP resent to your email.", "success")
                 session['step'] = 2
                 return redirect(url_for('register'))
@@ -112,8 +356,9 @@ def register():
                     session['step'] = 2
                     return redirect(url_for('register'))
 
-                db.mark_user_verified(user['id'])
+                # verify_otp(purpose='verify_email') already marked the user verified
                 session.pop('email', None)
+                session.pop('register_user_id', None)
                 session.pop('step', None)
                 flash("Email verified successfully. Please login.", "success")
                 return redirect(url_for('login'))
@@ -130,13 +375,13 @@ def register_back():
 # ================= LOGIN =================
 
 @app.route('/login', methods=['GET', 'POST'])
+@httpcache.cache_anonymous
 def login():
 
     # # If already logged in
     # if 'user_id' in session:
     #     return redirect(url_for('dashboard'))
 
-    db = get_db()
     step = session.get('step')  # None, forgot_email, forgot_otp, forgot_reset
 
     # -------------------- GET --------------------
@@ -155,7 +400,16 @@ def login():
         email = request.form.get('email')
         password = request.form.get('password')
 
-        success, result = db.login_user(email, password)
+        retry_after = rate_limited(('login_ip', request.remote_addr), ('login_email', email))
+        if retry_after:
+            return render_template('login.html', step=None), 429, {'Retry-After': str(retry_after)}
+
+        db = get_db()
+        try:
+            success, result = db.login_user(email, password)
+        except passwords.HasherBusy:
+            flash("Server busy, please try again in a moment.", "warning")
+            return render_template('login.html', step=None), 503, {'Retry-After': '2'}
 
         if not success:
             flash(result, "danger")
@@ -175,6 +429,11 @@ def login():
     elif step == 'forgot_email':
         email = request.form.get('email')
 
+        retry_after = rate_limited(('otp_send_ip', request.remote_addr), ('otp_send_email', email))
+        if retry_after:
+            return render_template('login.html', step=step), 429, {'Retry-After': str(retry_after)}
+
+        db = get_db()
         user = db.get_user_by_email(email)
         if not user:
             flash("Email not registered", "danger")
@@ -184,12 +443,12 @@ def login():
         session['reset_user_id'] = user['id']
         session['reset_email'] = user['email']
 
-        otp = db.generate_otp(user['id'], purpose='reset_password')
-
+        with db.transaction():
+            otp = db.generate_otp(user['id'], purpose='reset_password')
 
-        subject = "Password Reset OTP"
-        message = f"Your OTP is {otp}. It expires in 10 minutes."
-        send_email(email, message, subject)
+            subject = "Password Reset OTP"
+            message = f"Your OTP is {otp}. It expires in 10 minutes."
+            send_email(email, message, subject)
 
         session['step'] = 'forgot_otp'
         flash("OTP sent to your email", "success")
@@ -205,8 +464,11 @@ def login():
             session.pop('step', None)
             return redirect(url_for('login'))
 
+        retry_after = rate_limited(('otp_verify_user', user_id))
+        if retry_after:
+            return render_template('login.html', step=step), 429, {'Retry-After': str(retry_after)}
 
-        is_verified, message = db.verify_otp(
+        is_verified, message = get_db().verify_otp(
             user_id=session['reset_user_id'],
             input_otp=user_otp,
             purpose='reset_password'
@@ -228,7 +490,7 @@ def login():
         password = request.form.get('password')
         email = session.get('reset_email')
 
-        success, message = db.update_user_password(email, password)
+        success, message = get_db().update_user_password(email, password)
 
         # Clear reset session
         session.pop('reset_user_id', None)
@@ -243,13 +505,34 @@ def login():
 #------------Logour route----------
 @app.route('/logout', methods=['GET', 'POST'])
 def logout():
-    session.pop('user_id', None)
-    session.pop('user_role', None)
-    session.pop('username', None)
-    session.pop('email', None)
+    # Drops the server-side row too, so the old cookie is dead everywhere
+    session.clear()
     flash('Logout successfully!', 'success')
     return redirect(url_for('home'))
 
+PAGE_SIZES = (10, 25, 50, 100)
+DEFAULT_PAGE_SIZE = 25
+
+def parse_date_arg(name, args=None):
+    """Read a YYYY-MM-DD query arg, ignoring anything malformed."""
+    args = request.args if args is None else args
+    value = args.get(name, '').strip()
+    try:
+        return date.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+@app.template_global()
+def url_with_args(**overrides):
+    """Current URL with some query args replaced (None removes the arg)."""
+    args = request.args.to_dict()
+    for key, value in overrides.items():
+        if value is None:
+            args.pop(key, None)
+        else:
+            args[key] = value
+    return url_for(request.endpoint, **args)
+
 @app.route('/dashboard', methods=['GET', 'POST'])
 def dashboard():
     
@@ -261,7 +544,7 @@ def dashboard():
 
     user_id = session['user_id']
     user_role = session['user_role']
-    db = DatabaseManager()
+    db = get_db()
 
     
     # Handle New Log Entry (Normal User)
@@ -285,75 +568,93 @@ def dashboard():
             flash("Log added successfully!", 'success')
         elif result == "duplicate":
             flash("A log for this date already exists!", 'warning')
+        elif result == "archived":
+            flash("That year is archived and can no longer be changed.", 'warning')
         else:
             flash("Error adding log. Check date/time format.", 'danger')
 
         return redirect(url_for('dashboard'))
 
 
-    # Fetch Personal Logs
-    
-    personal_logs = db.get_logs(user_id=user_id)
+    # Paging / filter controls (GET query args)
 
-    # Senior / Admin Handling
+    per_page = request.args.get('per_page', DEFAULT_PAGE_SIZE, type=int)
+    if per_page not in PAGE_SIZES:
+        per_page = DEFAULT_PAGE_SIZE
+    date_from = parse_date_arg('date_from')
+    date_to = parse_date_arg('date_to')
 
-    users_list = []
-    target_user_logs = []
-    target_username = None
+    # Selected user (senior/admin): form POST or paging link GET
 
+    target_user_id = None
     if user_role in ['senior', 'admin']:
-        # Step 1: Fetch users list
-        if user_role == 'admin':
-            # Admin sees all users
-            users_list = db.list_users(requester_role=user_role)
-        else:
-            # Senior sees only 'user' role
-            users_list = db.get_users_by_role(requester_role=user_role, role='user')
-
-        # Step 2: Handle selected user
-        if request.method == 'POST' and 'user_id' in request.form:
+        selected = request.form.get('user_id') if request.method == 'POST' else request.args.get('user_id')
+        if selected:
             try:
-                target_user_id = int(request.form['user_id'])
-
-                # Step 2a: Fetch logs based on requester role
-                if user_role == 'admin':
-                    # Admin can see logs of all users
-                    target_user_logs = db.get_logs(user_id=target_user_id)
-                else:
-                    # Senior can only see normal user logs
-                    if any(u['id'] == target_user_id for u in users_list):
-                        target_user_logs = db.get_logs(user_id=target_user_id)
-                    else:
-                        flash("You are not allowed to view this user's logs.", 'danger')
-                        target_user_logs = []
-
-                # Step 2b: Fetch selected username
-                target_user = next((u for u in users_list if u['id'] == target_user_id), None)
-                if target_user:
-                    target_username = target_user['username']
-
+                target_user_id = int(selected)
             except ValueError:
                 flash("Invalid user selection.", 'danger')
 
+    # Conditional GET: nothing on the page changed since the browser's copy.
+    # Skipped while flash messages are pending (they render once). The stamp
+    # is its own cheap statement so a 304 never pays for load_dashboard; a
+    # full render is therefore two statements (tests/test_dashboard_queries.py).
 
-    # Fetch current logged-in username
-    
-    db.cursor.execute("SELECT username FROM users WHERE id = %s", (user_id,))
-    row = db.cursor.fetchone()
-    current_username = row['username'] if row else ''
+    etag = None
+    if request.method == 'GET' and '_flashes' not in session:
+        stamp = db.get_dashboard_stamp(
+            [uid for uid in (user_id, target_user_id) if uid is not None]
+        )
+        etag = httpcache.dashboard_etag(stamp, user_id, user_role, target_user_id,
+                                        request.query_string.decode(), date.today())
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+            response.set_etag(etag, weak=True)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+
+    # Everything the page shows, in one round trip
+
+    data = db.load_dashboard(
+        user_id=user_id,
+        user_role=user_role,
+        page_size=per_page,
+        before=parse_date_arg('before'),
+        after=parse_date_arg('after'),
+        date_from=date_from,
+        date_to=date_to,
+        target_user_id=target_user_id,
+        target_before=parse_date_arg('u_before'),
+        target_after=parse_date_arg('u_after')
+    )
+    if target_user_id is not None and not data.target_allowed:
+        # Admin can see logs of all users, senior only normal user logs
+        flash("You are not allowed to view this user's logs.", 'danger')
+        etag = None
 
-        
-    # Render Template
-    
-    return render_template(
+    response = app.make_response(render_template(
         'dashboard.html',
-        user={'username': current_username},
+        user={'username': session.get('username') or data.username},
         user_role=user_role,
-        logs=personal_logs,
-        users=users_list,
-        selected_user_logs=target_user_logs,
-        selected_user_name=target_username
-    )
+        logs=data.logs,
+        selected_user_logs=data.target_logs,
+        selected_user_name=data.target_username,
+        selected_user_id=target_user_id,
+        per_page=per_page,
+        page_sizes=PAGE_SIZES,
+        date_from=date_from,
+        date_to=date_to,
+        newer=data.newer,
+        older=data.older,
+        selected_newer=data.target_newer,
+        selected_older=data.target_older
+    ))
+    if etag is not None:
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'private, no-cache'
+    else:
+        response.headers['Cache-Control'] = 'no-store'
+    return response
 
 # DELETE LOG (POST only)
 @app.route('/logs/delete/<int:log_id>', methods=['POST'])
@@ -369,8 +670,10 @@ def delete_log(log_id):
         flash("Please login first!", 'danger')
         return redirect(url_for('login'))
 
-    db = DatabaseManager()
-    success = db.delete_log(log_id, session['user_id'], session['user_role'])
+    db = get_db()
+    # The log's date (hidden form field) lets Postgres prune to one partition
+    log_date = parse_date_arg('log_date', request.form)
+    success = db.delete_log(log_id, session['user_id'], session['user_role'], log_date=log_date)
 
     if success:
         flash("Log deleted successfully!", 'success')
@@ -400,8 +703,9 @@ def update_log(log_id):
         flash("Invalid date format!", 'danger')
         return redirect(url_for('dashboard'))
 
-    db = DatabaseManager()
-    log = db.get_log_by_id(log_id)
+    db = get_db()
+    log_date = parse_date_arg('log_date', request.form)
+    log = db.get_log_by_id(log_id, log_date=log_date)
     if not log:
         flash("Log not found!", 'danger')
         return redirect(url_for('dashboard'))
@@ -414,7 +718,8 @@ def update_log(log_id):
         clock_out,            # string HH:MM
         work_date,
         task_description,
-        session['user_role']
+        session['user_role'],
+        log_date=log_date
     )
 
     # Handle response
@@ -422,11 +727,226 @@ def update_log(log_id):
         flash("Log updated successfully!", 'success')
     elif result == "duplicate":
         flash("A log for this date already exists!", 'warning')
+    elif result == "archived":
+        flash("That year is archived and can no longer be changed.", 'warning')
     else:
         flash("Error updating log. Check date/time format.", 'danger')
 
     return redirect(url_for('dashboard'))
 
 
+# ================= REPORTS =================
+
+REPORT_PERIODS = ('week', 'month')
+REPORT_PAGE_SIZE = 100
+
+def period_end(period, start):
+    if period == 'week':
+        return start + timedelta(days=7)
+    return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+def weekdays_between(start, end):
+    """Mon-Fri days in [start, end)."""
+    days = (end - start).days
+    if days <= 0:
+        return 0
+    full_weeks, extra = divmod(days, 7)
+    first = start.weekday()
+    return full_weeks * 5 + sum(1 for i in range(extra) if (first + i) % 7 < 5)
+
+def format_seconds(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}h {(seconds % 3600) // 60}m"
+
+@app.route('/reports')
+def reports():
+    if 'user_id' not in session:
+        flash("Please login first!", 'danger')
+        return redirect(url_for('login'))
+    user_role = session['user_role']
+    if user_role not in ('senior', 'admin'):
+        flash("Reports are available to seniors and admins only.", 'danger')
+        return redirect(url_for('dashboard'))
+
+    period = request.args.get('period', 'week')
+    if period not in REPORT_PERIODS:
+        period = 'week'
+    today = date.today()
+    date_to = parse_date_arg('date_to') or today
+    date_from = parse_date_arg('date_from') or (today - timedelta(days=90))
+    page = max(request.args.get('page', 1, type=int), 1)
+
+    rows = get_db().get_summary_report(
+        period, date_from, date_to, user_role,
+        limit=REPORT_PAGE_SIZE + 1, offset=(page - 1) * REPORT_PAGE_SIZE
+    )
+    has_next = len(rows) > REPORT_PAGE_SIZE
+
+    report_rows = []
+    for row in rows[:REPORT_PAGE_SIZE]:
+        # Weekdays so far in the period that have no log
+        expected = weekdays_between(row['period_start'], min(period_end(period, row['period_start']), today + timedelta(days=1)))
+        report_rows.append({
+            'username': row['username'],
+            'role': row['role'],
+            'period_start': row['period_start'].isoformat(),
+            'hours': format_seconds(row['total_seconds']),
+            'overtime': format_seconds(row['overtime_seconds']),
+            'days_worked': row['days_worked'],
+            'missing_days': max(expected - row['weekdays_worked'], 0),
+        })
+
+    return render_template(
+        'reports.html',
+        rows=report_rows,
+        period=period,
+        periods=REPORT_PERIODS,
+        date_from=date_from,
+        date_to=date_to,
+        page=page,
+        has_next=has_next
+    )
+
+
+# SEARCH: task descriptions, scoped by role (DatabaseManager.search_logs)
+SEARCH_PAGE_SIZE = 25
+
+@app.route('/search')
+def search():
+    if 'user_id' not in session:
+        flash("Please login first!", 'danger')
+        return redirect(url_for('login'))
+
+    query = request.args.get('q', '').strip()
+    user_id = request.args.get('user_id', type=int)
+    date_from = parse_date_arg('date_from')
+    date_to = parse_date_arg('date_to')
+    page = max(request.args.get('page', 1, type=int), 1)
+
+    rows = []
+    if query:
+        rows = get_db().search_logs(
+            query, session['user_id'], session['user_role'],
+            user_id=user_id, date_from=date_from, date_to=date_to,
+            limit=SEARCH_PAGE_SIZE + 1, offset=(page - 1) * SEARCH_PAGE_SIZE
+        )
+
+    return render_template(
+        'search.html',
+        query=query,
+        rows=rows[:SEARCH_PAGE_SIZE],
+        user_id=user_id,
+        date_from=date_from,
+        date_to=date_to,
+        page=page,
+        has_next=len(rows) > SEARCH_PAGE_SIZE
+    )
+
+
+# USER PICKER: typeahead JSON for the senior/admin user fields on the dashboard
+@app.route('/users/search')
+def user_search():
+    if session.get('user_role') not in ('senior', 'admin'):
+        return jsonify(error="not allowed"), 403
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 25)
+    users = get_db().search_users(request.args.get('q', ''), session['user_role'], limit=limit)
+    response = jsonify(users=users)
+    # Backspacing over a prefix re-asks the same questions
+    response.headers['Cache-Control'] = 'private, max-age=60'
+    return response
+
+# BULK IMPORT (admin only)
+@app.route('/admin/import', methods=['GET', 'POST'])
+def import_logs():
+    if 'user_id' not in session:
+        flash("Please login first!", 'danger')
+        return redirect(url_for('login'))
+    if session.get('user_role') != 'admin':
+        flash("Only admins can import timesheets.", 'danger')
+        return redirect(url_for('dashboard'))
+
+    report = None
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            flash("Choose a CSV file to import.", 'danger')
+            return redirect(url_for('import_logs'))
+
+        stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+        try:
+            report = importer.import_timesheets(get_db(), stream)
+        except Exception:
+            logger.exception("timesheet import failed")
+            flash("Import failed, nothing was saved. Check the CSV header and encoding.", 'danger')
+            return redirect(url_for('import_logs'))
+
+        flash(f"Imported {report['inserted']} of {report['rows']} rows.", 'success')
+
+    return render_template('import.html', report=report)
+
+
+# STREAMING EXPORT (admin only)
+@app.route('/admin/export')
+def export_logs():
+    if 'user_id' not in session:
+        flash("Please login first!", 'danger')
+        return redirect(url_for('login'))
+    if session.get('user_role') != 'admin':
+        flash("Only admins can export timesheets.", 'danger')
+        return redirect(url_for('dashboard'))
+
+    fmt = request.args.get('format', 'csv')
+    if fmt == 'xlsx' and not exporter.XLSX_AVAILABLE:
+        flash("XLSX export is not available on this server, use CSV.", 'warning')
+        return redirect(url_for('dashboard'))
+
+    role = request.args.get('role') or None
+    if role not in (None, 'admin', 'senior', 'user'):
+        role = None
+
+    # The response outlives the app context (teardown releases g.db before
+    # the body is sent), so the export holds its own pooled connection
+    db = DatabaseManager(pool=get_pool(), replicas=get_replicas())
+    rows = db.iter_export_rows(
+        user_id=request.args.get('user_id', type=int),
+        role=role,
+        date_from=parse_date_arg('date_from'),
+        date_to=parse_date_arg('date_to')
+    )
+
+    if fmt == 'xlsx':
+        # Built in full before the response starts; CSV streams row by row
+        try:
+            workbook = exporter.xlsx_file(DatabaseManager.EXPORT_COLUMNS, rows)
+        except exporter.ExportTooLarge as e:
+            flash(f"{e}. Narrow the filters or export CSV instead.", 'warning')
+            return redirect(url_for('dashboard'))
+        finally:
+            rows.close()
+            db.close()
+        chunks, mimetype = exporter.file_chunks(workbook), exporter.XLSX_MIMETYPE
+    else:
+        fmt = 'csv'
+        chunks, mimetype = exporter.csv_chunks(DatabaseManager.EXPORT_COLUMNS, rows), exporter.CSV_MIMETYPE
+
+    def body():
+        try:
+            yield from chunks
+        finally:
+            rows.close()
+            db.close()
+
+    filename = f"timesheets-{date.today().isoformat()}.{fmt}"
+    return Response(
+        body(),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+
 if __name__ == '__main__':
+    # The reloader runs this module twice; only the serving child sends mail
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        mailer.start_workers(get_pool(), count=int(os.getenv('MAIL_WORKERS', 2)))
+        jobs.start_jobs(get_pool())
     app.run(debug=True, host='0.0.0.0', port = 5000)
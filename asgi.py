@@ -0,0 +1,604 @@
+"""
+ASGI deployment: async views for the hot, I/O-bound routes, with everything
+else served by the regular Flask app.
+
+    uvicorn asgi:application --workers 2
+    python mailer.py          # mail workers run as their own process here
+
+The login / logout / registration flows and the dashboard with its
+add/update/delete log routes are Quart views backed by
+async_db.AsyncDatabaseManager, so a worker keeps serving other requests while
+one waits on Postgres. Requests for any other endpoint (reports, admin
+import/export, /metrics, static files) are routed to the Flask app through
+asgiref's WsgiToAsgi. Both apps share templates, the secret key and the
+server-side session store, so a user moves between them transparently.
+
+Extra dependencies: quart, asgiref, psycopg[binary,pool] and an ASGI server
+such as uvicorn.
+"""
+import os
+import time
+from datetime import date, datetime
+
+from asgiref.wsgi import WsgiToAsgi
+from quart import Quart, Response, flash, g, redirect, render_template, request, session, url_for
+from quart.sessions import SessionInterface
+from quart.wrappers.response import DataBody
+from werkzeug.exceptions import HTTPException
+
+import app as wsgi
+import httpcache
+import mailer
+import passwords
+import ratelimit
+import sessions
+from async_db import AsyncDatabaseManager, create_pool
+from metrics import registry as metrics
+
+# Endpoints served by the async views below; all others go to the Flask app
+ASYNC_ENDPOINTS = frozenset({
+    'home', 'register', 'register_back', 'login', 'logout',
+    'dashboard', 'delete_log', 'update_log',
+})
+
+quart_app = Quart(__name__)
+quart_app.secret_key = wsgi.app.secret_key
+
+pool = create_pool(**wsgi.POOL_CONFIG, **wsgi.DB_CONFIG)
+
+
+@quart_app.before_serving
+async def open_pool():
+    await pool.open()
+
+
+@quart_app.after_serving
+async def close_pool():
+    await pool.close()
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Quart twin of sessions.ServerSideSessionInterface, on the async manager."""
+
+    def __init__(self, lifetime):
+        self.store = sessions.SessionStore(lifetime)
+
+    async def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        loaded = self.store.cached(sid) if sid else None
+        if loaded is sessions.UNCACHED:
+            loaded = await get_db().load_session(sessions.sid_key(sid))
+        return self.store.open(sid, loaded)
+
+    async def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        action, expires_at = self.store.plan(session)
+
+        if session.previous_sid:
+            await get_db().delete_session(sessions.sid_key(session.previous_sid))
+        if action == 'delete':
+            if not session.previous_sid:
+                await get_db().delete_session(sessions.sid_key(session.sid))
+            response.delete_cookie(name, domain=domain, path=path)
+        elif action == 'save':
+            await get_db().save_session(sessions.sid_key(session.sid), session.get('user_id'),
+                                        dict(session), expires_at)
+            response.set_cookie(
+                name, session.sid,
+                expires=expires_at if session.permanent else None,
+                httponly=self.get_cookie_httponly(app),
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+                domain=domain, path=path,
+            )
+
+
+quart_app.session_interface = ServerSideSessionInterface(wsgi.app.session_interface.store.lifetime)
+
+
+@quart_app.errorhandler(passwords.HasherBusy)
+async def hasher_busy(exc):
+    return "Server busy, please try again in a moment.", 503, {'Retry-After': '2'}
+
+
+def get_db():
+    """One AsyncDatabaseManager per request, released at teardown."""
+    if 'db' not in g:
+        g.db = AsyncDatabaseManager(pool)
+    return g.db
+
+
+@quart_app.teardown_appcontext
+async def release_db(exc):
+    db = g.pop('db', None)
+    if db is not None:
+        await db.close()
+
+
+@quart_app.before_request
+async def start_timer():
+    g.request_started = time.perf_counter()
+
+
+@quart_app.after_request
+async def record_request(response):
+    started = g.get('request_started')
+    if started is None:
+        return response
+    endpoint = request.endpoint or 'unmatched'
+    elapsed = time.perf_counter() - started
+    metrics.observe('http_request_duration_seconds', elapsed,
+                    {'endpoint': endpoint, 'method': request.method})
+
+    db = g.get('db')
+    queries = db.query_stats if db is not None else {'count': 0, 'seconds': 0.0}
+    metrics.observe('http_request_db_seconds', queries['seconds'], {'endpoint': endpoint})
+    metrics.observe('http_request_db_queries', queries['count'], {'endpoint': endpoint})
+    response.headers['Server-Timing'] = (
+        f'db;dur={queries["seconds"] * 1000:.1f};desc="{queries["count"]} queries", '
+        f'app;dur={elapsed * 1000:.1f}'
+    )
+    return response
+
+
+@quart_app.template_global()
+def url_with_args(**overrides):
+    """Current URL with some query args replaced (None removes the arg)."""
+    args = request.args.to_dict()
+    for key, value in overrides.items():
+        if value is None:
+            args.pop(key, None)
+        else:
+            args[key] = value
+    return url_for(request.endpoint, **args)
+
+
+@quart_app.template_global()
+def asset_url(filename):
+    """Same as app.asset_url: versioned URL of a file in static/."""
+    return httpcache.static_url(url_for, wsgi.app.static_folder, filename)
+
+
+@quart_app.after_request
+async def compress_response(response):
+    response.vary.add('Accept-Encoding')
+    if (not isinstance(response.response, DataBody) or response.status_code != 200
+            or 'Content-Encoding' in response.headers):
+        return response
+    encoding = httpcache.choose_encoding(request.accept_encodings)
+    if encoding and httpcache.compressible(response.mimetype, response.content_length or 0):
+        response.set_data(httpcache.compress(await response.get_data(), encoding))
+        response.headers['Content-Encoding'] = encoding
+        if response.headers.get('ETag'):
+            etag, _ = response.get_etag()
+            response.set_etag(etag, weak=True)
+    return response
+
+
+async def rate_limited(*hits):
+    """Same as app.rate_limited: flash and return Retry-After seconds if over a limit."""
+    retry_after = ratelimit.check(*hits)
+    if retry_after:
+        await flash(f"Too many attempts. Please try again in {retry_after} seconds.", "danger")
+    return retry_after
+
+
+def client_ip():
+    return request.remote_addr
+
+
+async def send_email(to_email, message, subject):
+    db = get_db()
+    await db.enqueue_email(to_email, subject, message)
+    # Inside db.transaction() the row is only visible to workers after COMMIT
+    db.on_commit(mailer.notify)
+
+# -----------------------------------------------------------------------------------
+
+@quart_app.route('/')
+async def home():
+    return await render_template('home.html')
+
+# ================= REGISTER =================
+
+@quart_app.route('/register', methods=['GET', 'POST'])
+async def register():
+    db = get_db()   # connection is only checked out on first query
+    message = None
+    step = session.get('step', 1)
+
+    if request.method == 'POST':
+        form = await request.form
+        step = int(form.get('step', 1))
+
+        if step == 1:
+            username = form.get('username')
+            email = form.get('email')
+            password = form.get('password')
+
+            retry_after = await rate_limited(('otp_send_ip', client_ip()), ('otp_send_email', email))
+            if retry_after:
+                return await render_template('register.html', step=1, message=None), 429, {'Retry-After': str(retry_after)}
+
+            if await db.email_exists(email):
+                if not await db.is_verified(email):
+                    user = await db.get_user_by_email(email)
+                    async with db.transaction():
+                        otp = await db.generate_otp(user['id'], purpose='verify_email')
+                        await send_email(email, f"Your OTP is {otp}. It expires in 10 minutes.", "Email Verification OTP")
+                    session['email'] = email
+                    session['register_user_id'] = user['id']
+                    session['step'] = 2
+                    await flash('OTP sent to your registered email.', 'success')
+                    return redirect(url_for('register'))
+                else:
+                    await flash("User already registered and verified. Please login.", "info")
+                    return redirect(url_for('login'))
+
+            else:
+                # User row, OTP and outbox message: one transaction, one commit
+                async with db.transaction():
+                    success, result = await db.register_user(username, email, password)
+                    if success:
+                        otp = await db.generate_otp(result['id'], purpose='verify_email')
+                        await send_email(email, f"Your OTP is {otp}. It expires in 10 minutes.", "User Registration OTP")
+                if success:
+                    session['email'] = email
+                    session['register_user_id'] = result['id']
+                    session['step'] = 2
+                    await flash('OTP sent to your registered email.', 'success')
+                    return redirect(url_for('register'))
+                else:
+                    message = result
+
+        elif step == 2:
+            email = session.get('email')
+            user_id = session.get('register_user_id')
+            if not email or not user_id:
+                await flash("Session expired. Please start again.", "danger")
+                return redirect(url_for('register'))
+
+            action = form.get('action', 'verify')
+            if action == 'resend':
+                retry_after = await rate_limited(('otp_send_ip', client_ip()), ('otp_send_email', email))
+            else:
+                # Same key as the password reset flow: one OTP budget per account
+                retry_after = await rate_limited(('otp_verify_user', user_id))
+            if retry_after:
+                return await render_template('register.html', step=2, message=None), 429, {'Retry-After': str(retry_after)}
+
+            user = await db.get_user_by_email(email)
+
+            if action == 'resend':
+                async with db.transaction():
+                    otp = await db.generate_otp(user['id'], purpose='verify_email')
+                    await send_email(email, f"Your new OTP is {otp}", "Resend OTP")
+                await flash("OTP resent to your email.", "success")
+                session['step'] = 2
+                return redirect(url_for('register'))
+
+            elif action == 'verify':
+                is_verified, message = await db.verify_otp(user['id'], form.get('otp'), purpose='verify_email')
+                if not is_verified:
+                    await flash(message, "danger")
+                    session['step'] = 2
+                    return redirect(url_for('register'))
+
+                # verify_otp(purpose='verify_email') already marked the user verified
+                session.pop('email', None)
+                session.pop('register_user_id', None)
+                session.pop('step', None)
+                await flash("Email verified successfully. Please login.", "success")
+                return redirect(url_for('login'))
+
+    return await render_template('register.html', step=step, message=message)
+
+
+@quart_app.route('/register/back')
+async def register_back():
+    session['step'] = 1
+    return redirect(url_for('register'))
+
+# ================= LOGIN =================
+
+@quart_app.route('/login', methods=['GET', 'POST'])
+async def login():
+    db = get_db()
+    step = session.get('step')  # None, forgot_email, forgot_otp, forgot_reset
+
+    if request.method == 'GET':
+        if request.args.get('forgot') == '1':
+            session['step'] = 'forgot_email'
+            step = 'forgot_email'
+        return await render_template('login.html', step=step)
+
+    form = await request.form
+
+    # ========== NORMAL LOGIN ==========
+    if step is None:
+        retry_after = await rate_limited(('login_ip', client_ip()), ('login_email', form.get('email')))
+        if retry_after:
+            return await render_template('login.html', step=None), 429, {'Retry-After': str(retry_after)}
+
+        try:
+            success, result = await db.login_user(form.get('email'), form.get('password'))
+        except passwords.HasherBusy:
+            await flash("Server busy, please try again in a moment.", "warning")
+            return await render_template('login.html', step=None), 503, {'Retry-After': '2'}
+        if not success:
+            await flash(result, "danger")
+            return await render_template('login.html', step=None)
+
+        session.clear()
+        session['user_id'] = result['id']
+        session['username'] = result['username']
+        session['email'] = result['email']
+        session['user_role'] = result['role']
+
+        await flash("Login successful 🎉", "success")
+        return redirect(url_for('dashboard'))
+
+    # ========== FORGOT PASSWORD : EMAIL ==========
+    elif step == 'forgot_email':
+        email = form.get('email')
+        retry_after = await rate_limited(('otp_send_ip', client_ip()), ('otp_send_email', email))
+        if retry_after:
+            return await render_template('login.html', step=step), 429, {'Retry-After': str(retry_after)}
+
+        user = await db.get_user_by_email(email)
+        if not user:
+            await flash("Email not registered", "danger")
+            return redirect(url_for('login'))
+
+        session['reset_user_id'] = user['id']
+        session['reset_email'] = user['email']
+
+        async with db.transaction():
+            otp = await db.generate_otp(user['id'], purpose='reset_password')
+            await send_email(email, f"Your OTP is {otp}. It expires in 10 minutes.", "Password Reset OTP")
+
+        session['step'] = 'forgot_otp'
+        await flash("OTP sent to your email", "success")
+        return redirect(url_for('login'))
+
+    # ========== FORGOT PASSWORD : OTP ==========
+    elif step == 'forgot_otp':
+        user_id = session.get('reset_user_id')
+        if not user_id:
+            await flash("Session expired. Please try again.", "danger")
+            session.pop('step', None)
+            return redirect(url_for('login'))
+
+        retry_after = await rate_limited(('otp_verify_user', user_id))
+        if retry_after:
+            return await render_template('login.html', step=step), 429, {'Retry-After': str(retry_after)}
+
+        is_verified, message = await db.verify_otp(user_id, form.get('otp'), purpose='reset_password')
+        if not is_verified:
+            await flash(message, "danger")
+            session['step'] = 'forgot_otp'
+            return redirect(url_for('login'))
+
+        session['step'] = 'forgot_reset'
+        await flash("OTP verified successfully", "success")
+        return redirect(url_for('login'))
+
+    # ========== FORGOT PASSWORD : RESET ==========
+    elif step == 'forgot_reset':
+        await db.update_user_password(session.get('reset_email'), form.get('password'))
+
+        session.pop('reset_user_id', None)
+        session.pop('reset_email', None)
+        session.pop('step', None)
+
+        await flash("Password reset successful. Please login.", "success")
+        return redirect(url_for('login'))
+
+    return redirect(url_for('login'))
+
+
+@quart_app.route('/logout', methods=['GET', 'POST'])
+async def logout():
+    session.clear()
+    await flash('Logout successfully!', 'success')
+    return redirect(url_for('home'))
+
+# ================= DASHBOARD =================
+
+@quart_app.route('/dashboard', methods=['GET', 'POST'])
+async def dashboard():
+    if 'user_id' not in session:
+        await flash("Please login first!", 'danger')
+        return redirect(url_for('login'))
+
+    user_id = session['user_id']
+    user_role = session['user_role']
+    db = get_db()
+    form = await request.form if request.method == 'POST' else {}
+
+    # Handle New Log Entry (Normal User)
+    if 'work_date' in form and 'user_id' not in form:
+        work_date = datetime.strptime(form['work_date'], '%Y-%m-%d').date()
+        if work_date > date.today():
+            await flash("Future dates are not allowed!", 'danger')
+            return redirect(url_for('dashboard'))
+
+        result = await db.add_log(
+            user_id, form.get('clock_in'), form.get('clock_out'), work_date, form.get('task_description')
+        )
+        if result == "success":
+            await flash("Log added successfully!", 'success')
+        elif result == "duplicate":
+            await flash("A log for this date already exists!", 'warning')
+        elif result == "archived":
+            await flash("That year is archived and can no longer be changed.", 'warning')
+        else:
+            await flash("Error adding log. Check date/time format.", 'danger')
+        return redirect(url_for('dashboard'))
+
+    args = request.args
+    per_page = args.get('per_page', wsgi.DEFAULT_PAGE_SIZE, type=int)
+    if per_page not in wsgi.PAGE_SIZES:
+        per_page = wsgi.DEFAULT_PAGE_SIZE
+    date_from = wsgi.parse_date_arg('date_from', args)
+    date_to = wsgi.parse_date_arg('date_to', args)
+
+    # Selected user (senior/admin): form POST or paging link GET
+
+    target_user_id = None
+    if user_role in ['senior', 'admin']:
+        selected = form.get('user_id') if request.method == 'POST' else args.get('user_id')
+        if selected:
+            try:
+                target_user_id = int(selected)
+            except ValueError:
+                await flash("Invalid user selection.", 'danger')
+
+    # Conditional GET, as in app.dashboard
+
+    etag = None
+    if request.method == 'GET' and '_flashes' not in session:
+        stamp = await db.get_dashboard_stamp(
+            [uid for uid in (user_id, target_user_id) if uid is not None]
+        )
+        etag = httpcache.dashboard_etag(stamp, user_id, user_role, target_user_id,
+                                        request.query_string.decode(), date.today())
+        if request.if_none_match.contains_weak(etag):
+            response = Response('', status=304)
+            response.set_etag(etag, weak=True)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+
+    # Everything the page shows, in one round trip
+
+    data = await db.load_dashboard(
+        user_id=user_id,
+        user_role=user_role,
+        page_size=per_page,
+        before=wsgi.parse_date_arg('before', args),
+        after=wsgi.parse_date_arg('after', args),
+        date_from=date_from,
+        date_to=date_to,
+        target_user_id=target_user_id,
+        target_before=wsgi.parse_date_arg('u_before', args),
+        target_after=wsgi.parse_date_arg('u_after', args)
+    )
+    if target_user_id is not None and not data.target_allowed:
+        # Admin can see logs of all users, senior only normal user logs
+        await flash("You are not allowed to view this user's logs.", 'danger')
+        etag = None
+
+    response = await quart_app.make_response(await render_template(
+        'dashboard.html',
+        user={'username': session.get('username') or data.username},
+        user_role=user_role,
+        logs=data.logs,
+        selected_user_logs=data.target_logs,
+        selected_user_name=data.target_username,
+        selected_user_id=target_user_id,
+        per_page=per_page,
+        page_sizes=wsgi.PAGE_SIZES,
+        date_from=date_from,
+        date_to=date_to,
+        newer=data.newer,
+        older=data.older,
+        selected_newer=data.target_newer,
+        selected_older=data.target_older
+    ))
+    if etag is not None:
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'private, no-cache'
+    else:
+        response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+@quart_app.route('/logs/delete/<int:log_id>', methods=['POST'])
+async def delete_log(log_id):
+    if 'user_id' not in session:
+        await flash("Please login first!", 'danger')
+        return redirect(url_for('login'))
+
+    log_date = wsgi.parse_date_arg('log_date', await request.form)
+    if await get_db().delete_log(log_id, session['user_id'], session['user_role'], log_date=log_date):
+        await flash("Log deleted successfully!", 'success')
+    else:
+        await flash("Unauthorized or log not found!", 'danger')
+    return redirect(url_for('dashboard'))
+
+
+@quart_app.route('/logs/update/<int:log_id>', methods=['POST'])
+async def update_log(log_id):
+    if 'user_id' not in session:
+        await flash("Please login first!", 'danger')
+        return redirect(url_for('login'))
+
+    form = await request.form
+    try:
+        work_date = datetime.strptime(form.get('date', '').strip(), '%Y-%m-%d').date()
+    except ValueError:
+        await flash("Invalid date format!", 'danger')
+        return redirect(url_for('dashboard'))
+
+    db = get_db()
+    log_date = wsgi.parse_date_arg('log_date', form)
+    if not await db.get_log_by_id(log_id, log_date=log_date):
+        await flash("Log not found!", 'danger')
+        return redirect(url_for('dashboard'))
+
+    result = await db.update_log(
+        log_id,
+        session['user_id'],
+        form.get('clock_in', '').strip(),
+        form.get('clock_out', '').strip(),
+        work_date,
+        form.get('task_description', '').strip(),
+        session['user_role'],
+        log_date=log_date
+    )
+    if result == "success":
+        await flash("Log updated successfully!", 'success')
+    elif result == "duplicate":
+        await flash("A log for this date already exists!", 'warning')
+    elif result == "archived":
+        await flash("That year is archived and can no longer be changed.", 'warning')
+    else:
+        await flash("Error updating log. Check date/time format.", 'danger')
+    return redirect(url_for('dashboard'))
+
+# ================= DISPATCH =================
+
+def _served_by_flask():
+    raise RuntimeError("handled by the WSGI app")
+
+# Register the Flask-only routes too (never called) so url_for() in the
+# shared templates can build links to them
+for rule in wsgi.app.url_map.iter_rules():
+    if rule.endpoint not in ASYNC_ENDPOINTS and rule.endpoint not in quart_app.view_functions:
+        quart_app.add_url_rule(rule.rule, endpoint=rule.endpoint, view_func=_served_by_flask,
+                               methods=rule.methods)
+
+wsgi_application = WsgiToAsgi(wsgi.app)
+_routes = wsgi.app.url_map.bind('localhost')
+
+
+def _is_async(path, method):
+    try:
+        endpoint, _ = _routes.match(path, method=method)
+    except HTTPException:
+        # 404 / 405 / slash redirects: let Flask answer as it always has
+        return False
+    return endpoint in ASYNC_ENDPOINTS
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and not _is_async(scope['path'], scope['method']):
+        return await wsgi_application(scope, receive, send)
+    return await quart_app(scope, receive, send)
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run('asgi:application', host='0.0.0.0', port=int(os.getenv('PORT', 5000)))
@@ -0,0 +1,563 @@
+"""
+Async counterpart of db.DatabaseManager for the ASGI deployment (asgi.py).
+
+Covers what the async views need: the login / registration / password reset
+flows and the timesheet dashboard (list, add, update, delete). Queries are
+the same as the sync manager's; the shared SQL (log_rows_query, paginate,
+SUMMARY_REFRESH_SQL) is imported from db.py so the two cannot drift.
+
+Built on psycopg 3 and psycopg_pool:
+
+    pip install "psycopg[binary,pool]"
+
+Password and OTP hashing are CPU bound, so they run in a worker thread
+instead of blocking the event loop (passwords.py then hands account
+passwords on to its process pool).
+"""
+import asyncio
+import logging
+import secrets
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+
+import psycopg
+from psycopg import errors
+from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
+from psycopg_pool import AsyncConnectionPool
+
+import passwords
+from db import (
+    BREAK_HOURS, ENSURE_PARTITION_SQL, LOG_DATE_FILTER, STANDARD_DAY_HOURS, SUMMARY_REFRESH_SQL, INSERT_LOG_SQL, LATEST_OTP_SQL, VERIFY_OTP_SQL, DASHBOARD_STAMP_SQL, LogRow, build_dashboard,
+    dashboard_query, default_otp_hasher, log_rows_query, paginate,
+    parse_clock, session_cache, shift_duration, user_cache
+)
+
+logger = logging.getLogger('worklog.async_db')
+
+
+def conninfo(host='localhost', dbname='log_tracker', user='postgres', password='pyp123', port=5432):
+    return f"host={host} dbname={dbname} user={user} password={password} port={port}"
+
+
+def create_pool(minconn=1, maxconn=10, timeout=5.0, **conn_kwargs):
+    """
+    An AsyncConnectionPool that is not opened yet; call `await pool.open()`
+    from inside the running event loop (asgi.py does it at startup).
+    """
+    return AsyncConnectionPool(
+        conninfo(**conn_kwargs), min_size=minconn, max_size=maxconn,
+        timeout=timeout, open=False
+    )
+
+
+class AsyncDatabaseManager:
+    """
+    One per request. The connection is checked out of the pool on first use
+    and handed back by close(), mirroring DatabaseManager(pool=...).
+    """
+
+    def __init__(self, pool, otp_hasher=None):
+        self.pool = pool
+        self.conn = None
+        self.otp_hasher = otp_hasher or default_otp_hasher()
+        self.query_stats = {'count': 0, 'errors': 0, 'seconds': 0.0, 'statements': []}
+        self._tx_depth = 0
+        self._after_commit = []
+
+    async def _connection(self):
+        if self.conn is None:
+            self.conn = await self.pool.getconn()
+        return self.conn
+
+    async def _execute(self, cur, query, params=None):
+        started = time.perf_counter()
+        try:
+            await cur.execute(query, params)
+        except Exception:
+            self.query_stats['errors'] += 1
+            raise
+        finally:
+            self.query_stats['count'] += 1
+            self.query_stats['seconds'] += time.perf_counter() - started
+
+    async def _fetchone(self, query, params=None):
+        conn = await self._connection()
+        async with conn.cursor(row_factory=dict_row) as cur:
+            await self._execute(cur, query, params)
+            return await cur.fetchone()
+
+    async def _fetchall(self, query, params=None):
+        conn = await self._connection()
+        async with conn.cursor(row_factory=dict_row) as cur:
+            await self._execute(cur, query, params)
+            return await cur.fetchall()
+
+    async def _run(self, query):
+        conn = await self._connection()
+        async with conn.cursor() as cur:
+            await self._execute(cur, query)
+
+    @asynccontextmanager
+    async def transaction(self, savepoint=True):
+        """
+        Same unit of work as DatabaseManager.transaction():
+
+            async with db.transaction():
+                otp = await db.generate_otp(user['id'])
+                await db.enqueue_email(email, subject, body)
+
+        commits once at the end of the outermost block; nested blocks are
+        savepoints, or join the enclosing block with savepoint=False.
+        """
+        if self._tx_depth and not savepoint:
+            yield self
+            return
+
+        if self._tx_depth:
+            name = f"uow_{self._tx_depth}"
+            await self._run(f"SAVEPOINT {name}")
+            self._tx_depth += 1
+            try:
+                yield self
+            except BaseException:
+                await self._run(f"ROLLBACK TO SAVEPOINT {name}")
+                raise
+            else:
+                await self._run(f"RELEASE SAVEPOINT {name}")
+            finally:
+                self._tx_depth -= 1
+            return
+
+        conn = await self._connection()
+        self._tx_depth = 1
+        try:
+            yield self
+        except BaseException:
+            self._tx_depth = 0
+            self._after_commit.clear()
+            await conn.rollback()
+            raise
+        self._tx_depth = 0
+        await conn.commit()
+        callbacks, self._after_commit = self._after_commit, []
+        for fn in callbacks:
+            fn()
+
+    def on_commit(self, fn):
+        """Call fn once the current transaction commits (now, if there is none)."""
+        if self._tx_depth:
+            self._after_commit.append(fn)
+        else:
+            fn()
+
+    async def close(self):
+        if self.conn is None:
+            return
+        conn, self.conn = self.conn, None
+        try:
+            # Reads leave a transaction open; end it before the pool sees the connection
+            await conn.rollback()
+        finally:
+            await self.pool.putconn(conn)
+
+    # USERS
+
+    async def email_exists(self, email):
+        return await self._fetchone("SELECT 1 FROM users WHERE email = %s", (email,)) is not None
+
+    async def get_user_by_email(self, email):
+        return await self._fetchone("""
+            SELECT id, username, email
+            FROM users
+            WHERE email = %s
+        """, (email,))
+
+    async def is_verified(self, email):
+        row = await self._fetchone("SELECT is_verified FROM users WHERE email = %s", (email,))
+        return row['is_verified'] if row else None
+
+    async def insert_user(self, username, email, password, role='user'):
+        hashed_pw = await asyncio.to_thread(passwords.hash_password, password)
+        try:
+            async with self.transaction():
+                user = await self._fetchone("""
+                    INSERT INTO users (username, email, password_hash, role)
+                    VALUES (%s, %s, %s, %s)
+                    RETURNING id, username, email, role, is_verified
+                """, (username, email, hashed_pw, role))
+                self.on_commit(user_cache.clear)
+                return user
+        except errors.UniqueViolation:
+            return None
+
+    async def register_user(self, username, email, password):
+        if await self.email_exists(email):
+            return False, "Email already registered"
+
+        user = await self.insert_user(username, email, password)
+        if user:
+            return True, user
+        return False, "Registration failed"
+
+    async def mark_user_verified(self, user_id):
+        try:
+            async with self.transaction():
+                await self._fetchone("UPDATE users SET is_verified = TRUE WHERE id = %s RETURNING id", (user_id,))
+                self.on_commit(user_cache.clear)
+            return True
+        except Exception as e:
+            logger.error("mark_user_verified failed: %s", e)
+            return False
+
+    async def login_user(self, email, password):
+        user = await self._fetchone("""
+            SELECT id, username, email, password_hash, role, is_verified
+            FROM users
+            WHERE email = %s
+        """, (email,))
+        if not user:
+            return False, "User not found"
+        if not user["is_verified"]:
+            return False, "Account not verified"
+        if not await asyncio.to_thread(passwords.verify_password, user["password_hash"], password):
+            return False, "Invalid password"
+        if passwords.needs_rehash(user["password_hash"]):
+            await self._rehash_password(user["id"], password)
+        return True, {
+            "id": user["id"],
+            "username": user["username"],
+            "email": user["email"],
+            "role": user["role"]
+        }
+
+    async def _rehash_password(self, user_id, password):
+        """Same as DatabaseManager._rehash_password; best effort."""
+        try:
+            new_hash = await asyncio.to_thread(passwords.hash_password, password)
+            async with self.transaction():
+                await self._fetchone("UPDATE users SET password_hash = %s WHERE id = %s RETURNING id",
+                                     (new_hash, user_id))
+        except passwords.HasherBusy:
+            pass  # try again on the next login
+        except psycopg.Error as e:
+            logger.warning("password rehash failed for user %s: %s", user_id, e)
+
+    async def update_user_password(self, email, password):
+        hashed_password = await asyncio.to_thread(passwords.hash_password, password)
+        try:
+            async with self.transaction():
+                row = await self._fetchone("""
+                    UPDATE users
+                    SET password_hash = %s
+                    WHERE email = %s
+                    RETURNING id
+                """, (hashed_password, email))
+                if row is not None:
+                    # Anyone holding the old password is logged out everywhere
+                    await self._fetchall("DELETE FROM user_sessions WHERE user_id = %s RETURNING sid", (row['id'],))
+                    await self._fetchall("""
+                        UPDATE api_tokens SET revoked_at = CURRENT_TIMESTAMP
+                        WHERE user_id = %s AND revoked_at IS NULL
+                        RETURNING id
+                    """, (row['id'],))
+                    self.on_commit(session_cache.clear)
+                self.on_commit(user_cache.clear)
+
+            if row is None:
+                return False, "User not found"
+            return True, "Password updated successfully"
+
+        except psycopg.Error as e:
+            return False, f"Database error: {e}"
+
+        except Exception as e:
+            return False, f"Unexpected error: {e}"
+
+    async def get_user_by_id(self, user_id):
+        key = ('user', user_id)
+        user = user_cache.get(key)
+        if user is None:
+            row = await self._fetchone("""
+                SELECT id, username, email, role, is_verified
+                FROM users
+                WHERE id = %s
+            """, (user_id,))
+            user = dict(row) if row else None
+            if user is not None:
+                user_cache.set(key, user)
+        return user
+
+    async def list_users(self, requester_role):
+        if requester_role not in ('admin', 'senior'):
+            return []
+        key = ('users', 'all')
+        users = user_cache.get(key)
+        if users is None:
+            users = await self._fetchall("""
+                SELECT id, username, email, role, is_verified, created_at
+                FROM users
+                ORDER BY role DESC, username
+            """)
+            user_cache.set(key, users)
+        return users
+
+    async def get_users_by_role(self, role, requester_role):
+        if requester_role not in ('admin', 'senior'):
+            return []
+        key = ('users_by_role', role)
+        users = user_cache.get(key)
+        if users is None:
+            users = await self._fetchall("""
+                SELECT id, username, email, role, is_verified, created_at
+                FROM users
+                WHERE role = %s
+                ORDER BY username
+            """, (role,))
+            user_cache.set(key, users)
+        return users
+
+    # OTP / EMAIL
+
+    async def generate_otp(self, user_id, purpose='verify_email', expiry_minutes=10):
+        otp = str(100000 + secrets.randbelow(900000))
+        otp_hash = await asyncio.to_thread(self.otp_hasher.hash, otp)
+        expires_at = datetime.now() + timedelta(minutes=expiry_minutes)
+
+        async with self.transaction(savepoint=False):
+            await self._fetchone("""
+                INSERT INTO user_otp (user_id, otp_hash, purpose, expires_at)
+                VALUES (%s, %s, %s, %s)
+                RETURNING id
+            """, (user_id, otp_hash, purpose, expires_at))
+        return otp
+
+    async def verify_otp(self, user_id, input_otp, purpose='verify_email'):
+        input_otp = str(input_otp).strip()
+        row = await self._fetchone(LATEST_OTP_SQL, (user_id, purpose))
+        if not row:
+            return False, "No OTP found"
+        if datetime.now() > row['expires_at']:
+            return False, "OTP expired"
+        if not await asyncio.to_thread(self.otp_hasher.verify, row['otp_hash'], input_otp):
+            return False, "Invalid OTP"
+
+        # Same single statement as the sync manager: OTP used and, for
+        # sign-up, the user verified
+        async with self.transaction(savepoint=False):
+            used = await self._fetchone(VERIFY_OTP_SQL, {
+                'otp_id': row['id'],
+                'verify_email': purpose == 'verify_email',
+            })
+            if used is None:
+                return False, "OTP already used"
+            if purpose == 'verify_email':
+                self.on_commit(user_cache.clear)
+        return True, "OTP verified"
+
+    async def enqueue_email(self, to_email, subject, body):
+        async with self.transaction(savepoint=False):
+            row = await self._fetchone("""
+                INSERT INTO email_outbox (to_email, subject, body)
+                VALUES (%s, %s, %s)
+                RETURNING id
+            """, (to_email, subject, body))
+        return row['id']
+
+    # SESSIONS (see sessions.py)
+
+    async def load_session(self, sid):
+        """Same as DatabaseManager.load_session; misses are not cached."""
+        key = ('session', sid)
+        entry = session_cache.get(key)
+        if entry is None:
+            row = await self._fetchone("""
+                SELECT data, expires_at FROM user_sessions
+                WHERE sid = %s AND expires_at > CURRENT_TIMESTAMP
+            """, (sid,))
+            if row is None:
+                return None
+            entry = (row['data'], row['expires_at'])
+            session_cache.set(key, entry)
+        if entry[1] <= datetime.now():
+            return None
+        return entry
+
+    async def save_session(self, sid, user_id, data, expires_at):
+        async with self.transaction(savepoint=False):
+            await self._fetchone("""
+                INSERT INTO user_sessions (sid, user_id, data, expires_at)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (sid) DO UPDATE
+                SET user_id = EXCLUDED.user_id,
+                    data = EXCLUDED.data,
+                    expires_at = EXCLUDED.expires_at
+                RETURNING sid
+            """, (sid, user_id, Jsonb(data), expires_at))
+            self.on_commit(lambda: session_cache.set(('session', sid), (data, expires_at)))
+
+    async def delete_session(self, sid):
+        async with self.transaction(savepoint=False):
+            await self._fetchone("DELETE FROM user_sessions WHERE sid = %s RETURNING sid", (sid,))
+            # Tombstone rather than a miss, so no process keeps serving the old entry
+            self.on_commit(lambda: session_cache.set(('session', sid), None))
+
+    # TIMESHEET
+
+    async def get_log_rows(self, user_id, limit=None, before=None, after=None, date_from=None, date_to=None):
+        query, params = log_rows_query(user_id, limit, before, after, date_from, date_to)
+        conn = await self._connection()
+        async with conn.cursor() as cur:
+            await self._execute(cur, query, params)
+            return list(map(LogRow._make, await cur.fetchall()))
+
+    async def get_logs_page(self, user_id, page_size=25, before=None, after=None, date_from=None, date_to=None):
+        logs = await self.get_log_rows(
+            user_id, limit=page_size + 1, before=before, after=after,
+            date_from=date_from, date_to=date_to
+        )
+        return paginate(logs, page_size, before, after)
+
+    async def load_dashboard(self, user_id, user_role, page_size=25, before=None, after=None,
+                             date_from=None, date_to=None, target_user_id=None,
+                             target_before=None, target_after=None):
+        """Same as DatabaseManager.load_dashboard: one round trip, DashboardData back."""
+        query, params = dashboard_query(
+            user_id, user_role, page_size, before, after, date_from, date_to,
+            target_user_id, target_before, target_after
+        )
+        return build_dashboard(
+            await self._fetchone(query, params), page_size, before, after,
+            target_user_id, target_before, target_after
+        )
+
+    async def get_dashboard_stamp(self, user_ids):
+        return await self._fetchone(DASHBOARD_STAMP_SQL, {'user_ids': list(user_ids)})
+
+    async def get_log_by_id(self, log_id, log_date=None):
+        return await self._fetchall(f"""
+            SELECT id, clock_in, clock_out, work_date, task_description
+            FROM timesheet
+            WHERE id = %s {LOG_DATE_FILTER if log_date else ""}
+        """, (log_id, log_date) if log_date else (log_id,))
+
+    async def refresh_summaries(self, pairs):
+        """Same as DatabaseManager.refresh_summaries(pairs); no commit."""
+        pairs = [p for p in pairs if p[1] is not None]
+        if not pairs:
+            return
+        keys_sql = "SELECT * FROM unnest(%(user_ids)s::int[], %(work_dates)s::date[]) AS k(user_id, work_date)"
+        conn = await self._connection()
+        async with conn.cursor() as cur:
+            await self._execute(cur, SUMMARY_REFRESH_SQL.format(keys=keys_sql), {
+                'standard_seconds': STANDARD_DAY_HOURS * 3600,
+                'break_seconds': BREAK_HOURS * 3600,
+                'user_ids': [p[0] for p in pairs],
+                'work_dates': [p[1] for p in pairs],
+            })
+
+    async def add_log(self, user_id, clock_in, clock_out, work_date, task_description):
+        try:
+            clock_in = parse_clock(clock_in)
+            clock_out = parse_clock(clock_out)
+            duration = shift_duration(clock_in, clock_out)
+
+            async with self.transaction():
+                await self._fetchone(ENSURE_PARTITION_SQL, (work_date,))
+                inserted = await self._fetchone(INSERT_LOG_SQL, (user_id, clock_in, clock_out, duration,
+                                                                 work_date, task_description))
+                if inserted is None:
+                    return "duplicate"
+                await self.refresh_summaries([(user_id, work_date)])
+            return "success"
+
+        except errors.UniqueViolation:
+            return "duplicate"
+
+        except errors.ObjectNotInPrerequisiteState:
+            return "archived"
+
+        except Exception as e:
+            logger.error("add_log failed: %s", e)
+            return "error"
+
+    async def delete_log(self, log_id, user_id, user_role, log_date=None):
+        date_filter = LOG_DATE_FILTER if log_date else ""
+        date_params = (log_date,) if log_date else ()
+        try:
+            async with self.transaction():
+                if user_role == 'admin':
+                    deleted = await self._fetchone(f"""
+                        DELETE FROM timesheet
+                        WHERE id = %s {date_filter}
+                        RETURNING id, user_id, work_date
+                    """, (log_id,) + date_params)
+                else:
+                    deleted = await self._fetchone(f"""
+                        DELETE FROM timesheet
+                        WHERE id = %s AND user_id = %s {date_filter}
+                        RETURNING id, user_id, work_date
+                    """, (log_id, user_id) + date_params)
+
+                if deleted:
+                    await self.refresh_summaries([(deleted['user_id'], deleted['work_date'])])
+            return bool(deleted)
+
+        except Exception as e:
+            logger.error("delete_log failed: %s", e)
+            return False
+
+    async def update_log(self, log_id, user_id, clock_in, clock_out, work_date, task_description, requester_role,
+                         log_date=None):
+        """Same contract as DatabaseManager.update_log: "success" / "duplicate" / "archived" / "error"."""
+        date_filter = "AND t.work_date = %s AND old.work_date = t.work_date" if log_date else ""
+        date_params = (log_date,) if log_date else ()
+        try:
+            clock_in = parse_clock(clock_in)
+            clock_out = parse_clock(clock_out)
+            duration = shift_duration(clock_in, clock_out)
+
+            async with self.transaction():
+                await self._fetchone(ENSURE_PARTITION_SQL, (work_date,))
+                if requester_role in ['senior', 'admin']:
+                    updated = await self._fetchone(f"""
+                        UPDATE timesheet t
+                        SET clock_in = %s,
+                            clock_out = %s,
+                            work_duration = %s,
+                            work_date = %s,
+                            task_description = %s
+                        FROM timesheet old
+                        WHERE t.id = %s AND old.id = t.id {date_filter}
+                        RETURNING t.user_id, old.work_date AS old_date
+                    """, (clock_in, clock_out, duration, work_date, task_description, log_id) + date_params)
+                else:
+                    updated = await self._fetchone(f"""
+                        UPDATE timesheet t
+                        SET clock_in = %s,
+                            clock_out = %s,
+                            work_duration = %s,
+                            work_date = %s,
+                            task_description = %s
+                        FROM timesheet old
+                        WHERE t.id = %s AND t.user_id = %s AND old.id = t.id {date_filter}
+                        RETURNING t.user_id, old.work_date AS old_date
+                    """, (clock_in, clock_out, duration, work_date, task_description, log_id, user_id) + date_params)
+
+                if updated:
+                    await self.refresh_summaries([
+                        (updated['user_id'], updated['old_date']),
+                        (updated['user_id'], work_date),
+                    ])
+            return "success" if updated else "error"
+
+        except errors.UniqueViolation:
+            return "duplicate"
+
+        except errors.ObjectNotInPrerequisiteState:
+            return "archived"
+
+        except Exception as e:
+            logger.error("update_log failed: %s", e)
+            return "error"
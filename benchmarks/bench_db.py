@@ -0,0 +1,123 @@
+"""
+Micro-benchmarks for DatabaseManager methods against a seeded database
+(see seed.py). Each method is called --iterations times after a short
+warm-up; mutating methods are paired so the data set is left as it was.
+
+    python benchmarks/bench_db.py --iterations 200 --output results/db.json
+"""
+import argparse
+import itertools
+from datetime import date, timedelta
+
+from common import (
+    BENCH_PASSWORD, add_db_args, db_kwargs, print_table, summarize, timed, write_results
+)
+from db import DatabaseManager, user_cache
+
+
+def pick_accounts(db):
+    db.cursor.execute("""
+        SELECT DISTINCT ON (role) id, email, role
+        FROM users
+        WHERE role IN ('admin', 'senior', 'user')
+        ORDER BY role, id DESC
+    """)
+    accounts = {row['role']: row for row in db.cursor.fetchall()}
+    db.cursor.execute("""
+        SELECT id, work_date, clock_in, clock_out, task_description
+        FROM timesheet WHERE user_id = %s ORDER BY work_date DESC LIMIT 1
+    """, (accounts['user']['id'],))
+    accounts['log'] = db.cursor.fetchone()
+    db.conn.rollback()
+    return accounts
+
+
+def cases(db, accounts):
+    user = accounts['user']
+    log = accounts['log']
+    # Days of next year: past the seeded history, inside a partition schema.sql
+    # creates, and reusable since every added log is deleted again
+    next_year = date(date.today().year + 1, 1, 1)
+    free_dates = itertools.cycle(next_year + timedelta(days=i) for i in range(365))
+
+    def add_then_delete():
+        work_date = next(free_dates)
+        db.add_log(user['id'], '09:00', '17:30', work_date, 'bench add')
+        db.cursor.execute("SELECT id FROM timesheet WHERE user_id = %s AND work_date = %s",
+                          (user['id'], work_date))
+        row = db.cursor.fetchone()
+        db.conn.rollback()
+        if row:
+            db.delete_log(row['id'], user['id'], 'user')
+
+    def otp_roundtrip():
+        otp = db.generate_otp(user['id'], purpose='reset_password')
+        db.verify_otp(user['id'], otp, purpose='reset_password')
+
+    def uncached(fn):
+        def run():
+            user_cache.clear()
+            return fn()
+        return run
+
+    def read(fn):
+        # Reads leave a transaction open on the connection; end it like a request would
+        def run():
+            result = fn()
+            db.conn.rollback()
+            return result
+        return run
+
+    return {
+        'email_exists': read(lambda: db.email_exists(user['email'])),
+        'get_user_by_email': read(lambda: db.get_user_by_email(user['email'])),
+        'is_verified': read(lambda: db.is_verified(user['email'])),
+        'login_user': read(lambda: db.login_user(user['email'], BENCH_PASSWORD)),
+        'get_user_by_id (uncached)': read(uncached(lambda: db.get_user_by_id(user['id']))),
+        'list_users (uncached)': read(uncached(lambda: db.list_users('admin'))),
+        'list_users (cached)': read(lambda: db.list_users('admin')),
+        'get_users_by_role (uncached)': read(uncached(lambda: db.get_users_by_role('user', 'senior'))),
+        'get_logs (full history)': read(lambda: db.get_logs(user['id'])),
+        'get_log_rows (full history)': read(lambda: db.get_log_rows(user['id'])),
+        'get_logs_page (25)': read(lambda: db.get_logs_page(user['id'], page_size=25)),
+        'get_log_by_id': read(lambda: db.get_log_by_id(log['id'])),
+        'load_dashboard (user)': read(lambda: db.load_dashboard(user['id'], 'user')),
+        'load_dashboard (admin + target)': read(uncached(lambda: db.load_dashboard(
+            accounts['admin']['id'], 'admin', target_user_id=user['id']))),
+        'get_summary_report (week)': read(lambda: db.get_summary_report(
+            'week', date.today() - timedelta(days=90), date.today(), 'admin')),
+        'update_log (same values)': lambda: db.update_log(
+            log['id'], user['id'], log['clock_in'], log['clock_out'], log['work_date'],
+            log['task_description'], 'user'),
+        'add_log + delete_log': add_then_delete,
+        'generate_otp + verify_otp': otp_roundtrip,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark DatabaseManager methods")
+    add_db_args(parser)
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--only', action='append', help="Run only cases whose name contains this")
+    parser.add_argument('--output', help="Write JSON results here ('-' for stdout)")
+    args = parser.parse_args()
+
+    db = DatabaseManager(**db_kwargs(args))
+    try:
+        accounts = pick_accounts(db)
+        results = {}
+        for name, fn in cases(db, accounts).items():
+            if args.only and not any(part in name for part in args.only):
+                continue
+            results[name] = summarize(timed(fn, args.iterations))
+    finally:
+        db.close()
+
+    print(f"DatabaseManager micro-benchmarks ({args.iterations} iterations)")
+    print_table(results)
+    if args.output:
+        write_results(args.output, 'db', results, iterations=args.iterations, dbname=args.dbname)
+
+
+if __name__ == '__main__':
+    main()
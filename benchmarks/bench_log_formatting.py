@@ -0,0 +1,94 @@
+"""
+Compare the two timesheet read paths on one user with a large history:
+
+    get_logs      -> RealDictRows formatted in a Python loop
+    get_log_rows  -> LogRow tuples formatted by Postgres (to_char / interval math)
+
+Rows are seeded inside a transaction that is rolled back at the end, so the
+target database is left untouched.
+
+    python benchmarks/bench_log_formatting.py --rows 100000 --repeat 5
+"""
+import argparse
+import statistics
+import time
+import uuid
+
+from common import add_db_args, db_kwargs
+from db import DatabaseManager
+
+
+def seed(db, rows):
+    db.cursor.execute("""
+        INSERT INTO users (username, email, password_hash, is_verified)
+        VALUES ('bench', %s, 'x', TRUE)
+        RETURNING id
+    """, (f"bench-{uuid.uuid4().hex}@example.com",))
+    user_id = db.cursor.fetchone()['id']
+
+    # One row per day going back from today; 100k rows reaches the 1750s,
+    # which keeps (user_id, work_date) unique. Those years need partitions,
+    # created in the same transaction so the rollback removes them too.
+    db.cursor.execute("""
+        SELECT ensure_timesheet_partition(year)
+        FROM generate_series(extract(year FROM CURRENT_DATE - %s)::int,
+                             extract(year FROM CURRENT_DATE)::int) AS year
+    """, (rows - 1,))
+    db.cursor.execute("""
+        INSERT INTO timesheet (user_id, clock_in, clock_out, work_duration, work_date, task_description)
+        SELECT %s,
+               TIME '09:00' + (g %% 60) * INTERVAL '1 minute',
+               TIME '18:00' + (g %% 45) * INTERVAL '1 minute',
+               INTERVAL '9 hours' + ((g %% 45) - (g %% 60)) * INTERVAL '1 minute',
+               CURRENT_DATE - g,
+               'benchmark task ' || g
+        FROM generate_series(0, %s - 1) AS g
+    """, (user_id, rows))
+    return user_id
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - started)
+    return samples, len(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    add_db_args(parser)
+    args = parser.parse_args()
+
+    db = DatabaseManager(**db_kwargs(args))
+    try:
+        user_id = seed(db, args.rows)
+
+        paths = {
+            'get_logs (python loop)': lambda: db.get_logs(user_id),
+            'get_log_rows (sql format)': lambda: db.get_log_rows(user_id),
+        }
+        print(f"{args.rows} rows, {args.repeat} runs each")
+        for name, fn in paths.items():
+            samples, count = timed(fn, args.repeat)
+            print(f"  {name:<28} rows={count:<8} min={min(samples) * 1000:8.1f}ms "
+                  f"median={statistics.median(samples) * 1000:8.1f}ms")
+
+        # Both paths must agree on what the template gets to see
+        slow = db.get_logs(user_id, limit=1000)
+        fast = db.get_log_rows(user_id, limit=1000)
+        fields = ('id', 'clock_in', 'clock_out', 'work_date', 'task_description', 'workhour')
+        mismatches = sum(
+            1 for a, b in zip(slow, fast) if tuple(a[f] for f in fields) != tuple(b)
+        )
+        print(f"  mismatched rows in first 1000: {mismatches}")
+    finally:
+        db.conn.rollback()
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
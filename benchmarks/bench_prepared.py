@@ -0,0 +1,132 @@
+"""
+Prepared vs. unprepared statements (statements.py) for the hot login and
+dashboard queries, against a seeded database (see seed.py). Each case runs
+on two connections, one sending SQL text on every call
+(prepare_statements=False) and one using PREPARE / EXECUTE, and the
+per-call latencies are compared.
+
+login_user itself is dominated by password hashing, so the login case
+times its user lookup (LOGIN_USER_SQL) on its own. The "(first use)" case
+forgets every prepared statement before each call, so it measures what a
+fresh pooled connection pays once per statement: SAVEPOINT, PREPARE and
+RELEASE around the first EXECUTE.
+
+    python benchmarks/bench_prepared.py --iterations 1000 --output results/prepared.json
+
+results/prepared.json (2000 iterations, local Postgres over a Unix socket,
+seed.py defaults), p50 per call:
+
+    fixed single-row lookups    0.06-0.23ms -> 0.05-0.12ms   (x1.2-x2.2)
+    get_logs_page, load_dashboard (user)      x1.2
+    load_dashboard (admin + target)           x0.95, no gain
+    login_user lookup (first use)  0.13ms -> 0.20ms          (x0.65)
+
+The one-off cost is about 0.1ms, three extra statements, per statement
+per connection, paid back after a few calls; over a network each of
+those is a round trip. Generated dashboard SQL never settles on a generic
+plan (custom_plans only), so it saves the parse but still plans per call;
+for the larger admin query that saving is lost in the noise.
+At most DB_MAX_PREPARED_STATEMENTS (200) distinct texts are prepared; any
+beyond that run unprepared at the plain timings.
+"""
+import argparse
+
+from bench_db import pick_accounts
+from common import add_db_args, db_kwargs, summarize, timed, write_results
+from db import (
+    LATEST_OTP_SQL, LOGIN_USER_SQL, DatabaseManager, session_cache, user_cache
+)
+
+
+def cases(db, accounts):
+    user = accounts['user']
+    admin = accounts['admin']
+
+    def read(fn):
+        # End the implicit transaction like a request would
+        def run():
+            result = fn()
+            db.conn.rollback()
+            return result
+        return run
+
+    def login_lookup():
+        db.cursor.execute(LOGIN_USER_SQL, (user['email'],))
+        return db.cursor.fetchone()
+
+    def otp_lookup():
+        db.cursor.execute(LATEST_OTP_SQL, (user['id'], 'reset_password'))
+        return db.cursor.fetchone()
+
+    def first_use(fn):
+        # Forget every prepared statement first, so the prepared connection
+        # pays SAVEPOINT + PREPARE + RELEASE on each call; the plain one
+        # runs the same DEALLOCATE so both sides carry it
+        def run():
+            db.cursor.execute("DEALLOCATE ALL")
+            prepared = getattr(db.conn, 'prepared', None)
+            if prepared is not None:
+                prepared.clear()
+            return fn()
+        return run
+
+    def uncached(cache, fn):
+        def run():
+            cache.clear()
+            return fn()
+        return run
+
+    return {
+        'login_user lookup': read(login_lookup),
+        'login_user lookup (first use)': read(first_use(login_lookup)),
+        'get_user_by_id (uncached)': read(uncached(user_cache, lambda: db.get_user_by_id(user['id']))),
+        'load_session (uncached)': read(uncached(session_cache, lambda: db.load_session('bench-missing'))),
+        'verify_otp lookup': read(otp_lookup),
+        'get_dashboard_stamp': read(lambda: db.get_dashboard_stamp([user['id']])),
+        'get_logs_page (25)': read(lambda: db.get_logs_page(user['id'], page_size=25)),
+        'load_dashboard (user)': read(lambda: db.load_dashboard(user['id'], 'user')),
+        'load_dashboard (admin + target)': read(lambda: db.load_dashboard(
+            admin['id'], 'admin', target_user_id=user['id'])),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark prepared against unprepared statements")
+    add_db_args(parser)
+    parser.add_argument('--iterations', type=int, default=500)
+    parser.add_argument('--only', action='append', help="Run only cases whose name contains this")
+    parser.add_argument('--output', help="Write JSON results here ('-' for stdout)")
+    args = parser.parse_args()
+
+    plain = DatabaseManager(**db_kwargs(args), prepare_statements=False)
+    prepared = DatabaseManager(**db_kwargs(args), prepare_statements=True)
+    try:
+        accounts = pick_accounts(plain)
+        runs = {'plain': cases(plain, accounts), 'prepared': cases(prepared, accounts)}
+        results = {}
+        for name in runs['plain']:
+            if args.only and not any(part in name for part in args.only):
+                continue
+            results[name] = {mode: summarize(timed(runs[mode][name], args.iterations)) for mode in runs}
+        plans = prepared.get_prepared_statements()
+    finally:
+        plain.close()
+        prepared.close()
+
+    print(f"Prepared statements ({args.iterations} iterations, p50 / p95 per call)")
+    for name, result in results.items():
+        before, after = result['plain'], result['prepared']
+        speedup = before['p50_ms'] / after['p50_ms'] if after['p50_ms'] else 0.0
+        print(f"  {name:<32} plain {before['p50_ms']:>7.3f} / {before['p95_ms']:>7.3f}ms   "
+              f"prepared {after['p50_ms']:>7.3f} / {after['p95_ms']:>7.3f}ms   x{speedup:.2f}")
+    print("Plan cache on the prepared connection:")
+    for row in plans:
+        print(f"  {row['name']:<32} generic={row.get('generic_plans')} custom={row.get('custom_plans')}")
+
+    if args.output:
+        write_results(args.output, 'prepared', results, iterations=args.iterations,
+                      dbname=args.dbname, plans=[{k: str(v) for k, v in row.items()} for row in plans])
+
+
+if __name__ == '__main__':
+    main()
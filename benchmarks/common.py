@@ -0,0 +1,112 @@
+"""
+Shared helpers for the benchmark scripts: connection arguments, latency
+summaries and machine-readable result files.
+
+Every script prints a human summary and, with --output, writes JSON of the form
+
+    {"benchmark": ..., "meta": {commit, timestamp, python, host, ...}, "results": {...}}
+
+so runs from different commits can be diffed or plotted.
+"""
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+# Password every seeded account gets (see seed.py)
+BENCH_PASSWORD = 'bench-password'
+
+
+def add_db_args(parser):
+    parser.add_argument('--host', default=os.getenv('PGHOST', 'localhost'))
+    parser.add_argument('--dbname', default=os.getenv('PGDATABASE', 'log_tracker_bench'))
+    parser.add_argument('--user', default=os.getenv('PGUSER', 'postgres'))
+    parser.add_argument('--password', default=os.getenv('PGPASSWORD', 'pyp123'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('PGPORT', 5432)))
+
+
+def db_kwargs(args, dbname=None):
+    return {
+        'host': args.host,
+        'dbname': dbname or args.dbname,
+        'user': args.user,
+        'password': args.password,
+        'port': args.port,
+    }
+
+
+def percentile(sorted_samples, q):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_samples:
+        return 0.0
+    rank = max(int(round(q / 100 * len(sorted_samples))) - 1, 0)
+    return sorted_samples[min(rank, len(sorted_samples) - 1)]
+
+
+def summarize(samples):
+    """Latency samples in seconds -> summary dict in milliseconds."""
+    ordered = sorted(samples)
+    count = len(ordered)
+    return {
+        'count': count,
+        'mean_ms': round(sum(ordered) / count * 1000, 3) if count else 0.0,
+        'p50_ms': round(percentile(ordered, 50) * 1000, 3),
+        'p90_ms': round(percentile(ordered, 90) * 1000, 3),
+        'p95_ms': round(percentile(ordered, 95) * 1000, 3),
+        'p99_ms': round(percentile(ordered, 99) * 1000, 3),
+        'max_ms': round(ordered[-1] * 1000, 3) if count else 0.0,
+    }
+
+
+def timed(fn, iterations, warmup=3):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(path, benchmark, results, **meta):
+    payload = {
+        'benchmark': benchmark,
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'host': socket.gethostname(),
+            **meta,
+        },
+        'results': results,
+    }
+    if path == '-':
+        json.dump(payload, sys.stdout, indent=2)
+        print()
+    else:
+        with open(path, 'w') as fh:
+            json.dump(payload, fh, indent=2)
+
+
+def print_table(results):
+    for name, stats in results.items():
+        print(f"  {name:<32} n={stats['count']:<6} p50={stats['p50_ms']:>9.2f}ms "
+              f"p95={stats['p95_ms']:>9.2f}ms p99={stats['p99_ms']:>9.2f}ms")
@@ -0,0 +1,158 @@
+"""
+HTTP load scenario against a running app (python app.py, gunicorn, ...)
+pointed at a database seeded by seed.py.
+
+Each virtual user logs in once, then loops:
+
+    GET  /dashboard
+    POST /dashboard            (add a log for a fresh past date)
+    POST /logs/update/<id>     (edit that log)
+    POST /logs/delete/<id>     (remove it again)
+
+Latency percentiles are reported per step, throughput for the whole run.
+
+    python benchmarks/load_http.py --base-url http://localhost:5000 \\
+        --users 20 --duration 60 --output results/http.json
+"""
+import argparse
+import http.cookiejar
+import itertools
+import re
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from datetime import date, timedelta
+
+from common import BENCH_PASSWORD, print_table, summarize, write_results
+
+LOG_ID_RE = re.compile(r'/logs/update/(\d+)')
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    # Time each request on its own; the redirect target is measured separately
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class VirtualUser(threading.Thread):
+
+    def __init__(self, base_url, email, deadline, recorder, date_source):
+        super().__init__(daemon=True)
+        self.base_url = base_url.rstrip('/')
+        self.email = email
+        self.deadline = deadline
+        self.recorder = recorder
+        self.date_source = date_source
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+            NoRedirect()
+        )
+
+    def request(self, step, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        started = time.perf_counter()
+        try:
+            with self.opener.open(self.base_url + path, data=body, timeout=30) as resp:
+                payload = resp.read()
+                status = resp.status
+        except urllib.error.HTTPError as e:
+            payload = e.read()
+            status = e.code
+        except OSError:
+            payload, status = b'', 0
+        self.recorder.record(step, time.perf_counter() - started, status)
+        return status, payload
+
+    def run(self):
+        status, _ = self.request('POST /login', '/login', {'email': self.email, 'password': BENCH_PASSWORD})
+        if status != 302:
+            return
+
+        while time.monotonic() < self.deadline:
+            self.request('GET /dashboard', '/dashboard')
+
+            work_date = next(self.date_source).isoformat()
+            self.request('POST /dashboard (add)', '/dashboard', {
+                'work_date': work_date, 'clock_in': '09:00', 'clock_out': '17:00',
+                'task_description': 'load test',
+            })
+            # The newest page only shows recent dates, so look the row up by date
+            _, page = self.request('GET /dashboard (find)', f'/dashboard?date_from={work_date}&date_to={work_date}')
+            match = LOG_ID_RE.search(page.decode('utf-8', 'replace'))
+            if not match:
+                continue
+            log_id = match.group(1)
+
+            self.request('POST /logs/update', f'/logs/update/{log_id}', {
+                'date': work_date, 'clock_in': '08:30', 'clock_out': '17:15',
+                'task_description': 'load test (edited)',
+            })
+            self.request('POST /logs/delete', f'/logs/delete/{log_id}', {})
+
+
+class Recorder:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, step, seconds, status):
+        with self._lock:
+            self.samples[step].append(seconds)
+            if status == 0 or status >= 400:
+                self.errors[step] += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP load test")
+    parser.add_argument('--base-url', default='http://localhost:5000')
+    parser.add_argument('--users', type=int, default=10, help="Concurrent virtual users")
+    parser.add_argument('--duration', type=float, default=30, help="Seconds to run")
+    parser.add_argument('--first-user', type=int, default=10,
+                        help="Seeded user<i>@bench.local index to start from")
+    parser.add_argument('--output', help="Write JSON results here ('-' for stdout)")
+    args = parser.parse_args()
+
+    recorder = Recorder()
+    deadline = time.monotonic() + args.duration
+    # Far-past dates never collide with seeded rows
+    counter = itertools.count()
+    lock = threading.Lock()
+
+    def dates():
+        while True:
+            with lock:
+                n = next(counter)
+            yield date(1900, 1, 1) + timedelta(days=n)
+
+    workers = [
+        VirtualUser(args.base_url, f"user{args.first_user + i}@bench.local", deadline, recorder, dates())
+        for i in range(args.users)
+    ]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    results = {step: summarize(samples) for step, samples in recorder.samples.items()}
+    for step, stats in results.items():
+        stats['errors'] = recorder.errors.get(step, 0)
+    total = sum(stats['count'] for stats in results.values())
+    throughput = round(total / elapsed, 2) if elapsed else 0.0
+
+    print(f"{args.users} users for {elapsed:.1f}s: {total} requests, {throughput} req/s")
+    print_table(results)
+    if args.output:
+        write_results(args.output, 'http', results, users=args.users,
+                      duration_s=round(elapsed, 2), requests=total, throughput_rps=throughput,
+                      base_url=args.base_url)
+
+
+if __name__ == '__main__':
+    main()
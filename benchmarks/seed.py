@@ -0,0 +1,118 @@
+"""
+Create (or refill) a throwaway benchmark database from schema.sql and seed
+it with N users and M timesheet rows.
+
+    python benchmarks/seed.py --recreate --users 1000 --rows 1000000
+
+Accounts are user<i>@bench.local (admin0@ / senior<i>@ for the first few),
+all verified, all with the password in common.BENCH_PASSWORD. Timesheet rows
+are spread evenly over users, one per day going back from today.
+"""
+import argparse
+import time
+
+import psycopg2
+from psycopg2 import sql
+
+from common import BENCH_PASSWORD, REPO_ROOT, add_db_args, db_kwargs
+from db import DatabaseManager
+from passwords import HashingPool
+
+# schema.sql ends with ad-hoc fixtures; only the DDL above this line is applied
+SCHEMA_END_MARKER = '--Only for testing purpose'
+
+
+def schema_ddl():
+    with open(f"{REPO_ROOT}/schema.sql", encoding='utf-8') as fh:
+        return fh.read().split(SCHEMA_END_MARKER)[0]
+
+
+def recreate_database(args):
+    admin = psycopg2.connect(**db_kwargs(args, dbname='postgres'))
+    admin.autocommit = True
+    with admin.cursor() as cur:
+        cur.execute(sql.SQL("DROP DATABASE IF EXISTS {}").format(sql.Identifier(args.dbname)))
+        cur.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(args.dbname)))
+    admin.close()
+
+    conn = psycopg2.connect(**db_kwargs(args))
+    with conn, conn.cursor() as cur:
+        cur.execute(schema_ddl())
+    conn.close()
+
+
+def seed(db, users, rows, seniors):
+    # Same method/cost the app is configured with, so login benchmarks are realistic
+    password_hash = HashingPool(workers=0).hash(BENCH_PASSWORD)
+
+    db.cursor.execute("TRUNCATE timesheet, user_otp, users RESTART IDENTITY CASCADE")
+    db.cursor.execute("""
+        INSERT INTO users (username, email, password_hash, role, is_verified)
+        SELECT CASE WHEN g = 0 THEN 'Admin 0'
+                    WHEN g <= %(seniors)s THEN 'Senior ' || g
+                    ELSE 'User ' || g END,
+               CASE WHEN g = 0 THEN 'admin0@bench.local'
+                    WHEN g <= %(seniors)s THEN 'senior' || g || '@bench.local'
+                    ELSE 'user' || g || '@bench.local' END,
+               %(hash)s,
+               (CASE WHEN g = 0 THEN 'admin'
+                     WHEN g <= %(seniors)s THEN 'senior'
+                     ELSE 'user' END)::user_role,
+               TRUE
+        FROM generate_series(0, %(users)s - 1) AS g
+    """, {'users': users, 'seniors': seniors, 'hash': password_hash})
+
+    per_user = max(rows // users, 1)
+    # timesheet has one partition per year; long histories reach back past schema.sql's
+    db.cursor.execute("""
+        SELECT ensure_timesheet_partition(year)
+        FROM generate_series(extract(year FROM CURRENT_DATE - %s)::int,
+                             extract(year FROM CURRENT_DATE)::int) AS year
+    """, (per_user - 1,))
+    db.cursor.execute("""
+        INSERT INTO timesheet (user_id, clock_in, clock_out, work_duration, work_date, task_description)
+        SELECT u.id,
+               TIME '09:00' + ((u.id + g) %% 60) * INTERVAL '1 minute',
+               TIME '18:00' + ((u.id * 7 + g) %% 90) * INTERVAL '1 minute',
+               INTERVAL '9 hours'
+                   + (((u.id * 7 + g) %% 90) - ((u.id + g) %% 60)) * INTERVAL '1 minute',
+               CURRENT_DATE - g,
+               'Worked on ticket #' || (u.id * 31 + g) %% 5000 || ' and code review'
+        FROM users u
+        CROSS JOIN generate_series(0, %s - 1) AS g
+    """, (per_user,))
+    inserted = db.cursor.rowcount
+    db.conn.commit()
+
+    db.rebuild_summaries()
+    db.cursor.execute("ANALYZE")
+    db.conn.commit()
+    return inserted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed a benchmark database")
+    add_db_args(parser)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--rows', type=int, default=200_000)
+    parser.add_argument('--seniors', type=int, default=5)
+    parser.add_argument('--recreate', action='store_true',
+                        help="DROP and CREATE the database, then apply schema.sql")
+    args = parser.parse_args()
+
+    if args.dbname in ('log_tracker', 'postgres'):
+        parser.error(f"refusing to seed {args.dbname!r}; point --dbname at a throwaway database")
+
+    started = time.perf_counter()
+    if args.recreate:
+        recreate_database(args)
+
+    db = DatabaseManager(**db_kwargs(args))
+    inserted = seed(db, args.users, args.rows, args.seniors)
+    db.close()
+    print(f"seeded {args.users} users and {inserted} timesheet rows into {args.dbname} "
+          f"in {time.perf_counter() - started:.1f}s (password: {BENCH_PASSWORD})")
+
+
+if __name__ == '__main__':
+    main()
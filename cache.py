@@ -0,0 +1,162 @@
+"""
+Small in-process caches.
+
+TTLCache is a thread-safe LRU whose entries also expire after `ttl` seconds.
+Give it a SqliteBackend and several worker processes on one host share the
+cached values and, more importantly, invalidations: every clear() bumps a
+generation number in the shared file and each process drops its front LRU
+when it sees the generation move.
+"""
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class SqliteBackend:
+    """Shared local store for TTLCache, one sqlite file per cache namespace."""
+
+    def __init__(self, path, namespace='default'):
+        self.path = path
+        self.namespace = namespace
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                namespace TEXT, key TEXT, expires_at REAL, value BLOB,
+                PRIMARY KEY (namespace, key)
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache_generations (
+                namespace TEXT PRIMARY KEY, generation INTEGER NOT NULL
+            )
+        """)
+        conn.execute(
+            "INSERT OR IGNORE INTO cache_generations VALUES (?, 0)", (namespace,)
+        )
+        conn.commit()
+
+    def _conn(self):
+        # sqlite3 connections may not cross threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def generation(self):
+        row = self._conn().execute(
+            "SELECT generation FROM cache_generations WHERE namespace = ?", (self.namespace,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def get(self, key):
+        row = self._conn().execute(
+            "SELECT expires_at, value FROM cache_entries WHERE namespace = ? AND key = ?",
+            (self.namespace, key)
+        ).fetchone()
+        if row is None or row[0] < time.time():
+            return _MISSING
+        return pickle.loads(row[1])
+
+    def set(self, key, value, ttl):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO cache_entries VALUES (?, ?, ?, ?)",
+            (self.namespace, key, time.time() + ttl, pickle.dumps(value))
+        )
+
+    def clear(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM cache_entries WHERE namespace = ?", (self.namespace,))
+        conn.execute(
+            "UPDATE cache_generations SET generation = generation + 1 WHERE namespace = ?",
+            (self.namespace,)
+        )
+        conn.execute("COMMIT")
+
+
+class TTLCache:
+    """
+    :param maxsize: Entries kept in the in-process LRU
+    :param ttl: Seconds an entry stays valid
+    :param backend: Optional SqliteBackend shared between processes
+    """
+
+    def __init__(self, maxsize=1024, ttl=60, backend=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.backend = backend
+        self._data = OrderedDict()   # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._generation = backend.generation() if backend else 0
+        self.hits = 0
+        self.misses = 0
+
+    def _sync_generation(self):
+        if self.backend is None:
+            return
+        generation = self.backend.generation()
+        if generation != self._generation:
+            with self._lock:
+                self._data.clear()
+                self._generation = generation
+
+    def get(self, key, default=None):
+        self._sync_generation()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._data[key]
+
+        if self.backend is not None:
+            value = self.backend.get(repr(key))
+            if value is not _MISSING:
+                self._store(key, value)
+                self.hits += 1
+                return value
+
+        self.misses += 1
+        return default
+
+    def _store(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def set(self, key, value):
+        self._store(key, value)
+        if self.backend is not None:
+            self.backend.set(repr(key), value, self.ttl)
+
+    def get_or_load(self, key, loader):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = loader()
+            self.set(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+        if self.backend is not None:
+            self.backend.clear()
+            self._generation = self.backend.generation()
+
+    def stats(self):
+        with self._lock:
+            size = len(self._data)
+        return {'size': size, 'maxsize': self.maxsize, 'ttl': self.ttl,
+                'hits': self.hits, 'misses': self.misses}
@@ -1,10 +1,970 @@
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extensions import (
+    TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INERROR, TRANSACTION_STATUS_UNKNOWN,
+    TransactionRollbackError, cursor as TupleCursor, parse_dsn
+)
+from psycopg2.extras import Json, RealDictCursor, execute_values
+from psycopg2.pool import PoolError
 from werkzeug.security import generate_password_hash, check_password_hash
+import contextlib
+import functools
+import gzip
+import hashlib
+import hmac
+import inspect
+import logging
+import os
 import random
+import secrets
 import string
-from datetime import datetime, timedelta
+import threading
+import time
+from collections import namedtuple
+from datetime import date, datetime, timedelta, time as dt_time
+
+from cache import SqliteBackend, TTLCache
+import passwords
+from metrics import registry as metrics
+from statements import (
+    ENABLED as PREPARED_STATEMENTS, PreparingConnection, Statement, registry as statements
+)
+
+logger = logging.getLogger('worklog.db')
+
+# Hours deducted from every logged day for lunch/break
+BREAK_HOURS = 1
+
+# Net hours per day after which time counts as overtime in reports
+STANDARD_DAY_HOURS = 8
+
+# Recomputes the week and month timesheet_summary rows touched by the
+# (user_id, work_date) pairs that {keys} selects. Buckets left without any
+# timesheet rows are deleted; the rest are upserted. The same statement bumps
+# each affected user's timesheet_versions row (dashboard ETags, httpcache.py).
+SUMMARY_REFRESH_SQL = """
+    WITH keys AS ({keys}),
+    versions AS (
+        INSERT INTO timesheet_versions (user_id, version, updated_at)
+        SELECT DISTINCT user_id, 1, CURRENT_TIMESTAMP FROM keys
+        ON CONFLICT (user_id) DO UPDATE
+        SET version = timesheet_versions.version + 1,
+            updated_at = EXCLUDED.updated_at
+    ),
+    buckets AS (
+        SELECT DISTINCT k.user_id, p.period,
+               date_trunc(p.period, k.work_date)::date AS period_start
+        FROM keys k
+        CROSS JOIN (VALUES ('week'), ('month')) AS p(period)
+    ),
+    totals AS (
+        SELECT b.user_id, b.period, b.period_start,
+               count(t.id) AS days_worked,
+               count(t.id) FILTER (WHERE extract(isodow FROM t.work_date) < 6) AS weekdays_worked,
+               coalesce(sum(n.net), 0) AS total_seconds,
+               coalesce(sum(greatest(n.net - %(standard_seconds)s, 0)), 0) AS overtime_seconds
+        FROM buckets b
+        LEFT JOIN timesheet t
+               ON t.user_id = b.user_id
+              AND t.work_date >= b.period_start
+              AND t.work_date < b.period_start + ('1 ' || b.period)::interval
+        LEFT JOIN LATERAL (
+            SELECT greatest(floor(extract(epoch FROM t.work_duration))::bigint - %(break_seconds)s, 0) AS net
+        ) n ON TRUE
+        GROUP BY b.user_id, b.period, b.period_start
+    ),
+    emptied AS (
+        DELETE FROM timesheet_summary s
+        USING totals x
+        WHERE x.days_worked = 0
+          AND s.user_id = x.user_id AND s.period = x.period AND s.period_start = x.period_start
+    )
+    INSERT INTO timesheet_summary
+        (user_id, period, period_start, days_worked, weekdays_worked, total_seconds, overtime_seconds)
+    SELECT user_id, period, period_start, days_worked, weekdays_worked, total_seconds, overtime_seconds
+    FROM totals
+    WHERE days_worked > 0
+    ON CONFLICT (period, period_start, user_id) DO UPDATE
+    SET days_worked = EXCLUDED.days_worked,
+        weekdays_worked = EXCLUDED.weekdays_worked,
+        total_seconds = EXCLUDED.total_seconds,
+        overtime_seconds = EXCLUDED.overtime_seconds
+"""
+
+# Display-ready timesheet row, every field already formatted by Postgres
+LogRow = namedtuple('LogRow', 'id clock_in clock_out work_date task_description workhour')
+
+
+# TIMESHEET PARSING (shared by add_log, update_log and importer.py)
+
+def parse_clock(value):
+    """
+    'HH:MM' or 'HH:MM:SS' -> datetime.time; time objects pass through.
+    Raises ValueError for anything else.
+    """
+    if isinstance(value, dt_time):
+        return value
+    if len(value) == 5:
+        value += ":00"
+    if len(value) == 8 and value[2] == ':' and value[5] == ':':
+        # Same result as the strptime below, several times faster
+        return dt_time.fromisoformat(value)
+    return datetime.strptime(value, "%H:%M:%S").time()
+
+
+def shift_duration(clock_in, clock_out):
+    """Worked time between two clock times; clock_out before clock_in is an overnight shift."""
+    dt_in = datetime.combine(date.min, clock_in)
+    dt_out = datetime.combine(date.min, clock_out)
+    if dt_out < dt_in:
+        dt_out += timedelta(days=1)  # handle overnight
+    return dt_out - dt_in
+
+
+# PUNCHES (punch_events -> timesheet, see DatabaseManager.compact_punches)
+
+# An in/out pair further apart than this is a forgotten punch, not a shift
+PUNCH_MAX_SHIFT = timedelta(hours=int(os.getenv('PUNCH_MAX_SHIFT_HOURS', 20)))
+
+
+def fold_punches(events, max_shift=PUNCH_MAX_SHIFT, now=None):
+    """
+    Pair each user's 'in' punch with the next 'out'.
+
+    :param events: Rows with id, user_id, kind, punched_at, ordered by
+                   user_id, punched_at, id
+    :return: (shifts, done_ids, dropped). shifts are (user_id, start, end);
+             done_ids are the events consumed, including repeated, stray and
+             abandoned punches (dropped counts those). An 'in' still waiting
+             for its 'out' is left out of done_ids.
+    """
+    now = now or datetime.now()
+    shifts, done_ids = [], []
+    dropped = 0
+    open_in = None
+    for i, event in enumerate(events):
+        if open_in is not None and open_in['user_id'] != event['user_id']:
+            open_in = None  # previous user's shift is still open
+        if event['kind'] == 'in':
+            if open_in is None:
+                open_in = event
+            elif event['punched_at'] - open_in['punched_at'] > max_shift:
+                done_ids.append(open_in['id'])  # never clocked out
+                dropped += 1
+                open_in = event
+            else:
+                done_ids.append(event['id'])  # repeated tap
+                dropped += 1
+        elif open_in is None or event['punched_at'] - open_in['punched_at'] > max_shift:
+            done_ids.append(event['id'])
+            dropped += 1
+            if open_in is not None:
+                done_ids.append(open_in['id'])
+                dropped += 1
+                open_in = None
+        else:
+            shifts.append((event['user_id'], open_in['punched_at'], event['punched_at']))
+            done_ids.extend((open_in['id'], event['id']))
+            open_in = None
+
+        is_last_of_user = i + 1 == len(events) or events[i + 1]['user_id'] != event['user_id']
+        if is_last_of_user and open_in is not None and now - open_in['punched_at'] > max_shift:
+            done_ids.append(open_in['id'])
+            dropped += 1
+            open_in = None
+    return shifts, done_ids, dropped
+
+
+# Appended to "WHERE id = %s" lookups when the caller knows the log's
+# work_date: timesheet is partitioned by year, and the date lets Postgres
+# prune to one partition instead of probing every partition's index
+LOG_DATE_FILTER = "AND work_date = %s"
+
+# Shortest search query that also matches substrings (trigrams need 3)
+SEARCH_MIN_SUBSTRING = 3
+
+
+def like_escape(text):
+    """Escape LIKE wildcards so user input only ever matches literally."""
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+# TIMESHEET READS (SQL shared with async_db.AsyncDatabaseManager)
+
+def log_filters(user_id, before=None, after=None, date_from=None, date_to=None):
+    """
+    WHERE clause for a user's timesheet rows. `before`/`after` are keyset
+    cursors on work_date, which (user_id, work_date) UNIQUE already indexes.
+    """
+    clauses = ["user_id = %s"]
+    params = [user_id]
+    if before:
+        clauses.append("work_date < %s")
+        params.append(before)
+    if after:
+        clauses.append("work_date > %s")
+        params.append(after)
+    if date_from:
+        clauses.append("work_date >= %s")
+        params.append(date_from)
+    if date_to:
+        clauses.append("work_date <= %s")
+        params.append(date_to)
+    return " AND ".join(clauses), params
+
+
+def log_rows_query(user_id, limit=None, before=None, after=None, date_from=None, date_to=None):
+    """SQL and params selecting LogRow columns, formatted by Postgres."""
+    where, params = log_filters(user_id, before, after, date_from, date_to)
+    # Walking forward from `after` reads oldest-first; callers reverse it
+    order = "ASC" if after and not before else "DESC"
+    query = f"""
+        SELECT id,
+               COALESCE(to_char(clock_in, 'HH24:MI'), '') AS clock_in,
+               COALESCE(to_char(clock_out, 'HH24:MI'), '') AS clock_out,
+               COALESCE(to_char(work_date, 'YYYY-MM-DD'), '') AS work_date,
+               task_description,
+               CASE
+                   WHEN work_duration IS NULL OR work_duration = INTERVAL '0' THEN '0h 0m'
+                   ELSE (floor(extract(epoch FROM work_duration))::bigint / 3600 - %s) || 'h '
+                        || (floor(extract(epoch FROM work_duration))::bigint %% 3600 / 60) || 'm'
+               END AS workhour
+        FROM timesheet
+        WHERE {where}
+        ORDER BY timesheet.work_date {order}
+    """
+    params.insert(0, BREAK_HOURS)
+    if limit:
+        query += " LIMIT %s"
+        params.append(limit)
+    return query, params
+
+
+def paginate(logs, page_size, before=None, after=None):
+    """
+    Trim a page_size + 1 fetch to one newest-first page.
+    :return: (logs, newer_cursor, older_cursor)
+    """
+    has_more = len(logs) > page_size
+    logs = logs[:page_size]
+
+    if after and not before:
+        logs.reverse()
+        newer = logs[0].work_date if logs and has_more else None
+        older = logs[-1].work_date if logs else None
+    else:
+        newer = logs[0].work_date if logs and before else None
+        older = logs[-1].work_date if logs and has_more else None
+    return logs, newer, older
+
+
+# DASHBOARD
+
+# Cheap "has anything on this dashboard changed" probe for conditional GETs:
+# timesheet versions and users.updated_at (name, role) of the viewer (and
+# selected user)
+DASHBOARD_STAMP_SQL = statements.declare('dashboard_stamp', """
+    SELECT coalesce(v.versions, '') AS versions,
+           coalesce(u.users, '') AS users,
+           greatest(v.updated_at, u.updated_at) AS updated_at
+    FROM (
+        SELECT string_agg(user_id || ':' || version, ',' ORDER BY user_id) AS versions,
+               max(updated_at) AS updated_at
+        FROM timesheet_versions
+        WHERE user_id = ANY(%(user_ids)s)
+    ) v, (
+        SELECT string_agg(id || ':' || extract(epoch FROM updated_at), ',' ORDER BY id) AS users,
+               max(updated_at) AS updated_at
+        FROM users
+        WHERE id = ANY(%(user_ids)s)
+    ) u
+""")
+
+# Everything dashboard.html renders, loaded by DatabaseManager.load_dashboard
+DashboardData = namedtuple(
+    'DashboardData',
+    'username logs newer older target_user_id target_username target_allowed '
+    'target_logs target_newer target_older'
+)
+
+def _json_logs_sql(user_id, page_size, before, after, date_from, date_to):
+    query, params = log_rows_query(user_id, page_size + 1, before, after, date_from, date_to)
+    order = "ASC" if after and not before else "DESC"
+    return f"""
+        (SELECT coalesce(json_agg(r ORDER BY r.work_date {order}), '[]'::json)
+         FROM ({query}) r)""", params
+
+
+def dashboard_query(user_id, user_role, page_size, before=None, after=None, date_from=None,
+                    date_to=None, target_user_id=None, target_before=None, target_after=None):
+    """
+    One statement returning a single row with the viewer's username, their
+    log page and the selected user's log page, the log pages as JSON arrays
+    of LogRow objects. The user picker is a typeahead (search_users).
+    """
+    logs_sql, params = _json_logs_sql(user_id, page_size, before, after, date_from, date_to)
+    columns = ["(SELECT username FROM users WHERE id = %s) AS username", f"{logs_sql} AS logs"]
+    params.insert(0, user_id)
+
+    if user_role in ('admin', 'senior') and target_user_id is not None:
+        # Seniors may only look at normal users' logs
+        allowed = "TRUE" if user_role == 'admin' else "role = 'user'"
+        target_sql, target_params = _json_logs_sql(
+            target_user_id, page_size, target_before, target_after, date_from, date_to)
+        columns.append(f"(SELECT username FROM users WHERE id = %s AND {allowed}) AS target_username")
+        columns.append(f"""
+        CASE WHEN EXISTS (SELECT 1 FROM users WHERE id = %s AND {allowed})
+             THEN {target_sql} END AS target_logs""")
+        params += [target_user_id, target_user_id] + target_params
+
+    return "SELECT " + ",\n".join(columns), params
+
+
+def build_dashboard(row, page_size, before=None, after=None, target_user_id=None,
+                    target_before=None, target_after=None):
+    """Turn a dashboard_query() row into DashboardData."""
+    logs, newer, older = paginate([LogRow(**r) for r in row['logs']], page_size, before, after)
+
+    target_logs, target_newer, target_older = [], None, None
+    target_allowed = False
+    if row.get('target_logs') is not None:
+        target_allowed = True
+        target_logs, target_newer, target_older = paginate(
+            [LogRow(**r) for r in row['target_logs']], page_size, target_before, target_after)
+
+    return DashboardData(
+        username=row['username'] or '',
+        logs=logs,
+        newer=newer,
+        older=older,
+        target_user_id=target_user_id,
+        target_username=row.get('target_username'),
+        target_allowed=target_allowed,
+        target_logs=target_logs,
+        target_newer=target_newer,
+        target_older=target_older,
+    )
+
+
+# Used by DatabaseManager.verify_otp once the code itself has been checked
+VERIFY_OTP_SQL = statements.declare('verify_otp', """
+    WITH used AS (
+        UPDATE user_otp SET is_used = TRUE
+        WHERE id = %(otp_id)s AND is_used = FALSE
+        RETURNING user_id
+    ),
+    verified AS (
+        UPDATE users SET is_verified = TRUE
+        WHERE %(verify_email)s AND id IN (SELECT user_id FROM used) AND NOT is_verified
+    )
+    SELECT user_id FROM used
+""")
+
+# The other hot fixed statements: sign-in, sessions, OTPs, API tokens, add_log
+LOGIN_USER_SQL = statements.declare('login_user', """
+    SELECT id, username, email, password_hash, role, is_verified
+    FROM users
+    WHERE email = %s
+""")
+
+USER_BY_ID_SQL = statements.declare('user_by_id', """
+    SELECT id, username, email, role, is_verified
+    FROM users
+    WHERE id = %s
+""")
+
+LOAD_SESSION_SQL = statements.declare('load_session', """
+    SELECT data, expires_at FROM user_sessions
+    WHERE sid = %s AND expires_at > CURRENT_TIMESTAMP
+""")
+
+SAVE_SESSION_SQL = statements.declare('save_session', """
+    INSERT INTO user_sessions (sid, user_id, data, expires_at)
+    VALUES (%s, %s, %s, %s)
+    ON CONFLICT (sid) DO UPDATE
+    SET user_id = EXCLUDED.user_id,
+        data = EXCLUDED.data,
+        expires_at = EXCLUDED.expires_at
+""")
+
+INSERT_OTP_SQL = statements.declare('insert_otp', """
+    INSERT INTO user_otp (user_id, otp_hash, purpose, expires_at)
+    VALUES (%s, %s, %s, %s)
+    RETURNING id
+""")
+
+LATEST_OTP_SQL = statements.declare('latest_otp', """
+    SELECT id, otp_hash, expires_at, is_used
+    FROM user_otp
+    WHERE user_id = %s AND purpose = %s AND is_used = FALSE
+    ORDER BY created_at DESC
+    LIMIT 1
+""")
+
+API_TOKEN_USER_SQL = statements.declare('api_token_user', """
+    SELECT t.id AS token_id, u.id AS user_id, u.username, u.role
+    FROM api_tokens t
+    JOIN users u ON u.id = t.user_id
+    WHERE t.token_hash = %s AND t.revoked_at IS NULL
+""")
+
+# Run in add_log / update_log's transaction: any year may be written, except
+# archived ones (psycopg2.errors.ObjectNotInPrerequisiteState)
+ENSURE_PARTITION_SQL = statements.declare('ensure_partition', """
+    SELECT ensure_timesheet_partition(extract(year FROM %s::date)::int)
+""")
+
+INSERT_LOG_SQL = statements.declare('insert_log', """
+    INSERT INTO timesheet
+    (user_id, clock_in, clock_out, work_duration, work_date, task_description)
+    VALUES (%s, %s, %s, %s, %s, %s)
+    ON CONFLICT (user_id, work_date) DO NOTHING
+    RETURNING id
+""")
+
+
+# OTP HASHING
+
+class HmacOtpHasher:
+    """
+    Keyed HMAC-SHA256 for OTPs. A 6-digit code that lives 10 minutes gains
+    nothing from a slow KDF; the server secret is what stops offline guessing.
+    Hashes written by the werkzeug backend still verify.
+    """
+    prefix = 'hmac-sha256$'
+
+    def __init__(self, secret):
+        if not secret:
+            raise ValueError("HmacOtpHasher needs a non-empty secret")
+        self.secret = secret.encode() if isinstance(secret, str) else secret
+
+    def hash(self, otp):
+        digest = hmac.new(self.secret, otp.encode(), hashlib.sha256).hexdigest()
+        return self.prefix + digest
+
+    def verify(self, otp_hash, otp):
+        if otp_hash.startswith(self.prefix):
+            return hmac.compare_digest(otp_hash, self.hash(otp))
+        return check_password_hash(otp_hash, otp)
+
+
+class WerkzeugOtpHasher:
+    """The original behaviour: werkzeug's default password hash (scrypt)."""
+
+    def hash(self, otp):
+        return generate_password_hash(otp)
+
+    def verify(self, otp_hash, otp):
+        if otp_hash.startswith(HmacOtpHasher.prefix):
+            return False
+        return check_password_hash(otp_hash, otp)
+
+
+def otp_hasher_from_env():
+    """
+    OTP_HASHER=hmac (default when OTP_SECRET is set) or werkzeug.
+    All workers must share OTP_SECRET for HMAC hashes to verify.
+    """
+    backend = os.getenv('OTP_HASHER', 'hmac' if os.getenv('OTP_SECRET') else 'werkzeug')
+    if backend == 'hmac':
+        return HmacOtpHasher(os.getenv('OTP_SECRET'))
+    if backend == 'werkzeug':
+        return WerkzeugOtpHasher()
+    raise ValueError(f"Unknown OTP_HASHER: {backend}")
+
+
+_otp_hasher = None
+
+
+def default_otp_hasher():
+    global _otp_hasher
+    if _otp_hasher is None:
+        _otp_hasher = otp_hasher_from_env()
+    return _otp_hasher
+
+
+# USER DIRECTORY CACHE
+# list_users / get_users_by_role / get_user_by_id results. Any write to users
+# clears the whole thing; those writes are rare next to dashboard reads.
+# USER_CACHE_PATH points several worker processes at one shared sqlite file.
+
+user_cache = TTLCache(
+    maxsize=int(os.getenv('USER_CACHE_SIZE', 1024)),
+    ttl=float(os.getenv('USER_CACHE_TTL', 60)),
+    backend=SqliteBackend(os.getenv('USER_CACHE_PATH'), namespace='users')
+    if os.getenv('USER_CACHE_PATH') else None
+)
+
+# SERVER-SIDE SESSIONS
+# Front LRU for user_sessions lookups, keyed by hashed session id. Revoking a
+# user's sessions clears it; with SESSION_CACHE_PATH the clear reaches every
+# worker process, otherwise other processes may serve a revoked session for
+# up to SESSION_CACHE_TTL seconds.
+
+session_cache = TTLCache(
+    maxsize=int(os.getenv('SESSION_CACHE_SIZE', 10000)),
+    ttl=float(os.getenv('SESSION_CACHE_TTL', 30)),
+    backend=SqliteBackend(os.getenv('SESSION_CACHE_PATH'), namespace='sessions')
+    if os.getenv('SESSION_CACHE_PATH') else None
+)
+
+
+# QUERY INSTRUMENTATION
+# Every statement goes through an instrumented cursor that reports to its
+# DatabaseManager: per-manager (so per-request) counts and timings, a
+# histogram per DatabaseManager method, and slow queries logged with their
+# EXPLAIN plan once they take SLOW_QUERY_MS or longer (0 turns that off).
+
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 200))
+
+# Per-statement timings kept on each DatabaseManager; counts stay exact past this
+MAX_RECORDED_STATEMENTS = 100
+
+metrics.describe('db_query_duration_seconds', 'SQL statement latency by DatabaseManager method')
+metrics.describe('db_query_errors_total', 'SQL statements that raised, by DatabaseManager method')
+metrics.describe('db_slow_queries_total', 'Statements at or over SLOW_QUERY_MS, by DatabaseManager method')
+
+
+class _InstrumentedMixin:
+    manager = None
+
+    def execute(self, query, vars=None):
+        sql, args = query, vars
+        if isinstance(query, Statement) and self.manager is not None and self.manager.prepare_statements:
+            sql, args = statements.prepared(self, query, vars)
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = super().execute(sql, args)
+            failed = False
+            return result
+        finally:
+            if self.manager is not None:
+                self.manager._record_query(query, vars, time.perf_counter() - started, failed)
+
+    def copy_expert(self, sql, file, size=8192):
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = super().copy_expert(sql, file, size)
+            failed = False
+            return result
+        finally:
+            if self.manager is not None:
+                self.manager._record_query(sql, None, time.perf_counter() - started, failed, explain=False)
+
+
+class InstrumentedDictCursor(_InstrumentedMixin, RealDictCursor):
+    pass
+
+
+class InstrumentedTupleCursor(_InstrumentedMixin, TupleCursor):
+    pass
+
+
+def instrumented(cls):
+    """
+    Class decorator: public DatabaseManager methods note their name while
+    they run, so each statement is attributed to the method that issued it.
+    The outermost call wins when methods call each other.
+    """
+    def wrap(name, fn):
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def gen_wrapper(self, *args, **kwargs):
+                outer = self._current_method
+                self._current_method = outer or name
+                try:
+                    yield from fn(self, *args, **kwargs)
+                finally:
+                    self._current_method = outer
+            return gen_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            outer = self._current_method
+            self._current_method = outer or name
+            try:
+                return fn(self, *args, **kwargs)
+            finally:
+                self._current_method = outer
+        return wrapper
+
+    for name, fn in list(vars(cls).items()):
+        if name.startswith('_') or not inspect.isfunction(fn) or name in ('close', 'transaction', 'on_commit'):
+            continue
+        setattr(cls, name, wrap(name, fn))
+    return cls
+
+
+# CONNECTION POOL
+
+class PoolTimeout(PoolError):
+    """Raised when no connection becomes free within the checkout timeout."""
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of psycopg2 connections shared by the whole process.
+
+    :param minconn: Connections opened up front and kept around
+    :param maxconn: Hard cap on open connections
+    :param timeout: Seconds getconn() waits for a free connection
+    :param ping_after: Idle seconds after which a connection is pinged
+                       with SELECT 1 before being handed out
+    :param conn_kwargs: Passed straight to psycopg2.connect
+    """
+
+    def __init__(self, minconn=1, maxconn=10, timeout=5.0, ping_after=30.0, **conn_kwargs):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("Invalid pool size: need 0 <= minconn <= maxconn, maxconn >= 1")
+
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self.conn_kwargs = conn_kwargs
+
+        self._cond = threading.Condition()   # RLock based, so helpers may re-enter
+        self._idle = []        # (conn, returned_at), most recently used last
+        self._size = 0         # open + reserved connections
+        self._waiting = 0
+        self._closed = False
+        self._counters = {
+            'checkouts': 0,
+            'timeouts': 0,
+            'created': 0,
+            'discarded': 0,
+            'health_check_failures': 0,
+            'wait_seconds_total': 0.0,
+        }
+
+        for _ in range(minconn):
+            self._idle.append((self._connect(), time.monotonic()))
+            self._size += 1
+
+    def _connect(self):
+        conn = psycopg2.connect(connection_factory=PreparingConnection, **self.conn_kwargs)
+        with self._cond:
+            self._counters['created'] += 1
+        return conn
+
+    def _is_healthy(self, conn, idle_for):
+        if conn.closed:
+            return False
+        if idle_for < self.ping_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        with self._cond:
+            self._counters['discarded'] += 1
+
+    def getconn(self, timeout=None):
+        """
+        Check a connection out of the pool, waiting up to `timeout` seconds.
+        Idle connections are health checked before being returned.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolError("Connection pool is closed")
+                if self._idle:
+                    conn, returned_at = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    # Reserve a slot and connect outside the lock
+                    self._size += 1
+                    conn, returned_at = None, None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._counters['timeouts'] += 1
+                    raise PoolTimeout(f"No database connection available within {timeout}s")
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+            self._counters['checkouts'] += 1
+            self._counters['wait_seconds_total'] += time.monotonic() - started
+
+        if conn is not None and not self._is_healthy(conn, time.monotonic() - returned_at):
+            with self._cond:
+                self._counters['health_check_failures'] += 1
+            self._discard(conn)
+            conn = None
+
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+        return conn
+
+    def putconn(self, conn, close=False):
+        """
+        Return a connection to the pool. Any open transaction is rolled back
+        so the next borrower starts clean.
+        """
+        if not conn.closed and not close:
+            status = conn.get_transaction_status()
+            if status == TRANSACTION_STATUS_UNKNOWN:
+                close = True
+            elif status != TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    close = True
+
+        with self._cond:
+            if close or conn.closed or self._closed:
+                self._discard(conn)
+                self._size -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            for conn, _ in self._idle:
+                self._discard(conn)
+            self._size -= len(self._idle)
+            self._idle = []
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._counters)
+            stats.update(
+                minconn=self.minconn,
+                maxconn=self.maxconn,
+                size=self._size,
+                idle=len(self._idle),
+                in_use=self._size - len(self._idle),
+                waiting=self._waiting,
+                closed=self._closed,
+            )
+        return stats
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def init_pool(minconn=1, maxconn=10, timeout=5.0, **conn_kwargs):
+    """Create the process-wide pool (once) and return it."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(minconn=minconn, maxconn=maxconn, timeout=timeout, **conn_kwargs)
+        return _pool
+
+
+def get_pool():
+    return _pool
+
+
+# READ REPLICAS
+
+# Seconds a replica that failed to connect or lost its connection sits out
+REPLICA_RETRY_AFTER = float(os.getenv('REPLICA_RETRY_AFTER', 30))
+REPLICA_CONNECT_TIMEOUT = int(os.getenv('REPLICA_CONNECT_TIMEOUT', 2))
+
+metrics.describe('db_routed_reads_total', 'Replica-eligible DatabaseManager calls by the server that ran them')
+metrics.describe('db_replica_ejections_total', 'Replicas taken out of rotation after a connection failure')
+
+
+def parse_lsn(lsn):
+    """'16/B374D848' (pg_lsn as text) -> int, so positions compare in Python."""
+    high, _, low = lsn.partition('/')
+    return (int(high, 16) << 32) | int(low, 16)
 
+
+class Replica:
+
+    def __init__(self, name, pool):
+        self.name = name
+        self.pool = pool
+        self.down_until = 0.0
+        self.ejections = 0
+        # Highest WAL position seen replayed (parse_lsn int); only grows
+        self.replayed = 0
+
+
+class ReplicaSet:
+    """
+    Streaming replicas for the read-only DatabaseManager methods, used
+    round-robin. A replica that fails to connect, or whose connection breaks
+    mid-read, is ejected for `retry_after` seconds; with every replica out,
+    reads simply go to the primary.
+
+    :param conn_kwargs: One psycopg2.connect kwargs dict per replica
+    :param pool_kwargs: maxconn / timeout / ping_after for each replica's
+                        ConnectionPool (minconn is always 0, so a replica
+                        that is down at startup does not stop the app)
+    """
+
+    def __init__(self, conn_kwargs, retry_after=REPLICA_RETRY_AFTER, **pool_kwargs):
+        pool_kwargs['minconn'] = 0
+        self.replicas = [
+            Replica(f"{kwargs.get('host', 'localhost')}:{kwargs.get('port', 5432)}",
+                    ConnectionPool(**pool_kwargs, **kwargs))
+            for kwargs in conn_kwargs
+        ]
+        self.retry_after = retry_after
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def checkout(self, min_lsn=0):
+        """
+        Borrow a connection from the next healthy replica that has replayed
+        WAL up to min_lsn (read-your-writes).
+
+        :return: (replica, conn), or (None, None) when the primary has to serve
+        """
+        with self._lock:
+            start = self._next
+            self._next = (start + 1) % len(self.replicas)
+
+        now = time.monotonic()
+        for offset in range(len(self.replicas)):
+            replica = self.replicas[(start + offset) % len(self.replicas)]
+            if replica.down_until > now:
+                continue
+            try:
+                conn = replica.pool.getconn()
+            except PoolTimeout:
+                continue   # busy, not broken
+            except psycopg2.Error as e:
+                self.eject(replica, e)
+                continue
+            try:
+                if replica.replayed < min_lsn:
+                    replica.replayed = max(replica.replayed, self._replay_position(conn))
+            except psycopg2.Error as e:
+                replica.pool.putconn(conn, close=True)
+                self.eject(replica, e)
+                continue
+            if replica.replayed >= min_lsn:
+                return replica, conn
+            replica.pool.putconn(conn)
+        return None, None
+
+    def _replay_position(self, conn):
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_last_wal_replay_lsn()::text")
+            lsn = cur.fetchone()[0]
+        # NULL: not in recovery (promoted), so there is nothing left to wait for
+        return parse_lsn(lsn) if lsn else float('inf')
+
+    def release(self, replica, conn, broken=False):
+        replica.pool.putconn(conn, close=broken)
+        if broken:
+            self.eject(replica, "connection lost")
+
+    def eject(self, replica, reason):
+        replica.down_until = time.monotonic() + self.retry_after
+        replica.ejections += 1
+        metrics.inc('db_replica_ejections_total', {'replica': replica.name})
+        logger.warning("replica %s out of rotation for %.0fs: %s", replica.name, self.retry_after, reason)
+
+    def stats(self):
+        now = time.monotonic()
+        return [
+            dict(replica.pool.stats(), name=replica.name, healthy=replica.down_until <= now,
+                 ejections=replica.ejections)
+            for replica in self.replicas
+        ]
+
+
+_replicas = None
+
+
+def init_replicas(dsns, defaults=None, **pool_kwargs):
+    """
+    Create the process-wide ReplicaSet (once) and return it.
+
+    :param dsns: libpq connection strings ("host=replica1 port=5432");
+                 settings they leave out are taken from defaults
+    """
+    global _replicas
+    with _pool_lock:
+        if _replicas is None:
+            conn_kwargs = [
+                {**(defaults or {}), 'connect_timeout': REPLICA_CONNECT_TIMEOUT, **parse_dsn(dsn)}
+                for dsn in dsns
+            ]
+            _replicas = ReplicaSet(conn_kwargs, **pool_kwargs)
+        return _replicas
+
+
+def get_replicas():
+    return _replicas
+
+
+def reads_from_replica(fn):
+    """
+    DatabaseManager method decorator: run the method on a replica when the
+    manager has a ReplicaSet, is outside transaction(), has not written
+    anything yet and a replica has replayed min_lsn. Otherwise, or when
+    the replica's connection breaks during the call, it runs on the primary.
+    """
+    @functools.wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        if self.replicas is None or self._on_replica or self._tx_depth or self.wrote \
+                or not self._checkout_replica():
+            if self.replicas is not None and not self._on_replica:
+                metrics.inc('db_routed_reads_total', {'server': 'primary'})
+            return fn(self, *args, **kwargs)
+
+        primary = self.conn, self.cursor
+        self.conn, self.cursor = self._replica_conn, self._replica_cursor
+        self._on_replica = True
+        try:
+            result = fn(self, *args, **kwargs)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError, TransactionRollbackError):
+            # Lost connection, or a query cancelled by recovery conflict: retry on the primary
+            self.conn, self.cursor = primary
+            self._on_replica = False
+            self._release_replica()
+            metrics.inc('db_routed_reads_total', {'server': 'primary'})
+            return fn(self, *args, **kwargs)
+        except Exception:
+            # e.g. a SQL error: end the aborted transaction, or the next
+            # routed read fails with "current transaction is aborted"
+            try:
+                self._replica_conn.rollback()
+            except psycopg2.Error:
+                self._release_replica()
+            raise
+        finally:
+            self.conn, self.cursor = primary
+            self._on_replica = False
+        metrics.inc('db_routed_reads_total', {'server': 'replica'})
+        return result
+    return wrapper
+
+
+@instrumented
 class DatabaseManager:
 
     def __init__(
@@ -13,16 +973,221 @@ class DatabaseManager:
         dbname="log_tracker",
         user="postgres",
         password="pyp123",
-        port=5432
+        port=5432,
+        pool=None,
+        otp_hasher=None,
+        replicas=None,
+        min_lsn=None,
+        prepare_statements=PREPARED_STATEMENTS
     ):
-        self.conn = psycopg2.connect(
-            host=host,
-            dbname=dbname,
-            user=user,
-            password=password,
-            port=port
-        )
-        self.cursor = self.conn.cursor(cursor_factory=RealDictCursor)
+        """
+        :param replicas: ReplicaSet for the @reads_from_replica methods
+        :param min_lsn: pg_lsn text; replicas serve this manager only once
+                        they have replayed it (the caller's last write_lsn())
+        :param prepare_statements: Run declared statements (statements.py)
+                                   as PREPARE / EXECUTE
+        """
+        self.otp_hasher = otp_hasher or default_otp_hasher()
+        self.prepare_statements = prepare_statements
+
+        # With a pool the connection is borrowed and must be given back via close()
+        self.pool = pool
+        if pool is not None:
+            self.conn = pool.getconn()
+        else:
+            self.conn = psycopg2.connect(
+                connection_factory=PreparingConnection,
+                host=host,
+                dbname=dbname,
+                user=user,
+                password=password,
+                port=port
+            )
+        self.replicas = replicas
+        self.min_lsn = min_lsn
+        self.wrote = False
+        self._replica = self._replica_conn = self._replica_cursor = None
+        self._replica_tried = False
+        self._on_replica = False
+        self._current_method = None
+        self._tx_depth = 0
+        self._after_commit = []
+        self.query_stats = {'count': 0, 'errors': 0, 'seconds': 0.0, 'commits': 0, 'statements': []}
+        self.cursor = self._new_cursor(InstrumentedDictCursor)
+
+    def _new_cursor(self, factory=InstrumentedTupleCursor, name=None):
+        cur = self.conn.cursor(name=name, cursor_factory=factory)
+        cur.manager = self
+        return cur
+
+    def _record_query(self, query, params, elapsed, failed, explain=True):
+        method = self._current_method or 'unknown'
+        stats = self.query_stats
+        stats['count'] += 1
+        stats['seconds'] += elapsed
+        if failed:
+            stats['errors'] += 1
+            metrics.inc('db_query_errors_total', {'method': method})
+        if len(stats['statements']) < MAX_RECORDED_STATEMENTS:
+            stats['statements'].append((method, elapsed))
+        metrics.observe('db_query_duration_seconds', elapsed, {'method': method})
+
+        if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS and not failed:
+            metrics.inc('db_slow_queries_total', {'method': method})
+            plan = self._explain(query, params) if explain else None
+            logger.warning(
+                "slow query in %s: %.1fms\n%s%s", method, elapsed * 1000,
+                " ".join(str(query).split()),
+                "\nplan:\n" + plan if plan else ""
+            )
+
+    def _explain(self, query, params):
+        """Plain EXPLAIN (no ANALYZE, so nothing runs twice) on an uninstrumented cursor."""
+        text = query.decode() if isinstance(query, bytes) else str(query)
+        if text.lstrip().split(None, 1)[0].upper() not in ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE'):
+            return None
+        if self.conn.get_transaction_status() == TRANSACTION_STATUS_INERROR:
+            return None
+        # Savepoint so a failing EXPLAIN cannot abort the caller's transaction
+        with self.conn.cursor() as cur:
+            cur.execute("SAVEPOINT slow_query_explain")
+            try:
+                cur.execute("EXPLAIN " + text, params)
+                plan = "\n".join(row[0] for row in cur.fetchall())
+            except psycopg2.Error as e:
+                cur.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+                plan = f"(EXPLAIN failed: {e})"
+            cur.execute("RELEASE SAVEPOINT slow_query_explain")
+        return plan
+
+    # UNIT OF WORK
+
+    @contextlib.contextmanager
+    def transaction(self, savepoint=True):
+        """
+        Run a block of manager calls as one transaction with a single COMMIT.
+
+            with db.transaction():
+                otp = db.generate_otp(user['id'])
+                db.enqueue_email(email, subject, body)
+
+        Mutating methods use this too, so outside a block they still commit
+        on their own. Inside one they only get a savepoint: a method that
+        handles its own failure (add_log() -> "duplicate") undoes just its
+        statements, while an exception escaping the block rolls it all back.
+        Methods that never swallow errors pass savepoint=False and simply
+        join the enclosing block.
+        """
+        if self._tx_depth and not savepoint:
+            yield self
+            return
+
+        if self._tx_depth:
+            name = f"uow_{self._tx_depth}"
+            self.cursor.execute(f"SAVEPOINT {name}")
+            self._tx_depth += 1
+            try:
+                yield self
+            except BaseException:
+                self.cursor.execute(f"ROLLBACK TO SAVEPOINT {name}")
+                raise
+            else:
+                self.cursor.execute(f"RELEASE SAVEPOINT {name}")
+            finally:
+                self._tx_depth -= 1
+            return
+
+        self._tx_depth = 1
+        try:
+            yield self
+        except BaseException:
+            self._tx_depth = 0
+            self._after_commit.clear()
+            self.conn.rollback()
+            raise
+        self._tx_depth = 0
+        self._commit()
+
+    def on_commit(self, fn):
+        """Call fn once the current transaction commits (now, if there is none)."""
+        if self._tx_depth:
+            self._after_commit.append(fn)
+        else:
+            fn()
+
+    def _commit(self, wrote=True):
+        self.conn.commit()
+        if wrote:
+            self.wrote = True
+        self.query_stats['commits'] += 1
+        callbacks, self._after_commit = self._after_commit, []
+        for fn in callbacks:
+            fn()
+
+    # REPLICA ROUTING
+
+    def _checkout_replica(self):
+        """Borrow a replica connection, at most one attempt per manager."""
+        if self._replica_conn is None and not self._replica_tried:
+            self._replica_tried = True
+            min_lsn = parse_lsn(self.min_lsn) if self.min_lsn else 0
+            self._replica, self._replica_conn = self.replicas.checkout(min_lsn)
+            if self._replica_conn is not None:
+                self._replica_cursor = self._replica_conn.cursor(cursor_factory=InstrumentedDictCursor)
+                self._replica_cursor.manager = self
+        return self._replica_conn is not None
+
+    def _release_replica(self):
+        if self._replica_conn is None:
+            return
+        broken = bool(self._replica_conn.closed)
+        if not broken:
+            try:
+                self._replica_cursor.close()
+            except psycopg2.Error:
+                broken = True
+        self.replicas.release(self._replica, self._replica_conn, broken=broken)
+        self._replica = self._replica_conn = self._replica_cursor = None
+
+    def write_lsn(self):
+        """
+        :return: The primary's WAL position (pg_lsn text) once this manager's
+                 writes are committed, for the next request's min_lsn; None
+                 if it wrote nothing
+        """
+        if not self.wrote:
+            return None
+        self.cursor.execute("SELECT pg_current_wal_lsn()::text AS lsn")
+        return self.cursor.fetchone()['lsn']
+
+    def get_prepared_statements(self):
+        """
+        Postgres' plan cache for this connection's prepared statements:
+        how often each ran on its generic (cached) plan versus a custom one.
+        The plan counters need PostgreSQL 14+.
+        """
+        self.cursor.execute("""
+            SELECT name, prepare_time, generic_plans, custom_plans
+            FROM pg_prepared_statements
+            ORDER BY name
+        """)
+        return [dict(row) for row in self.cursor.fetchall()]
+
+    def close(self):
+        """Release the connection: back to the pool, or closed if unpooled."""
+        self._release_replica()
+        if self.conn is None:
+            return
+        try:
+            self.cursor.close()
+        except psycopg2.Error:
+            pass
+        if self.pool is not None:
+            self.pool.putconn(self.conn)
+        else:
+            self.conn.close()
+        self.conn = None
+        self.cursor = None
 
    
     # USER HELPERS
@@ -50,17 +1215,17 @@ class DatabaseManager:
         return row['is_verified'] if row else None
 
     def insert_user(self, username, email, password, role='user'):
-        hashed_pw = generate_password_hash(password)
+        hashed_pw = passwords.hash_password(password)
         try:
-            self.cursor.execute("""
-                INSERT INTO users (username, email, password_hash, role)
-                VALUES (%s, %s, %s, %s)
-                RETURNING id, username, email, role, is_verified
-            """, (username, email, hashed_pw, role))
-            self.conn.commit()
-            return self.cursor.fetchone()
+            with self.transaction():
+                self.cursor.execute("""
+                    INSERT INTO users (username, email, password_hash, role)
+                    VALUES (%s, %s, %s, %s)
+                    RETURNING id, username, email, role, is_verified
+                """, (username, email, hashed_pw, role))
+                self.on_commit(user_cache.clear)
+                return self.cursor.fetchone()
         except psycopg2.errors.UniqueViolation:
-            self.conn.rollback()
             return None
 
     def get_users_by_role(self, role, requester_role):
@@ -74,27 +1239,37 @@ class DatabaseManager:
         if requester_role not in ('admin', 'senior'):
             return []  # Only admin or senior can fetch users
 
-        self.cursor.execute("""
-            SELECT id, username, email, role, is_verified, created_at
-            FROM users
-            WHERE role = %s
-            ORDER BY username
-        """, (role,))
-        
-        return self.cursor.fetchall()
+        def load():
+            self.cursor.execute("""
+                SELECT id, username, email, role, is_verified, created_at
+                FROM users
+                WHERE role = %s
+                ORDER BY username
+            """, (role,))
+            return [dict(row) for row in self.cursor.fetchall()]
+
+        return user_cache.get_or_load(('users_by_role', role), load)
+
+    def get_user_by_id(self, user_id):
+        def load():
+            self.cursor.execute(USER_BY_ID_SQL, (user_id,))
+            row = self.cursor.fetchone()
+            return dict(row) if row else None
+
+        return user_cache.get_or_load(('user', user_id), load)
 
     def mark_user_verified(self, user_id):
             """
             Mark a user as verified.
             """
             try:
-                query = "UPDATE users SET is_verified = TRUE WHERE id = %s"
-                self.cursor.execute(query, (user_id,))
-                self.conn.commit()
+                with self.transaction():
+                    query = "UPDATE users SET is_verified = TRUE WHERE id = %s AND NOT is_verified"
+                    self.cursor.execute(query, (user_id,))
+                    self.on_commit(user_cache.clear)
                 return True
             except Exception as e:
-                self.conn.rollback()
-                print(f"[DB ERROR] mark_user_verified: {e}")
+                logger.error("mark_user_verified failed: %s", e)
                 return False
 
     def register_user(self, username, email, password):
@@ -107,18 +1282,17 @@ class DatabaseManager:
         return False, "Registration failed"
 
     def login_user(self, email, password):
-        self.cursor.execute("""
-            SELECT id, username, email, password_hash, role, is_verified
-            FROM users
-            WHERE email = %s
-        """, (email,))
+        self.cursor.execute(LOGIN_USER_SQL, (email,))
         user = self.cursor.fetchone()
         if not user:
             return False, "User not found"
         if not user["is_verified"]:
             return False, "Account not verified"
-        if not check_password_hash(user["password_hash"], password):
+        # May raise passwords.HasherBusy; the login route turns that into a 503
+        if not passwords.verify_password(user["password_hash"], password):
             return False, "Invalid password"
+        if passwords.needs_rehash(user["password_hash"]):
+            self._rehash_password(user["id"], password)
         return True, {
             "id": user["id"],
             "username": user["username"],
@@ -143,29 +1317,46 @@ class DatabaseManager:
     #         # Catch any other Python exceptions
     #         return False, f"An unexpected error occurred: {e}"
 
-    def update_user_password(self, email, password):
-        hashed_password = generate_password_hash(password)
-
+    def _rehash_password(self, user_id, password):
+        """Upgrade a hash made under an older PASSWORD_HASH_METHOD; best effort."""
         try:
-            self.cursor.execute("""
-                UPDATE users
-                SET password_hash = %s
-                WHERE email = %s;
-            """, (hashed_password, email))
+            new_hash = passwords.hash_password(password)
+            with self.transaction():
+                self.cursor.execute(
+                    "UPDATE users SET password_hash = %s WHERE id = %s",
+                    (new_hash, user_id)
+                )
+        except passwords.HasherBusy:
+            pass  # try again on the next login
+        except psycopg2.Error as e:
+            logger.warning("password rehash failed for user %s: %s", user_id, e)
 
-            self.conn.commit()  # ✅ VERY IMPORTANT
+    def update_user_password(self, email, password):
+        hashed_password = passwords.hash_password(password)
 
-            if self.cursor.rowcount == 0:
+        try:
+            with self.transaction():
+                self.cursor.execute("""
+                    UPDATE users
+                    SET password_hash = %s
+                    WHERE email = %s
+                    RETURNING id
+                """, (hashed_password, email))
+                updated = self.cursor.fetchone()
+                if updated:
+                    # Anyone holding the old password is logged out everywhere
+                    self.revoke_user_sessions(updated['id'])
+                self.on_commit(user_cache.clear)
+
+            if not updated:
                 return False, "User not found"
 
             return True, "Password updated successfully"
 
         except psycopg2.Error as e:
-            self.conn.rollback()
             return False, f"Database error: {e}"
 
         except Exception as e:
-            self.conn.rollback()
             return False, f"Unexpected error: {e}"
 
 
@@ -175,47 +1366,244 @@ class DatabaseManager:
         # otp = ''.join(random.choices(string.digits, k=6))
         # otp_hash = generate_password_hash(otp)
 
-        otp = str(random.randint(100000, 999999))
-        otp_hash = generate_password_hash(otp)
+        otp = str(100000 + secrets.randbelow(900000))
+        otp_hash = self.otp_hasher.hash(otp)
 
         expires_at = datetime.now() + timedelta(minutes=expiry_minutes)
 
-        self.cursor.execute("""
-            INSERT INTO user_otp (user_id, otp_hash, purpose, expires_at)
-            VALUES (%s, %s, %s, %s)
-            RETURNING id
-        """, (user_id, otp_hash, purpose, expires_at))
-        self.conn.commit()
+        with self.transaction(savepoint=False):
+            self.cursor.execute(INSERT_OTP_SQL, (user_id, otp_hash, purpose, expires_at))
         return otp  # Send this to user via email/SMS
 
     def verify_otp(self, user_id, input_otp, purpose='verify_email'):
         input_otp = str(input_otp).strip()
-        self.cursor.execute("""
-            SELECT id, otp_hash, expires_at, is_used
-            FROM user_otp
-            WHERE user_id = %s AND purpose = %s AND is_used = FALSE
-            ORDER BY created_at DESC
-            LIMIT 1
-        """, (user_id, purpose))
+        self.cursor.execute(LATEST_OTP_SQL, (user_id, purpose))
         row = self.cursor.fetchone()
         if not row:
             return False, "No OTP found"
         if datetime.now() > row['expires_at']:
             return False, "OTP expired"
-        if not check_password_hash(row['otp_hash'], input_otp):
+        if not self.otp_hasher.verify(row['otp_hash'], input_otp):
             return False, "Invalid OTP"
 
-        # Mark OTP used
-        self.cursor.execute("UPDATE user_otp SET is_used = TRUE WHERE id = %s", (row['id'],))
-        self.conn.commit()
-        if purpose == 'verify_email':
-            self.cursor.execute(
-                "UPDATE users SET is_verified = TRUE WHERE id = %s",
-                (user_id,)
-            )
-            self.conn.commit()
+        # Mark the OTP used and, for sign-up, the user verified: one statement,
+        # one commit. is_used = FALSE makes a concurrent second use a no-op.
+        with self.transaction(savepoint=False):
+            self.cursor.execute(VERIFY_OTP_SQL, {
+                'otp_id': row['id'],
+                'verify_email': purpose == 'verify_email',
+            })
+            if self.cursor.fetchone() is None:
+                return False, "OTP already used"
+            if purpose == 'verify_email':
+                self.on_commit(user_cache.clear)
         return True, "OTP verified"
 
+    def purge_otps(self, retention_minutes=60, batch_size=5000):
+        """
+        Delete OTPs that were used or expired more than retention_minutes ago.
+        Works in batches so a large backlog never holds long row locks.
+        :return: Number of rows deleted
+        """
+        total = 0
+        while True:
+            self.cursor.execute("""
+                DELETE FROM user_otp
+                WHERE id IN (
+                    SELECT id FROM user_otp
+                    WHERE (is_used = TRUE OR expires_at < CURRENT_TIMESTAMP)
+                      AND created_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 minute'
+                    LIMIT %s
+                )
+            """, (retention_minutes, batch_size))
+            deleted = self.cursor.rowcount
+            self._commit()
+            total += deleted
+            if deleted < batch_size:
+                return total
+
+
+    # EMAIL OUTBOX
+
+    def enqueue_email(self, to_email, subject, body):
+        with self.transaction(savepoint=False):
+            self.cursor.execute("""
+                INSERT INTO email_outbox (to_email, subject, body)
+                VALUES (%s, %s, %s)
+                RETURNING id
+            """, (to_email, subject, body))
+            return self.cursor.fetchone()['id']
+
+    def claim_emails(self, batch_size=20, lease_seconds=120):
+        """
+        Claim up to batch_size due messages for one worker. Claimed rows are
+        pushed lease_seconds into the future so a crashed worker's batch is
+        picked up again once the lease runs out.
+        """
+        self.cursor.execute("""
+            UPDATE email_outbox
+            SET attempts = attempts + 1,
+                next_attempt_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 second'
+            WHERE id IN (
+                SELECT id FROM email_outbox
+                WHERE status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP
+                ORDER BY next_attempt_at
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, to_email, subject, body, attempts
+        """, (lease_seconds, batch_size))
+        rows = self.cursor.fetchall()
+        self._commit()
+        return rows
+
+    def mark_emails_sent(self, email_ids):
+        if not email_ids:
+            return
+        self.cursor.execute("""
+            UPDATE email_outbox
+            SET status = 'sent', sent_at = CURRENT_TIMESTAMP, last_error = NULL
+            WHERE id = ANY(%s)
+        """, (list(email_ids),))
+        self._commit()
+
+    def reschedule_email(self, email_id, error, retry_in_seconds=None):
+        """Retry after retry_in_seconds, or mark failed for good when it is None."""
+        if retry_in_seconds is None:
+            self.cursor.execute("""
+                UPDATE email_outbox SET status = 'failed', last_error = %s WHERE id = %s
+            """, (error, email_id))
+        else:
+            self.cursor.execute("""
+                UPDATE email_outbox
+                SET last_error = %s,
+                    next_attempt_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 second'
+                WHERE id = %s
+            """, (error, retry_in_seconds, email_id))
+        self._commit()
+
+
+    # SESSIONS (see sessions.py)
+
+    def load_session(self, sid):
+        """
+        :return: (data dict, expires_at) for a live session, else None.
+                 Misses are not cached, so random or expired cookies cannot
+                 evict live sessions from session_cache.
+        """
+        key = ('session', sid)
+        entry = session_cache.get(key)
+        if entry is None:
+            self.cursor.execute(LOAD_SESSION_SQL, (sid,))
+            row = self.cursor.fetchone()
+            if row is None:
+                return None
+            entry = (row['data'], row['expires_at'])
+            session_cache.set(key, entry)
+        if entry[1] <= datetime.now():
+            return None
+        return entry
+
+    def save_session(self, sid, user_id, data, expires_at):
+        with self.transaction(savepoint=False):
+            self.cursor.execute(SAVE_SESSION_SQL, (sid, user_id, Json(data), expires_at))
+        session_cache.set(('session', sid), (data, expires_at))
+
+    def delete_session(self, sid):
+        with self.transaction(savepoint=False):
+            self.cursor.execute("DELETE FROM user_sessions WHERE sid = %s", (sid,))
+        # Tombstone rather than a miss, so no process keeps serving the old entry
+        session_cache.set(('session', sid), None)
+
+    def revoke_user_sessions(self, user_id):
+        """Log a user out everywhere, API tokens included. :return: Number of sessions removed"""
+        with self.transaction(savepoint=False):
+            self.cursor.execute("DELETE FROM user_sessions WHERE user_id = %s", (user_id,))
+            revoked = self.cursor.rowcount
+            self.cursor.execute("""
+                UPDATE api_tokens SET revoked_at = CURRENT_TIMESTAMP
+                WHERE user_id = %s AND revoked_at IS NULL
+            """, (user_id,))
+            self.on_commit(session_cache.clear)
+        return revoked
+
+    def purge_sessions(self, batch_size=5000):
+        """Delete expired sessions in batches. :return: Number of rows deleted"""
+        total = 0
+        while True:
+            self.cursor.execute("""
+                DELETE FROM user_sessions
+                WHERE sid IN (
+                    SELECT sid FROM user_sessions
+                    WHERE expires_at < CURRENT_TIMESTAMP
+                    LIMIT %s
+                )
+            """, (batch_size,))
+            deleted = self.cursor.rowcount
+            self._commit()
+            total += deleted
+            if deleted < batch_size:
+                return total
+
+
+    # API TOKENS (see api.py)
+
+    def create_api_token(self, user_id, name, token_hash):
+        """Store a new token; only its SHA-256 is kept. :return: Token id"""
+        with self.transaction(savepoint=False):
+            self.cursor.execute("""
+                INSERT INTO api_tokens (user_id, name, token_hash)
+                VALUES (%s, %s, %s)
+                RETURNING id
+            """, (user_id, name, token_hash))
+            return self.cursor.fetchone()['id']
+
+    def get_api_token_user(self, token_hash):
+        """
+        :return: dict(token_id, user_id, username, role) for a live token, else
+                 None. Live tokens are cached in session_cache, unknown ones
+                 are not (garbage tokens must not evict real entries).
+                 last_used_at is only written on a cache miss, so at most
+                 once per SESSION_CACHE_TTL.
+        """
+        key = ('api_token', token_hash)
+        user = session_cache.get(key)
+        if user is not None:
+            return user
+
+        self.cursor.execute(API_TOKEN_USER_SQL, (token_hash,))
+        row = self.cursor.fetchone()
+        if row is None:
+            return None
+        user = dict(row)
+        self._touch_api_token(user['token_id'])
+        session_cache.set(key, user)
+        return user
+
+    def _touch_api_token(self, token_id):
+        """
+        Bump last_used_at. Bookkeeping, not a write the request has to read
+        back, so it does not set `wrote` (which would keep the request's
+        reads, and the session's next ones, off the replicas).
+        """
+        self.cursor.execute(
+            "UPDATE api_tokens SET last_used_at = CURRENT_TIMESTAMP WHERE id = %s", (token_id,)
+        )
+        if not self._tx_depth:
+            self._commit(wrote=False)
+
+    def revoke_api_token(self, token_id, user_id):
+        """:return: True if a live token of user_id was revoked"""
+        with self.transaction(savepoint=False):
+            self.cursor.execute("""
+                UPDATE api_tokens SET revoked_at = CURRENT_TIMESTAMP
+                WHERE id = %s AND user_id = %s AND revoked_at IS NULL
+                RETURNING token_hash
+            """, (token_id, user_id))
+            row = self.cursor.fetchone()
+            if row:
+                self.on_commit(lambda: session_cache.set(('api_token', row['token_hash']), None))
+        return row is not None
    
     # ADMIN / SENIOR HELPERS
    
@@ -228,22 +1616,66 @@ class DatabaseManager:
     def list_users(self, requester_role):
         if requester_role not in ('admin', 'senior'):
             return []
-        self.cursor.execute("""
-            SELECT id, username, email, role, is_verified, created_at
-            FROM users
-            ORDER BY role DESC, username
-        """)
-        return self.cursor.fetchall()
+
+        def load():
+            self.cursor.execute("""
+                SELECT id, username, email, role, is_verified, created_at
+                FROM users
+                ORDER BY role DESC, username
+            """)
+            return [dict(row) for row in self.cursor.fetchall()]
+
+        return user_cache.get_or_load(('users', 'all'), load)
+
+    def search_users(self, query, requester_role, limit=10):
+        """
+        Typeahead for the user pickers: username or email prefix matches
+        first (lower(...) text_pattern_ops indexes), then, for queries of
+        SEARCH_MIN_SUBSTRING+ characters, username substrings (trigram
+        index). Admins find everyone, seniors only 'user' accounts.
+
+        :return: Up to limit dicts of id, username, email, role
+        """
+        query = (query or '').strip().lower()
+        if requester_role not in ('admin', 'senior') or not query:
+            return []
+
+        def load():
+            escaped = like_escape(query)
+            params = {'prefix': f"{escaped}%", 'pattern': f"%{escaped}%", 'limit': limit}
+            match = "lower(username) LIKE %(prefix)s OR lower(email) LIKE %(prefix)s"
+            if len(query) >= SEARCH_MIN_SUBSTRING:
+                match += " OR username ILIKE %(pattern)s"
+            scope = "TRUE" if requester_role == 'admin' else "role = 'user'"
+            self.cursor.execute(f"""
+                SELECT id, username, email, role
+                FROM users
+                WHERE ({match}) AND {scope}
+                ORDER BY lower(username) LIKE %(prefix)s DESC, username, id
+                LIMIT %(limit)s
+            """, params)
+            return [dict(row) for row in self.cursor.fetchall()]
+
+        # Everyone types the same few first letters; user_cache is cleared on user changes
+        return user_cache.get_or_load(('user_search', requester_role, query, limit), load)
    
     # TIMESHEET / LOG HELPERS
 
-    def get_logs(self, user_id):
-        self.cursor.execute("""
+    @reads_from_replica
+    def get_logs(self, user_id, limit=None, before=None, after=None, date_from=None, date_to=None):
+        where, params = log_filters(user_id, before, after, date_from, date_to)
+        # Walking forward from `after` reads oldest-first; callers reverse it
+        order = "ASC" if after and not before else "DESC"
+        query = f"""
             SELECT id, clock_in, clock_out, work_date, task_description, work_duration
             FROM timesheet
-            WHERE user_id = %s
-            ORDER BY work_date DESC
-        """, (user_id,))
+            WHERE {where}
+            ORDER BY work_date {order}
+        """
+        if limit:
+            query += " LIMIT %s"
+            params.append(limit)
+        self.cursor.execute(statements.for_sql(query), params)
             
         logs = self.cursor.fetchall()
         logs_with_hours = []
@@ -253,8 +1685,6 @@ class DatabaseManager:
             log['clock_in'] = log['clock_in'].strftime("%H:%M") if log['clock_in'] else ''
             log['clock_out'] = log['clock_out'].strftime("%H:%M") if log['clock_out'] else ''
 
-            BREAK_HOURS = 1
-
             # Use DB duration directly
             if log['work_duration']:
                 total_seconds = int(log['work_duration'].total_seconds())
@@ -271,70 +1701,178 @@ class DatabaseManager:
 
         return logs_with_hours
 
-    def get_log_by_id(self, log_id):
-        self.cursor.execute("""
+    @reads_from_replica
+    def get_log_rows(self, user_id, limit=None, before=None, after=None, date_from=None, date_to=None):
+        """
+        Same rows and filters as get_logs, but clock times, work_date and the
+        workhour string (BREAK_HOURS deducted) are formatted by Postgres and
+        returned as LogRow tuples, so there is no per-row Python work.
+        """
+        query, params = log_rows_query(user_id, limit, before, after, date_from, date_to)
+        with self._new_cursor() as cur:
+            cur.execute(statements.for_sql(query), params)
+            return list(map(LogRow._make, cur.fetchall()))
+
+    @reads_from_replica
+    def get_logs_page(self, user_id, page_size=25, before=None, after=None, date_from=None, date_to=None):
+        """
+        One page of a user's logs, newest first.
+
+        :param before: Return rows older than this work_date (next page)
+        :param after: Return rows newer than this work_date (previous page)
+        :return: (LogRow list, newer_cursor, older_cursor); a cursor is None
+                 when there is nothing further in that direction
+        """
+        logs = self.get_log_rows(
+            user_id, limit=page_size + 1, before=before, after=after,
+            date_from=date_from, date_to=date_to
+        )
+        return paginate(logs, page_size, before, after)
+
+    @reads_from_replica
+    def load_dashboard(self, user_id, user_role, page_size=25, before=None, after=None,
+                       date_from=None, date_to=None, target_user_id=None,
+                       target_before=None, target_after=None):
+        """
+        Everything dashboard.html needs in one round trip: the viewer's
+        username and log page and the selected user's log page.
+
+        :return: DashboardData; target_allowed is False when the requester
+                 may not see target_user_id's logs (an indexed id + role
+                 check inside the same statement)
+        """
+        query, params = dashboard_query(
+            user_id, user_role, page_size, before, after, date_from, date_to,
+            target_user_id, target_before, target_after
+        )
+        self.cursor.execute(statements.for_sql(query), params)
+        return build_dashboard(
+            self.cursor.fetchone(), page_size, before, after,
+            target_user_id, target_before, target_after
+        )
+
+    @reads_from_replica
+    def get_dashboard_stamp(self, user_ids):
+        """:return: dict(versions, users, updated_at) from DASHBOARD_STAMP_SQL"""
+        self.cursor.execute(DASHBOARD_STAMP_SQL, {'user_ids': list(user_ids)})
+        return self.cursor.fetchone()
+
+    EXPORT_COLUMNS = (
+        'user_id', 'username', 'email', 'role', 'work_date',
+        'clock_in', 'clock_out', 'work_hours', 'task_description'
+    )
+
+    def iter_export_rows(self, user_id=None, role=None, date_from=None, date_to=None, itersize=5000):
+        """
+        Yield timesheet rows across users as tuples in EXPORT_COLUMNS order,
+        through a server-side (named) cursor that fetches itersize rows per
+        round trip, so memory stays flat however many rows match.
+        work_hours is decimal hours with BREAK_HOURS already deducted.
+
+        Runs in its own read transaction, which is rolled back when the
+        generator finishes or is closed.
+        """
+        clauses = []
+        params = [BREAK_HOURS]
+        if user_id:
+            clauses.append("t.user_id = %s")
+            params.append(user_id)
+        if role:
+            clauses.append("u.role = %s")
+            params.append(role)
+        if date_from:
+            clauses.append("t.work_date >= %s")
+            params.append(date_from)
+        if date_to:
+            clauses.append("t.work_date <= %s")
+            params.append(date_to)
+        where = "WHERE " + " AND ".join(clauses) if clauses else ""
+
+        cur = self._new_cursor(name=f"timesheet_export_{id(self)}")
+        cur.itersize = itersize
+        try:
+            cur.execute(f"""
+                SELECT t.user_id, u.username, u.email, u.role::text,
+                       to_char(t.work_date, 'YYYY-MM-DD'),
+                       to_char(t.clock_in, 'HH24:MI'),
+                       to_char(t.clock_out, 'HH24:MI'),
+                       CASE WHEN t.work_duration = INTERVAL '0' THEN 0
+                            ELSE round((extract(epoch FROM t.work_duration) / 3600 - %s)::numeric, 2)
+                       END,
+                       t.task_description
+                FROM timesheet t
+                JOIN users u ON u.id = t.user_id
+                {where}
+                ORDER BY t.user_id, t.work_date
+            """, params)
+            for row in cur:
+                yield row
+        finally:
+            cur.close()
+            self.conn.rollback()
+
+    def get_log_by_id(self, log_id, log_date=None):
+        """
+        :param log_date: The log's work_date, if the caller knows it; lets
+                         Postgres read one timesheet partition instead of all
+        """
+        self.cursor.execute(statements.for_sql(f"""
             SELECT id, clock_in, clock_out, work_date, task_description
             FROM timesheet
-            WHERE id = %s
+            WHERE id = %s {LOG_DATE_FILTER if log_date else ""}
             ORDER BY work_date DESC
-        """, (log_id,))
+        """), (log_id, log_date) if log_date else (log_id,))
         logs = self.cursor.fetchall()
         return logs
 
     def add_log(self, user_id, clock_in, clock_out, work_date, task_description):
         try:
             # Accept both HH:MM and HH:MM:SS
-            if len(clock_in) == 5:
-                clock_in += ":00"
-            if len(clock_out) == 5:
-                clock_out += ":00"
-
-            fmt = "%H:%M:%S"
-            t_in = datetime.strptime(clock_in, fmt)
-            t_out = datetime.strptime(clock_out, fmt)
-
-            if t_out < t_in:
-                t_out += timedelta(days=1)
-
-            duration = t_out - t_in
-
-            self.cursor.execute("""
-                INSERT INTO timesheet
-                (user_id, clock_in, clock_out, work_duration, work_date, task_description)
-                VALUES (%s, %s, %s, %s, %s, %s)
-            """, (user_id, clock_in, clock_out, duration, work_date, task_description))
-
-            self.conn.commit()
+            clock_in = parse_clock(clock_in)
+            clock_out = parse_clock(clock_out)
+            duration = shift_duration(clock_in, clock_out)
+
+            with self.transaction():
+                self.cursor.execute(ENSURE_PARTITION_SQL, (work_date,))
+                # ON CONFLICT: a duplicate day costs no error and no rollback
+                self.cursor.execute(INSERT_LOG_SQL, (user_id, clock_in, clock_out, duration,
+                                                     work_date, task_description))
+                if self.cursor.fetchone() is None:
+                    return "duplicate"
+                self.refresh_summaries([(user_id, work_date)])
             return "success"
 
-        except psycopg2.errors.UniqueViolation:
-            self.conn.rollback()
-            return "duplicate"
+        except psycopg2.errors.ObjectNotInPrerequisiteState:
+            return "archived"
 
         except Exception as e:
-            self.conn.rollback()
-            print("Add log error:", e)
+            logger.error("add_log failed: %s", e)
             return "error"
 
-    def delete_log(self, log_id, user_id, user_role):
+    def delete_log(self, log_id, user_id, user_role, log_date=None):
+        """:param log_date: As for get_log_by_id; prunes to one partition"""
+        date_filter = LOG_DATE_FILTER if log_date else ""
+        date_params = (log_date,) if log_date else ()
         try:
-            if user_role == 'admin':
-                # Admin can delete any log
-                self.cursor.execute("""
-                    DELETE FROM timesheet
-                    WHERE id = %s
-                    RETURNING id
-                """, (log_id,))
-            else:
-                # Normal user can delete only their own logs
-                self.cursor.execute("""
-                    DELETE FROM timesheet
-                    WHERE id = %s AND user_id = %s
-                    RETURNING id
-                """, (log_id, user_id))
-
-            deleted = self.cursor.fetchone()
-            self.conn.commit()
+            with self.transaction():
+                if user_role == 'admin':
+                    # Admin can delete any log
+                    self.cursor.execute(f"""
+                        DELETE FROM timesheet
+                        WHERE id = %s {date_filter}
+                        RETURNING id, user_id, work_date
+                    """, (log_id,) + date_params)
+                else:
+                    # Normal user can delete only their own logs
+                    self.cursor.execute(f"""
+                        DELETE FROM timesheet
+                        WHERE id = %s AND user_id = %s {date_filter}
+                        RETURNING id, user_id, work_date
+                    """, (log_id, user_id) + date_params)
+
+                deleted = self.cursor.fetchone()
+                if deleted:
+                    self.refresh_summaries([(deleted['user_id'], deleted['work_date'])])
 
             if deleted:
                 return True
@@ -342,84 +1880,406 @@ class DatabaseManager:
                 return False
 
         except Exception as e:
-            self.conn.rollback()
-            print("Delete error:", e)  # optional logging
+            logger.error("delete_log failed: %s", e)
             return False
 
-    def update_log(self, log_id, user_id, clock_in, clock_out, work_date, task_description, requester_role):
+    def update_log(self, log_id, user_id, clock_in, clock_out, work_date, task_description, requester_role,
+                   log_date=None):
         """
         Update a timesheet log.
         - Normal user can update only their own log
         - Senior/Admin can update any log
+        - log_date: the log's current work_date, if known (partition pruning);
+          a new work_date in another year moves the row to that partition
         - Returns:
             "success"  -> updated
             "duplicate" -> same user already has log for this date
+            "archived" -> work_date falls in an archived year
             "error"    -> any other error
         """
         try:
             # Convert clock_in/out to time objects if string
-            if isinstance(clock_in, str):
-                if len(clock_in) == 5:  # HH:MM
-                    clock_in += ":00"
-                clock_in = datetime.strptime(clock_in, "%H:%M:%S").time()
-
-            if isinstance(clock_out, str):
-                if len(clock_out) == 5:
-                    clock_out += ":00"
-                clock_out = datetime.strptime(clock_out, "%H:%M:%S").time()
+            clock_in = parse_clock(clock_in)
+            clock_out = parse_clock(clock_out)
 
             # Calculate duration
-            dt_in = datetime.combine(work_date, clock_in)
-            dt_out = datetime.combine(work_date, clock_out)
-            if dt_out < dt_in:
-                dt_out += timedelta(days=1)  # handle overnight
-            duration = dt_out - dt_in
-
-            # Duplicate check for normal users
-            if requester_role not in ['senior', 'admin']:
-                self.cursor.execute("""
-                    SELECT id FROM timesheet
-                    WHERE user_id = %s AND work_date = %s AND id != %s
-                """, (user_id, work_date, log_id))
-                if self.cursor.fetchone():
-                    return "duplicate"
-
-            # Build UPDATE query
-            if requester_role in ['senior', 'admin']:
-                # Admin/senior can update any log
-                self.cursor.execute("""
-                    UPDATE timesheet
-                    SET clock_in = %s,
-                        clock_out = %s,
-                        work_duration = %s,
-                        work_date = %s,
-                        task_description = %s
-                    WHERE id = %s
-                """, (clock_in, clock_out, duration, work_date, task_description, log_id))
-            else:
-                # Normal user can update only their own log
-                self.cursor.execute("""
-                    UPDATE timesheet
-                    SET clock_in = %s,
-                        clock_out = %s,
-                        work_duration = %s,
-                        work_date = %s,
-                        task_description = %s
-                    WHERE id = %s AND user_id = %s
-                """, (clock_in, clock_out, duration, work_date, task_description, log_id, user_id))
-
-            self.conn.commit()
-
-            if self.cursor.rowcount == 0:
+            duration = shift_duration(clock_in, clock_out)
+
+            date_filter = "AND t.work_date = %s AND old.work_date = t.work_date" if log_date else ""
+            date_params = (log_date,) if log_date else ()
+
+            # No separate duplicate SELECT: UNIQUE (user_id, work_date) rejects
+            # a clash inside the UPDATE itself
+            with self.transaction():
+                self.cursor.execute(ENSURE_PARTITION_SQL, (work_date,))
+                if requester_role in ['senior', 'admin']:
+                    # Admin/senior can update any log
+                    self.cursor.execute(f"""
+                        UPDATE timesheet t
+                        SET clock_in = %s,
+                            clock_out = %s,
+                            work_duration = %s,
+                            work_date = %s,
+                            task_description = %s
+                        FROM timesheet old
+                        WHERE t.id = %s AND old.id = t.id {date_filter}
+                        RETURNING t.user_id, old.work_date AS old_date
+                    """, (clock_in, clock_out, duration, work_date, task_description, log_id) + date_params)
+                else:
+                    # Normal user can update only their own log
+                    self.cursor.execute(f"""
+                        UPDATE timesheet t
+                        SET clock_in = %s,
+                            clock_out = %s,
+                            work_duration = %s,
+                            work_date = %s,
+                            task_description = %s
+                        FROM timesheet old
+                        WHERE t.id = %s AND t.user_id = %s AND old.id = t.id {date_filter}
+                        RETURNING t.user_id, old.work_date AS old_date
+                    """, (clock_in, clock_out, duration, work_date, task_description, log_id, user_id) + date_params)
+
+                updated = self.cursor.fetchone()
+                if updated:
+                    self.refresh_summaries([
+                        (updated['user_id'], updated['old_date']),
+                        (updated['user_id'], work_date),
+                    ])
+
+            if not updated:
                 return "error"  # nothing updated (unauthorized or not found)
             return "success"
 
+        except psycopg2.errors.UniqueViolation:
+            return "duplicate"
+
+        except psycopg2.errors.ObjectNotInPrerequisiteState:
+            return "archived"
+
         except Exception as e:
-            self.conn.rollback()
-            print("Update log error:", e)
+            logger.error("update_log failed: %s", e)
             return "error"
 
 
+    # SEARCH
+
+    @reads_from_replica
+    def search_logs(self, query, requester_id, requester_role, user_id=None,
+                    date_from=None, date_to=None, limit=25, offset=0):
+        """
+        Ranked search over task_description. Queries use web search syntax
+        ("exact phrase", -excluded, or) against the task_tsv GIN index; a
+        query of SEARCH_MIN_SUBSTRING+ characters also matches substrings
+        ("migr") through the trigram index.
+
+        Scope follows list_users / get_users_by_role: admins search everyone,
+        seniors 'user' accounts, and everyone their own logs.
+
+        :return: Rows ordered by rank, then newest first; work_date and clock
+                 times come formatted as strings
+        """
+        query = (query or '').strip()
+        if not query:
+            return []
+
+        params = {
+            'query': query,
+            'requester_id': requester_id,
+            'user_id': user_id,
+            'date_from': date_from,
+            'date_to': date_to,
+            'limit': limit,
+            'offset': offset,
+        }
+        match = "t.task_tsv @@ q.tsq"
+        if len(query) >= SEARCH_MIN_SUBSTRING:
+            match = f"({match} OR t.task_description ILIKE %(pattern)s)"
+            escaped = like_escape(query)
+            params['pattern'] = f"%{escaped}%"
+
+        if requester_role == 'admin':
+            scope = "TRUE"
+        elif requester_role == 'senior':
+            scope = "(u.role = 'user' OR t.user_id = %(requester_id)s)"
+        else:
+            scope = "t.user_id = %(requester_id)s"
+
+        filters = ""
+        if user_id is not None:
+            filters += " AND t.user_id = %(user_id)s"
+        if date_from:
+            filters += " AND t.work_date >= %(date_from)s"
+        if date_to:
+            filters += " AND t.work_date <= %(date_to)s"
+
+        self.cursor.execute(f"""
+            SELECT t.id, t.user_id, u.username,
+                   to_char(t.work_date, 'YYYY-MM-DD') AS work_date,
+                   to_char(t.clock_in, 'HH24:MI') AS clock_in,
+                   to_char(t.clock_out, 'HH24:MI') AS clock_out,
+                   t.task_description,
+                   ts_rank_cd(t.task_tsv, q.tsq) AS rank
+            FROM websearch_to_tsquery('english', %(query)s) AS q (tsq),
+                 timesheet t
+            JOIN users u ON u.id = t.user_id
+            WHERE {match} AND {scope}{filters}
+            ORDER BY rank DESC, t.work_date DESC, t.id DESC
+            LIMIT %(limit)s OFFSET %(offset)s
+        """, params)
+        return self.cursor.fetchall()
+
+    # PUNCHES (see punches.py)
+
+    def insert_punches(self, punches):
+        """
+        Append punches in one statement and one commit. A punch already
+        recorded (same user, kind and time), or for a user that does not
+        exist, is skipped rather than failing everyone else's punches.
+
+        :param punches: (user_id, kind, punched_at, source) tuples
+        :return: Number of rows inserted
+        """
+        with self.transaction(savepoint=False):
+            rows = execute_values(self.cursor, """
+                INSERT INTO punch_events (user_id, kind, punched_at, source)
+                SELECT v.user_id, v.kind::punch_kind, v.punched_at, v.source
+                FROM (VALUES %s) AS v (user_id, kind, punched_at, source)
+                JOIN users u ON u.id = v.user_id
+                ON CONFLICT (user_id, kind, punched_at) DO NOTHING
+                RETURNING id
+            """, punches, page_size=1000, fetch=True)
+        return len(rows)
+
+    def compact_punches(self, max_users=500, max_shift=PUNCH_MAX_SHIFT):
+        """
+        Fold pending punch_events of up to max_users users into timesheet.
+        A shift belongs to the work_date it started on; one ending past
+        midnight is stored with clock_out < clock_in, as add_log does.
+        Shifts on a day that already has a row widen it to the earliest
+        clock-in and latest clock-out, and work_duration is recomputed.
+        One transaction; timesheet_summary is refreshed with it.
+
+        :return: (shifts folded, punches dropped as repeated/stray/abandoned
+                 or because their year is archived)
+        """
+        with self.transaction(savepoint=False):
+            self.cursor.execute("""
+                SELECT id, user_id, kind, punched_at
+                FROM punch_events
+                WHERE compacted_at IS NULL
+                  AND user_id IN (
+                      SELECT DISTINCT user_id FROM punch_events
+                      WHERE compacted_at IS NULL
+                      LIMIT %s
+                  )
+                ORDER BY user_id, punched_at, id
+                FOR UPDATE SKIP LOCKED
+            """, (max_users,))
+            shifts, done_ids, dropped = fold_punches(self.cursor.fetchall(), max_shift)
+            folded = len(shifts)
+
+            days = {}
+            for user_id, start, end in shifts:
+                key = (user_id, start.date())
+                if key in days:
+                    start, end = min(start, days[key][0]), max(end, days[key][1])
+                days[key] = (start, end)
+
+            # A year without a partition gets one; shifts in an archived
+            # year are dropped (but marked compacted) so they cannot fail
+            # the batch on every run
+            for year in sorted({work_date.year for _, work_date in days}):
+                try:
+                    with self.transaction():
+                        self.cursor.execute(ENSURE_PARTITION_SQL, (date(year, 1, 1),))
+                except psycopg2.errors.ObjectNotInPrerequisiteState:
+                    archived = [key for key in days if key[1].year == year]
+                    for key in archived:
+                        del days[key]
+                    archived_shifts = sum(1 for _, start, _ in shifts
+                                          if start.year == year)
+                    folded -= archived_shifts
+                    dropped += 2 * archived_shifts
+                    logger.warning("dropped %d punched shifts in archived year %d", archived_shifts, year)
+
+            if days:
+                user_ids, work_dates = zip(*days)
+                self.cursor.execute("""
+                    SELECT t.user_id, t.work_date, t.clock_in, t.clock_out
+                    FROM timesheet t
+                    JOIN unnest(%s::int[], %s::date[]) AS k(user_id, work_date)
+                      ON t.user_id = k.user_id AND t.work_date = k.work_date
+                    FOR UPDATE OF t
+                """, (list(user_ids), list(work_dates)))
+                for row in self.cursor.fetchall():
+                    key = (row['user_id'], row['work_date'])
+                    row_start = datetime.combine(row['work_date'], row['clock_in'])
+                    row_end = row_start + shift_duration(row['clock_in'], row['clock_out'])
+                    start, end = days[key]
+                    days[key] = (min(start, row_start), max(end, row_end))
+
+                execute_values(self.cursor, """
+                    INSERT INTO timesheet
+                    (user_id, work_date, clock_in, clock_out, work_duration, task_description)
+                    VALUES %s
+                    ON CONFLICT (user_id, work_date) DO UPDATE
+                    SET clock_in = EXCLUDED.clock_in,
+                        clock_out = EXCLUDED.clock_out,
+                        work_duration = EXCLUDED.work_duration
+                """, [
+                    (user_id, work_date, start.time(), end.time(), end - start, '')
+                    for (user_id, work_date), (start, end) in days.items()
+                ], page_size=1000)
+                self.refresh_summaries(list(days))
+
+            if done_ids:
+                self.cursor.execute("""
+                    UPDATE punch_events SET compacted_at = CURRENT_TIMESTAMP
+                    WHERE id = ANY(%s)
+                """, (done_ids,))
+        return folded, dropped
+
+    # PARTITIONS (timesheet is range partitioned by year, see schema.sql)
+
+    TIMESHEET_ARCHIVE_COLUMNS = (
+        'id', 'user_id', 'clock_in', 'clock_out', 'work_duration', 'work_date', 'task_description'
+    )
+
+    def ensure_timesheet_partitions(self, years_ahead=1, first_year=None):
+        """
+        Create any missing yearly partitions from first_year (default: this
+        year) through years_ahead years from now. :return: Years created
+        """
+        this_year = date.today().year
+        with self.transaction(savepoint=False):
+            self.cursor.execute("""
+                SELECT year FROM generate_series(%s, %s) AS year
+                WHERE ensure_timesheet_partition(year)
+            """, (first_year or this_year, this_year + years_ahead))
+            return [row['year'] for row in self.cursor.fetchall()]
+
+    def list_timesheet_partitions(self):
+        """:return: Years that currently have an attached timesheet partition, oldest first"""
+        self.cursor.execute("""
+            SELECT substring(c.relname FROM '^timesheet_y([0-9]{4})$')::int AS year
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'timesheet'::regclass
+              AND c.relname ~ '^timesheet_y[0-9]{4}$'
+            ORDER BY 1
+        """)
+        return [row['year'] for row in self.cursor.fetchall()]
+
+    def archive_timesheet_year(self, year, archive_dir=None):
+        """
+        Detach a closed year's partition so day-to-day queries, vacuum and
+        the indexes no longer carry it. timesheet_summary rows are kept, so
+        reports still cover the year.
+
+        :param archive_dir: Write the rows to <archive_dir>/timesheet_y<year>.csv.gz
+                            and drop the table. Without it the table is moved
+                            to the timesheet_archive schema, still queryable.
+        :return: Where the year went (file path or table name)
+        """
+        name = f"timesheet_y{int(year)}"
+        with self.transaction(savepoint=False):
+            self.cursor.execute(f"ALTER TABLE timesheet DETACH PARTITION {name}")
+            if not archive_dir:
+                self.cursor.execute("CREATE SCHEMA IF NOT EXISTS timesheet_archive")
+                self.cursor.execute(f"ALTER TABLE {name} SET SCHEMA timesheet_archive")
+                self._record_archived_year(year, f"timesheet_archive.{name}")
+                return f"timesheet_archive.{name}"
+
+            path = os.path.join(archive_dir, f"{name}.csv.gz")
+            self._record_archived_year(year, path)
+            # Only a committed archive gets the real name
+            with gzip.open(path + '.tmp', 'wb') as fh:
+                self.cursor.copy_expert(
+                    f"COPY {name} ({', '.join(self.TIMESHEET_ARCHIVE_COLUMNS)}) "
+                    f"TO STDOUT WITH (FORMAT csv, HEADER)", fh)
+            self.cursor.execute(f"DROP TABLE {name}")
+            self.on_commit(lambda: os.replace(path + '.tmp', path))
+        return path
+
+    def _record_archived_year(self, year, location):
+        # ensure_timesheet_partition refuses years listed here
+        self.cursor.execute(
+            "INSERT INTO timesheet_archived_years (year, location) VALUES (%s, %s)",
+            (int(year), location)
+        )
+
+    # REPORTING
+
+    def refresh_summaries(self, pairs=None, keys_sql=None):
+        """
+        Bring timesheet_summary up to date for the weeks/months touched by
+        some timesheet change, and bump the users' timesheet_versions.
+        Runs inside the caller's transaction; no commit.
+
+        :param pairs: (user_id, work_date) tuples that changed
+        :param keys_sql: Alternatively, a SELECT returning user_id, work_date
+                         columns (used for bulk imports and rebuilds)
+        """
+        params = {
+            'standard_seconds': STANDARD_DAY_HOURS * 3600,
+            'break_seconds': BREAK_HOURS * 3600,
+        }
+        if keys_sql is None:
+            pairs = [p for p in (pairs or []) if p[1] is not None]
+            if not pairs:
+                return
+            keys_sql = "SELECT * FROM unnest(%(user_ids)s::int[], %(work_dates)s::date[]) AS k(user_id, work_date)"
+            params['user_ids'] = [p[0] for p in pairs]
+            params['work_dates'] = [p[1] for p in pairs]
+        self.cursor.execute(SUMMARY_REFRESH_SQL.format(keys=keys_sql), params)
+
+    def rebuild_summaries(self):
+        """Recompute every summary row from timesheet (initial backfill / repair)."""
+        self.cursor.execute("TRUNCATE timesheet_summary")
+        self.refresh_summaries(keys_sql="SELECT DISTINCT user_id, work_date FROM timesheet")
+        self._commit()
+
+    @reads_from_replica
+    def get_summary_report(self, period, date_from, date_to, requester_role, limit=100, offset=0):
+        """
+        Weekly or monthly totals per user for every period overlapping
+        [date_from, date_to]. Rows come from users crossed with those
+        periods, so a user with no logs in a period still gets a row (zero
+        days worked) for the missing-days figure; totals are read only from
+        timesheet_summary. Seniors see 'user' accounts, admins see everyone,
+        others nothing.
+        """
+        if requester_role not in ('admin', 'senior'):
+            return []
+
+        role_filter = "AND u.role = 'user'" if requester_role == 'senior' else ""
+        self.cursor.execute(f"""
+            SELECT u.id AS user_id, u.username, u.role, p.period_start,
+                   coalesce(s.days_worked, 0) AS days_worked,
+                   coalesce(s.weekdays_worked, 0) AS weekdays_worked,
+                   coalesce(s.total_seconds, 0) AS total_seconds,
+                   coalesce(s.overtime_seconds, 0) AS overtime_seconds
+            FROM (
+                SELECT g::date AS period_start
+                FROM generate_series(date_trunc(%(period)s, %(date_from)s::date),
+                                     %(date_to)s::date,
+                                     ('1 ' || %(period)s)::interval) AS g
+            ) p
+            CROSS JOIN users u
+            LEFT JOIN timesheet_summary s
+                   ON s.user_id = u.id
+                  AND s.period = %(period)s
+                  AND s.period_start = p.period_start
+            WHERE u.created_at < p.period_start + ('1 ' || %(period)s)::interval
+              AND (u.is_active OR s.user_id IS NOT NULL)
+              {role_filter}
+            ORDER BY p.period_start DESC, u.username, u.id
+            LIMIT %(limit)s OFFSET %(offset)s
+        """, {'period': period, 'date_from': date_from, 'date_to': date_to,
+              'limit': limit, 'offset': offset})
+        return self.cursor.fetchall()
+
+
 # -----------------Testing-----------------------------
 
 if __name__ == '__main__':
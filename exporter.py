@@ -0,0 +1,103 @@
+"""
+Timesheet exports from an iterable of row tuples
+(DatabaseManager.iter_export_rows).
+
+CSV is the streaming format: csv_chunks() yields bytes as rows arrive, so
+a Flask streaming response never holds more than one chunk. An XLSX file
+can only be written once every row is in, so xlsx_file() builds the whole
+workbook before anything is sent (openpyxl's write-only mode spools it to
+a temp file, so memory stays flat) and refuses more than
+EXPORT_XLSX_MAX_ROWS rows (default 100000); larger exports should use CSV.
+XLSX needs the optional openpyxl package.
+
+Text cells that a spreadsheet would read as a formula (leading =, +, -, @,
+tab or carriage return) are written with a leading ' so they stay text.
+"""
+import csv
+import io
+import os
+import tempfile
+
+try:
+    from openpyxl import Workbook
+except ImportError:
+    Workbook = None
+
+XLSX_AVAILABLE = Workbook is not None
+XLSX_MAX_ROWS = int(os.getenv('EXPORT_XLSX_MAX_ROWS', 100000))
+
+CSV_MIMETYPE = 'text/csv'
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def safe_cell(value):
+    """Text that would start a formula -> the same text prefixed with '."""
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def safe_row(row):
+    return [safe_cell(value) for value in row]
+
+
+def csv_chunks(columns, rows, rows_per_chunk=500):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    pending = 0
+    for row in rows:
+        writer.writerow(safe_row(row))
+        pending += 1
+        if pending >= rows_per_chunk:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    yield buffer.getvalue().encode('utf-8')
+
+
+class ExportTooLarge(Exception):
+    """More rows than an XLSX export may hold."""
+
+
+def xlsx_file(columns, rows, max_rows=XLSX_MAX_ROWS):
+    """
+    Write the whole workbook before anything is sent.
+
+    :return: Temp file positioned at the start of the XLSX bytes
+    :raises ExportTooLarge: past max_rows rows (nothing has been sent yet,
+                            so the caller can still answer with an error)
+    """
+    if not XLSX_AVAILABLE:
+        raise RuntimeError("XLSX export needs the openpyxl package")
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Timesheets')
+    sheet.append(columns)
+    for count, row in enumerate(rows, 1):
+        if count > max_rows:
+            sheet.close()   # drops the worksheet's spool file
+            raise ExportTooLarge(f"XLSX exports are limited to {max_rows} rows")
+        sheet.append(safe_row(row))
+
+    fh = tempfile.TemporaryFile()
+    try:
+        workbook.save(fh)
+    except Exception:
+        fh.close()
+        raise
+    fh.seek(0)
+    return fh
+
+
+def file_chunks(fh, chunk_size=64 * 1024):
+    """Stream an open file out in chunks, closing it at the end."""
+    with fh:
+        while True:
+            chunk = fh.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
@@ -0,0 +1,116 @@
+"""
+HTTP caching helpers shared by app.py and asgi.py.
+
+- page_cache / cache_anonymous: fully rendered pages for visitors without a
+  session (home, login, register), served without touching Jinja.
+- dashboard_etag: validator for the dashboard built from the users'
+  timesheet_versions and users.updated_at (DatabaseManager.get_dashboard_stamp),
+  so unchanged
+  dashboards answer 304 before anything is queried or rendered.
+- choose_encoding / compress: gzip, or brotli when the `brotli` package is
+  installed, for text responses.
+- static_url: static file URLs carrying a content hash, so they can be
+  cached for a year (see STATIC_MAX_AGE).
+"""
+import gzip
+import hashlib
+import os
+from functools import wraps
+
+from cache import TTLCache
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:  # optional: pip install brotli
+    brotli = None
+    BROTLI_AVAILABLE = False
+
+STATIC_MAX_AGE = 365 * 24 * 3600
+COMPRESS_MIN_SIZE = 500
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'image/svg+xml')
+
+# Changes with each deploy so cached pages and ETags from old templates die
+BUILD_ID = os.getenv('APP_VERSION') or str(int(max(
+    os.path.getmtime(os.path.join(root, name))
+    for root, _, names in os.walk(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates'))
+    for name in names
+)))
+
+page_cache = TTLCache(
+    maxsize=int(os.getenv('PAGE_CACHE_SIZE', 256)),
+    ttl=float(os.getenv('PAGE_CACHE_TTL', 300)),
+)
+
+
+def cache_anonymous(view):
+    """
+    Flask view decorator: GETs from visitors with an empty session are served
+    from page_cache. A response is only stored if the view left the session
+    empty too (login?forgot=1, for one, does not).
+    """
+    from flask import make_response, request, session
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method != 'GET' or session:
+            return view(*args, **kwargs)
+
+        key = (request.endpoint, request.full_path)
+        cached = page_cache.get(key)
+        if cached is not None:
+            body, mimetype = cached
+            response = make_response(body)
+            response.mimetype = mimetype
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200 or session or response.is_streamed:
+                return response
+            page_cache.set(key, (response.get_data(), response.mimetype))
+
+        response.headers['Cache-Control'] = 'public, max-age=0, must-revalidate'
+        response.add_etag()
+        return response.make_conditional(request)
+
+    return wrapper
+
+
+def dashboard_etag(stamp, user_id, user_role, target_user_id, query_string, today):
+    """Weak ETag for one dashboard view; any change to its inputs changes it."""
+    parts = (
+        BUILD_ID, user_id, user_role, target_user_id, query_string, today,
+        stamp['versions'], stamp['users'],
+    )
+    return hashlib.sha1('|'.join(map(str, parts)).encode()).hexdigest()
+
+
+def choose_encoding(accept_encodings):
+    """Best of br/gzip from a werkzeug Accept-Encoding header, or None."""
+    offers = ['br', 'gzip'] if BROTLI_AVAILABLE else ['gzip']
+    return accept_encodings.best_match(offers)
+
+
+def compressible(mimetype, length):
+    return length >= COMPRESS_MIN_SIZE and (mimetype or '').startswith(COMPRESSIBLE_TYPES)
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6)
+
+
+def _content_hash(path):
+    with open(path, 'rb') as fh:
+        return hashlib.sha1(fh.read()).hexdigest()[:10]
+
+
+_static_hashes = {}
+
+
+def static_url(url_for, static_folder, filename):
+    """url_for('static') plus ?v=<content hash>, computed once per file."""
+    version = _static_hashes.get(filename)
+    if version is None:
+        version = _static_hashes[filename] = _content_hash(os.path.join(static_folder, filename))
+    return url_for('static', filename=filename, v=version)
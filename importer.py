@@ -0,0 +1,211 @@
+"""
+Bulk timesheet import from CSV.
+
+The file is streamed: rows are validated with the same rules as
+DatabaseManager.add_log (HH:MM or HH:MM:SS, clock_out before clock_in is an
+overnight shift, no future dates), written in chunks into a temp staging
+table with COPY, then merged into timesheet in one statement that skips
+anything clashing with UNIQUE (user_id, work_date). The whole import is one
+transaction.
+
+Expected header (user may be given by id or by email):
+
+    user_id|email, work_date, clock_in, clock_out, task_description
+
+CLI:
+
+    python importer.py export.csv
+"""
+import csv
+import io
+from datetime import date
+
+from db import parse_clock, shift_duration
+
+# Line-level details kept in the report; counts are always complete
+MAX_REPORTED = 1000
+
+
+def _new_report():
+    return {
+        'rows': 0,
+        'inserted': 0,
+        'duplicates': 0,
+        'errors': 0,
+        'duplicate_lines': [],   # (line_no, reason)
+        'error_lines': [],       # (line_no, message)
+    }
+
+
+def _note(report, kind, line_no, message):
+    report[kind] += 1
+    details = report[f"{kind[:-1]}_lines"]
+    if len(details) < MAX_REPORTED:
+        details.append((line_no, message))
+
+
+def _load_user_keys(db):
+    db.cursor.execute("SELECT id, email FROM users")
+    by_email = {}
+    ids = set()
+    for row in db.cursor.fetchall():
+        ids.add(row['id'])
+        by_email[row['email'].lower()] = row['id']
+    return ids, by_email
+
+
+def _parse_row(row, user_ids, users_by_email, today):
+    """Validated (user_id, clock_in, clock_out, duration, work_date, task) or ValueError."""
+    if row.get('user_id'):
+        user_id = int(row['user_id'])
+        if user_id not in user_ids:
+            raise ValueError(f"unknown user_id {user_id}")
+    elif row.get('email'):
+        user_id = users_by_email.get(row['email'].strip().lower())
+        if user_id is None:
+            raise ValueError(f"unknown email {row['email']}")
+    else:
+        raise ValueError("user_id or email is required")
+
+    work_date = date.fromisoformat((row.get('work_date') or '').strip())
+    if work_date > today:
+        raise ValueError("future dates are not allowed")
+
+    clock_in = parse_clock((row.get('clock_in') or '').strip())
+    clock_out = parse_clock((row.get('clock_out') or '').strip())
+    duration = shift_duration(clock_in, clock_out)
+
+    task = row.get('task_description')
+    if task is None:
+        raise ValueError("task_description is required")
+
+    return user_id, clock_in, clock_out, duration, work_date, task
+
+
+def _copy_chunk(db, buffer):
+    buffer.seek(0)
+    db.cursor.copy_expert("""
+        COPY timesheet_import
+            (line_no, user_id, clock_in, clock_out, work_duration, work_date, task_description)
+        FROM STDIN WITH (FORMAT csv, FORCE_NOT_NULL (task_description))
+    """, buffer)
+    buffer.seek(0)
+    buffer.truncate()
+
+
+def import_timesheets(db, stream, chunk_rows=50000):
+    """
+    Import CSV rows from a text stream.
+
+    :param db: DatabaseManager; the import runs in one db.transaction()
+    :param stream: Text file object positioned at the CSV header
+    :param chunk_rows: Rows buffered in memory per COPY
+    :return: Report dict with row/inserted/duplicate/error counts and the
+             first MAX_REPORTED offending line numbers with reasons
+    """
+    report = _new_report()
+    today = date.today()
+
+    with db.transaction():
+        user_ids, users_by_email = _load_user_keys(db)
+        db.cursor.execute("""
+            CREATE TEMP TABLE timesheet_import (
+                line_no INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                clock_in TIME NOT NULL,
+                clock_out TIME NOT NULL,
+                work_duration INTERVAL NOT NULL,
+                work_date DATE NOT NULL,
+                task_description TEXT NOT NULL
+            ) ON COMMIT DROP
+        """)
+
+        reader = csv.DictReader(stream)
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        pending = 0
+
+        for row in reader:
+            report['rows'] += 1
+            line_no = reader.line_num
+            try:
+                parsed = _parse_row(row, user_ids, users_by_email, today)
+            except (ValueError, TypeError) as e:
+                _note(report, 'errors', line_no, str(e))
+                continue
+
+            writer.writerow((line_no,) + parsed)
+            pending += 1
+            if pending >= chunk_rows:
+                _copy_chunk(db, buffer)
+                pending = 0
+
+        if pending:
+            _copy_chunk(db, buffer)
+
+        # timesheet is partitioned by year: older files may need new partitions
+        db.cursor.execute("""
+            SELECT ensure_timesheet_partition(year::int)
+            FROM (SELECT DISTINCT extract(year FROM work_date) AS year FROM timesheet_import) y
+        """)
+
+        # First occurrence of each (user_id, work_date) in the file wins;
+        # anything already in timesheet is left alone and reported.
+        db.cursor.execute("""
+            WITH ranked AS (
+                SELECT s.*,
+                       row_number() OVER (PARTITION BY user_id, work_date ORDER BY line_no) AS rn
+                FROM timesheet_import s
+            ),
+            inserted AS (
+                INSERT INTO timesheet
+                    (user_id, clock_in, clock_out, work_duration, work_date, task_description)
+                SELECT user_id, clock_in, clock_out, work_duration, work_date, task_description
+                FROM ranked
+                WHERE rn = 1
+                ON CONFLICT (user_id, work_date) DO NOTHING
+                RETURNING user_id, work_date
+            )
+            SELECT r.line_no,
+                   CASE WHEN r.rn > 1 THEN 'repeated in file' ELSE 'log already exists' END AS reason
+            FROM ranked r
+            LEFT JOIN inserted i ON i.user_id = r.user_id AND i.work_date = r.work_date AND r.rn = 1
+            WHERE i.user_id IS NULL
+            ORDER BY r.line_no
+        """)
+        for dup in db.cursor:
+            _note(report, 'duplicates', dup['line_no'], dup['reason'])
+
+        db.cursor.execute("SELECT count(*) AS staged FROM timesheet_import")
+        report['inserted'] = db.cursor.fetchone()['staged'] - report['duplicates']
+
+        db.refresh_summaries(keys_sql="SELECT DISTINCT user_id, work_date FROM timesheet_import")
+
+    return report
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    from app import DB_CONFIG
+    from db import DatabaseManager
+
+    parser = argparse.ArgumentParser(description="Bulk import timesheets from CSV")
+    parser.add_argument('path')
+    parser.add_argument('--chunk-rows', type=int, default=50000)
+    args = parser.parse_args()
+
+    db = DatabaseManager(**DB_CONFIG)
+    started = time.perf_counter()
+    with open(args.path, newline='', encoding='utf-8-sig') as fh:
+        result = import_timesheets(db, fh, chunk_rows=args.chunk_rows)
+    elapsed = time.perf_counter() - started
+    db.close()
+
+    print(f"{result['rows']} rows in {elapsed:.1f}s: {result['inserted']} inserted, "
+          f"{result['duplicates']} duplicates, {result['errors']} errors")
+    for line_no, reason in result['duplicate_lines']:
+        print(f"  line {line_no}: duplicate ({reason})")
+    for line_no, message in result['error_lines']:
+        print(f"  line {line_no}: {message}")
@@ -0,0 +1,120 @@
+"""
+Periodic housekeeping that runs next to the web app.
+
+Each job is a function taking a DatabaseManager; PeriodicJob runs it every
+`interval` seconds on a daemon thread with a pooled connection. The dev
+server starts these in-process (see app.py); elsewhere run
+
+    python jobs.py
+"""
+import logging
+import os
+import threading
+import time
+from datetime import date
+
+from db import DatabaseManager
+
+logger = logging.getLogger('worklog.jobs')
+
+
+def purge_otps(db):
+    deleted = db.purge_otps(retention_minutes=int(os.getenv('OTP_RETENTION_MINUTES', 60)))
+    if deleted:
+        logger.info("purged %d OTP rows", deleted)
+
+
+def purge_sessions(db):
+    deleted = db.purge_sessions()
+    if deleted:
+        logger.info("purged %d expired sessions", deleted)
+
+
+def compact_punches(db):
+    shifts, dropped = db.compact_punches()
+    if shifts or dropped:
+        logger.info("folded %d punched shifts into timesheet, dropped %d punches", shifts, dropped)
+
+
+def maintain_timesheet_partitions(db):
+    """
+    Keep next year's timesheet partition ready and, with
+    TIMESHEET_ARCHIVE_AFTER_YEARS set, archive older years (into
+    TIMESHEET_ARCHIVE_DIR as .csv.gz when set, else the timesheet_archive schema).
+    """
+    created = db.ensure_timesheet_partitions(years_ahead=1)
+    if created:
+        logger.info("created timesheet partitions for %s", ', '.join(map(str, created)))
+
+    keep_years = os.getenv('TIMESHEET_ARCHIVE_AFTER_YEARS')
+    if not keep_years:
+        return
+    cutoff = date.today().year - int(keep_years)
+    for year in db.list_timesheet_partitions():
+        if year < cutoff:
+            where = db.archive_timesheet_year(year, os.getenv('TIMESHEET_ARCHIVE_DIR'))
+            logger.info("archived timesheet %d to %s", year, where)
+
+
+# name -> (function, default interval in seconds)
+JOBS = {
+    'purge_otps': (purge_otps, 15 * 60),
+    'purge_sessions': (purge_sessions, 10 * 60),
+    'compact_punches': (compact_punches, 60),
+    'maintain_timesheet_partitions': (maintain_timesheet_partitions, 24 * 3600),
+}
+
+
+class PeriodicJob(threading.Thread):
+
+    def __init__(self, pool, name, func, interval):
+        super().__init__(daemon=True, name=f"job-{name}")
+        self.pool = pool
+        self.func = func
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run_once(self):
+        db = DatabaseManager(pool=self.pool)
+        try:
+            self.func(db)
+        finally:
+            db.close()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("job %s failed", self.name)
+            self._stop_event.wait(self.interval)
+
+
+def start_jobs(pool, names=None):
+    threads = []
+    for name, (func, interval) in JOBS.items():
+        if names is not None and name not in names:
+            continue
+        job = PeriodicJob(pool, name, func, interval)
+        job.start()
+        threads.append(job)
+    return threads
+
+
+if __name__ == '__main__':
+    from app import DB_CONFIG
+    from db import init_pool
+
+    logging.basicConfig(level=logging.INFO)
+    pool = init_pool(minconn=1, maxconn=2, **DB_CONFIG)
+    jobs = start_jobs(pool)
+    print(f"running jobs: {', '.join(j.name for j in jobs)}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        for job in jobs:
+            job.stop()
@@ -0,0 +1,230 @@
+"""
+Background delivery for outbound email.
+
+Request handlers only INSERT into email_outbox (DatabaseManager.enqueue_email)
+and return. MailWorker threads claim due rows in batches, send them over a
+transport that keeps its SMTP session open between batches, and reschedule
+failures with exponential backoff.
+
+The Flask dev server starts workers in-process (see app.py). For any other
+deployment run them as their own process:
+
+    python mailer.py --workers 2
+
+Set MAIL_TRANSPORT=sink (optionally MAIL_SINK_DIR=/some/dir) to deliver into
+a local sink instead of SMTP.
+"""
+import logging
+import os
+import smtplib
+import threading
+import time
+from email.message import EmailMessage
+
+from db import DatabaseManager
+
+logger = logging.getLogger('worklog.mailer')
+
+# Set by notify() so idle workers pick up fresh mail without waiting a poll cycle
+_wake = threading.Event()
+
+
+def notify():
+    _wake.set()
+
+
+def build_message(sender, to_email, subject, body):
+    msg = EmailMessage()
+    msg['Subject'] = subject
+    msg['From'] = sender
+    msg['To'] = to_email
+    msg.set_content(body)
+    return msg
+
+
+# ================= TRANSPORTS =================
+
+class SMTPTransport:
+    """
+    SMTP over SSL with a connection that is reused across sends. The session
+    is checked with NOOP after idle_timeout seconds and re-established once
+    if the server dropped it.
+    """
+
+    def __init__(self, host, port, username, password, idle_timeout=60):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.idle_timeout = idle_timeout
+        self._smtp = None
+        self._last_used = 0.0
+
+    @property
+    def sender(self):
+        return self.username
+
+    def _connect(self):
+        smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=30)
+        smtp.login(self.username, self.password)
+        self._smtp = smtp
+
+    def _ensure_connected(self):
+        if self._smtp is not None and time.monotonic() - self._last_used > self.idle_timeout:
+            try:
+                self._smtp.noop()
+            except smtplib.SMTPException:
+                self.close()
+        if self._smtp is None:
+            self._connect()
+
+    def send(self, msg):
+        self._ensure_connected()
+        try:
+            self._smtp.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            # Server hung up between batches; one fresh session, then give up
+            self.close()
+            self._connect()
+            self._smtp.send_message(msg)
+        self._last_used = time.monotonic()
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except smtplib.SMTPException:
+                pass
+            except OSError:
+                pass
+            self._smtp = None
+
+
+class LocalSinkTransport:
+    """
+    Delivers nowhere: messages are kept in `sent` and, when a directory is
+    given, written there as .eml files. Meant for tests and local runs.
+    """
+
+    def __init__(self, directory=None, sender='worklog@localhost'):
+        self.directory = directory
+        self.sender = sender
+        self.sent = []
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def send(self, msg):
+        with self._lock:
+            self.sent.append(msg)
+            if self.directory:
+                name = f"{time.time_ns()}-{len(self.sent)}.eml"
+                with open(os.path.join(self.directory, name), 'wb') as fh:
+                    fh.write(msg.as_bytes())
+
+    def close(self):
+        pass
+
+
+def transport_from_env():
+    if os.getenv('MAIL_TRANSPORT', 'smtp') == 'sink':
+        return LocalSinkTransport(directory=os.getenv('MAIL_SINK_DIR'))
+    return SMTPTransport(
+        host=os.getenv('SMTP_HOST', 'smtp.gmail.com'),
+        port=int(os.getenv('SMTP_PORT', 465)),
+        username=os.getenv('SENDER_EMAIL'),
+        password=os.getenv('SENDER_PASSWORD'),
+    )
+
+
+# ================= WORKERS =================
+
+class MailWorker(threading.Thread):
+    """
+    Drains email_outbox. Each worker owns its transport (SMTP sessions are not
+    thread-safe) and borrows a pooled connection per batch.
+
+    :param max_attempts: Deliveries tried before a message is marked failed
+    :param backoff_base: Seconds before the first retry; doubles each attempt
+    """
+
+    def __init__(self, pool, transport, batch_size=20, poll_interval=1.0,
+                 max_attempts=5, backoff_base=30, backoff_max=3600):
+        super().__init__(daemon=True, name='mail-worker')
+        self.pool = pool
+        self.transport = transport
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+        _wake.set()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                claimed = self.process_batch()
+            except Exception:
+                logger.exception("mail worker batch failed")
+                claimed = 0
+            if not claimed:
+                _wake.wait(self.poll_interval)
+                _wake.clear()
+        self.transport.close()
+
+    def retry_delay(self, attempts):
+        if attempts >= self.max_attempts:
+            return None
+        return min(self.backoff_base * 2 ** (attempts - 1), self.backoff_max)
+
+    def process_batch(self):
+        """Claim, send and settle one batch. Returns how many rows were claimed."""
+        db = DatabaseManager(pool=self.pool)
+        try:
+            rows = db.claim_emails(self.batch_size)
+            sent = []
+            for row in rows:
+                msg = build_message(self.transport.sender, row['to_email'], row['subject'], row['body'])
+                try:
+                    self.transport.send(msg)
+                    sent.append(row['id'])
+                except Exception as e:
+                    logger.warning("sending mail %s to %s failed: %s", row['id'], row['to_email'], e)
+                    db.reschedule_email(row['id'], str(e), self.retry_delay(row['attempts']))
+            db.mark_emails_sent(sent)
+            return len(rows)
+        finally:
+            db.close()
+
+
+def start_workers(pool, count=2, transport_factory=transport_from_env, **worker_kwargs):
+    workers = [MailWorker(pool, transport_factory(), **worker_kwargs) for _ in range(count)]
+    for worker in workers:
+        worker.start()
+    return workers
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from app import DB_CONFIG
+    from db import init_pool
+
+    parser = argparse.ArgumentParser(description="Run outbound email workers")
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--batch-size', type=int, default=20)
+    args = parser.parse_args()
+
+    pool = init_pool(minconn=1, maxconn=args.workers, **DB_CONFIG)
+    workers = start_workers(pool, count=args.workers, batch_size=args.batch_size)
+    print(f"{len(workers)} mail worker(s) running")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.stop()
@@ -0,0 +1,111 @@
+"""
+Process-local metrics in Prometheus text format.
+
+Only what the app needs: counters and histograms keyed by a name and a
+small set of labels, plus collector callbacks for values that are read at
+scrape time (pool gauges). Served by the /metrics route in app.py to admins
+and to scrapers sending Authorization: Bearer $OPS_TOKEN.
+"""
+import threading
+from bisect import bisect_left
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)   # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _label_str(labels, extra=None):
+    items = list(labels)
+    if extra:
+        items.append(extra)
+    if not items:
+        return ''
+    body = ','.join(
+        '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in items
+    )
+    return '{' + body + '}'
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help = {}
+        self._counters = {}     # name -> {labels tuple: value}
+        self._histograms = {}   # name -> {labels tuple: Histogram}
+        self._buckets = {}
+        self._collectors = []
+
+    def describe(self, name, help_text, buckets=None):
+        self._help[name] = help_text
+        if buckets is not None:
+            self._buckets[name] = buckets
+
+    def inc(self, name, labels=None, amount=1):
+        key = tuple(sorted((labels or {}).items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name, value, labels=None):
+        key = tuple(sorted((labels or {}).items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = Histogram(self._buckets.get(name, DEFAULT_BUCKETS))
+            hist.observe(value)
+
+    def register_collector(self, fn):
+        """fn() -> iterable of (name, type, labels dict, value), read at scrape time."""
+        self._collectors.append(fn)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                self._header(lines, name, 'counter')
+                for key, value in series.items():
+                    lines.append(f"{name}{_label_str(key)} {value}")
+
+            for name, series in sorted(self._histograms.items()):
+                self._header(lines, name, 'histogram')
+                for key, hist in series.items():
+                    cumulative = 0
+                    for bound, count in zip(hist.buckets, hist.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_label_str(key, ('le', repr(bound)))} {cumulative}")
+                    lines.append(f"{name}_bucket{_label_str(key, ('le', '+Inf'))} {hist.count}")
+                    lines.append(f"{name}_sum{_label_str(key)} {hist.sum}")
+                    lines.append(f"{name}_count{_label_str(key)} {hist.count}")
+
+        seen = set()
+        for collector in self._collectors:
+            for name, kind, labels, value in collector():
+                if name not in seen:
+                    self._header(lines, name, kind)
+                    seen.add(name)
+                lines.append(f"{name}{_label_str(sorted(labels.items()))} {value}")
+
+        return '\n'.join(lines) + '\n'
+
+    def _header(self, lines, name, kind):
+        if name in self._help:
+            lines.append(f"# HELP {name} {self._help[name]}")
+        lines.append(f"# TYPE {name} {kind}")
+
+
+registry = MetricsRegistry()
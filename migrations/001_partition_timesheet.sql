@@ -0,0 +1,85 @@
+-- Rebuild timesheet as the yearly range-partitioned table of schema.sql
+-- section 4, for databases created before it was partitioned.
+--
+--     psql -1 -v ON_ERROR_STOP=1 -d log_tracker -f migrations/001_partition_timesheet.sql
+--
+-- Run it in one transaction (-1): the old table is locked for the whole copy
+-- and everything rolls back on error. Ids and the id sequence are kept, so
+-- nothing that refers to a log id changes. Afterwards timesheet has a
+-- partition for every year with data through next year, and the search
+-- indexes of section 12 are rebuilt.
+
+LOCK TABLE timesheet IN ACCESS EXCLUSIVE MODE;
+
+-- Move the old table out of the way; its constraint and index names are reused
+ALTER TABLE timesheet RENAME TO timesheet_unpartitioned;
+ALTER TABLE timesheet_unpartitioned RENAME CONSTRAINT timesheet_pkey TO timesheet_unpartitioned_pkey;
+ALTER TABLE timesheet_unpartitioned
+    RENAME CONSTRAINT timesheet_user_id_work_date_key TO timesheet_unpartitioned_user_id_work_date_key;
+ALTER TABLE timesheet_unpartitioned RENAME CONSTRAINT timesheet_user_id_fkey TO timesheet_unpartitioned_user_id_fkey;
+DROP INDEX IF EXISTS timesheet_task_tsv_idx;
+DROP INDEX IF EXISTS timesheet_task_trgm_idx;
+ALTER SEQUENCE timesheet_id_seq OWNED BY NONE;
+
+CREATE TABLE timesheet (
+    id INTEGER NOT NULL DEFAULT nextval('timesheet_id_seq'),
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    clock_in TIME NOT NULL,
+    clock_out TIME NOT NULL,
+    work_duration INTERVAL NOT NULL DEFAULT '00:00',
+    work_date DATE NOT NULL,
+    task_description TEXT NOT NULL,
+    task_tsv tsvector GENERATED ALWAYS AS (to_tsvector('english', task_description)) STORED,
+    PRIMARY KEY (id, work_date),
+    UNIQUE (user_id, work_date)
+) PARTITION BY RANGE (work_date);
+
+ALTER SEQUENCE timesheet_id_seq OWNED BY timesheet.id;
+
+CREATE TABLE IF NOT EXISTS timesheet_archived_years (
+    year INTEGER PRIMARY KEY,
+    location TEXT NOT NULL,
+    archived_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE OR REPLACE FUNCTION ensure_timesheet_partition(year INTEGER) RETURNS BOOLEAN AS $$
+BEGIN
+    IF to_regclass(format('timesheet_y%s', year)) IS NOT NULL THEN
+        RETURN FALSE;
+    END IF;
+    -- Two first writes of a new year: the second waits here, then finds the table
+    PERFORM pg_advisory_xact_lock(hashtext('timesheet_partition'), year);
+    IF EXISTS (SELECT 1 FROM timesheet_archived_years a WHERE a.year = ensure_timesheet_partition.year) THEN
+        RAISE EXCEPTION 'timesheet year % is archived', ensure_timesheet_partition.year
+            USING ERRCODE = 'object_not_in_prerequisite_state';
+    END IF;
+    IF to_regclass(format('timesheet_y%s', year)) IS NOT NULL THEN
+        RETURN FALSE;
+    END IF;
+    EXECUTE format(
+        'CREATE TABLE %I PARTITION OF timesheet FOR VALUES FROM (%L) TO (%L)',
+        format('timesheet_y%s', year), make_date(year, 1, 1), make_date(year + 1, 1, 1)
+    );
+    RETURN TRUE;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT count(*) AS partitions_created
+FROM generate_series(
+    least(2020, (SELECT extract(year FROM min(work_date))::int FROM timesheet_unpartitioned)),
+    extract(year FROM CURRENT_DATE)::int + 1
+) AS year
+WHERE ensure_timesheet_partition(year);
+
+INSERT INTO timesheet (id, user_id, clock_in, clock_out, work_duration, work_date, task_description)
+SELECT id, user_id, clock_in, clock_out, work_duration, work_date, task_description
+FROM timesheet_unpartitioned;
+
+-- Search indexes (schema.sql section 12), built once after the copy
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX timesheet_task_tsv_idx ON timesheet USING GIN (task_tsv);
+CREATE INDEX timesheet_task_trgm_idx ON timesheet USING GIN (task_description gin_trgm_ops);
+
+DROP TABLE timesheet_unpartitioned;
+
+ANALYZE timesheet;
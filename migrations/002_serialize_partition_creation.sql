@@ -0,0 +1,28 @@
+-- ensure_timesheet_partition with the creation serialized per year, for
+-- databases set up from an earlier schema.sql or 001_partition_timesheet.sql.
+-- Before it, two concurrent first writes of a new year could both try to
+-- create the partition and one failed with duplicate_table.
+--
+--     psql -v ON_ERROR_STOP=1 -d log_tracker -f migrations/002_serialize_partition_creation.sql
+
+CREATE OR REPLACE FUNCTION ensure_timesheet_partition(year INTEGER) RETURNS BOOLEAN AS $$
+BEGIN
+    IF to_regclass(format('timesheet_y%s', year)) IS NOT NULL THEN
+        RETURN FALSE;
+    END IF;
+    -- Two first writes of a new year: the second waits here, then finds the table
+    PERFORM pg_advisory_xact_lock(hashtext('timesheet_partition'), year);
+    IF EXISTS (SELECT 1 FROM timesheet_archived_years a WHERE a.year = ensure_timesheet_partition.year) THEN
+        RAISE EXCEPTION 'timesheet year % is archived', ensure_timesheet_partition.year
+            USING ERRCODE = 'object_not_in_prerequisite_state';
+    END IF;
+    IF to_regclass(format('timesheet_y%s', year)) IS NOT NULL THEN
+        RETURN FALSE;
+    END IF;
+    EXECUTE format(
+        'CREATE TABLE %I PARTITION OF timesheet FOR VALUES FROM (%L) TO (%L)',
+        format('timesheet_y%s', year), make_date(year, 1, 1), make_date(year + 1, 1, 1)
+    );
+    RETURN TRUE;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,22 @@
+-- users.updated_at, bumped by trigger when a user's name, email, role or
+-- status changes, for databases set up from an earlier schema.sql. The
+-- dashboard ETag (DASHBOARD_STAMP_SQL) includes it, so a rename or role
+-- change no longer answers 304 with the stale page.
+--
+--     psql -1 -v ON_ERROR_STOP=1 -d log_tracker -f migrations/003_users_updated_at.sql
+
+ALTER TABLE users ADD COLUMN updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
+
+CREATE OR REPLACE FUNCTION touch_user_updated_at() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.updated_at := now();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER users_touch_updated_at
+    BEFORE UPDATE OF username, email, role, is_verified, is_active ON users
+    FOR EACH ROW
+    WHEN (ROW(OLD.username, OLD.email, OLD.role, OLD.is_verified, OLD.is_active)
+          IS DISTINCT FROM ROW(NEW.username, NEW.email, NEW.role, NEW.is_verified, NEW.is_active))
+    EXECUTE FUNCTION touch_user_updated_at();
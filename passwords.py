@@ -0,0 +1,148 @@
+"""
+Password hashing policy and the worker pool that runs it.
+
+Account passwords are hashed with werkzeug using PASSWORD_HASH_METHOD
+(default "scrypt:32768:8:1", werkzeug's own default). Changing the method or
+its cost only affects new hashes; existing users are moved over the next
+time they log in (see needs_rehash and DatabaseManager.login_user).
+
+Hashing and verification run in a small process pool so a burst of logins
+uses at most PASSWORD_HASH_WORKERS cores and leaves the request threads free
+for other traffic. At most PASSWORD_HASH_MAX_PENDING operations may be queued
+or running; beyond that HasherBusy is raised immediately instead of queuing.
+Workers are started with the "spawn" method: the pool is created lazily, by
+which time the mail, job and punch threads are running, and forking a
+process that holds their locks can deadlock the child.
+
+    PASSWORD_HASH_METHOD=pbkdf2:sha256:600000
+    PASSWORD_HASH_WORKERS=2          # 0 hashes on the calling thread
+    PASSWORD_HASH_MAX_PENDING=8
+    PASSWORD_HASH_TIMEOUT=5          # seconds to wait for a result
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+logger = logging.getLogger('worklog.passwords')
+
+HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', min(2, os.cpu_count() or 1)))
+HASH_MAX_PENDING = int(os.getenv('PASSWORD_HASH_MAX_PENDING', max(HASH_WORKERS, 1) * 4))
+HASH_TIMEOUT = float(os.getenv('PASSWORD_HASH_TIMEOUT', 5))
+
+
+class HasherBusy(Exception):
+    """Too many hashing operations in flight; the caller should retry later."""
+
+
+def _hash(password, method):
+    return generate_password_hash(password, method=method)
+
+
+def _policy_prefix(method):
+    # werkzeug fills in default parameters ("scrypt" -> "scrypt:32768:8:1"),
+    # so compare against what it actually writes
+    return generate_password_hash('', method=method).split('$', 1)[0]
+
+
+class HashingPool:
+
+    def __init__(self, method=HASH_METHOD, workers=HASH_WORKERS, max_pending=HASH_MAX_PENDING,
+                 timeout=HASH_TIMEOUT):
+        self.method = method
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._prefix = None
+        self.stats = {'in_flight': 0, 'completed': 0, 'rejected': 0, 'timeouts': 0}
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.stats['rejected'] += 1
+            raise HasherBusy("password hashing pool is saturated")
+        with self._lock:
+            self.stats['in_flight'] += 1
+
+        def done(_future=None):
+            with self._lock:
+                self.stats['in_flight'] -= 1
+                self.stats['completed'] += 1
+            self._slots.release()
+
+        if self.workers <= 0:
+            try:
+                return fn(*args)
+            finally:
+                done()
+
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            done()
+            raise
+        # The slot is held until the work really finishes, even if we stop waiting
+        future.add_done_callback(done)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            with self._lock:
+                self.stats['timeouts'] += 1
+            raise HasherBusy("password hashing timed out")
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+
+    def hash(self, password):
+        return self._run(_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """True when pwhash was made with a different method or cost than the policy."""
+        if self._prefix is None:
+            self._prefix = _policy_prefix(self.method)
+        return pwhash.split('$', 1)[0] != self._prefix
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_pool():
+    """Process-wide HashingPool built from the PASSWORD_HASH_* settings."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = HashingPool()
+        return _default
+
+
+def hash_password(password):
+    return default_pool().hash(password)
+
+
+def verify_password(pwhash, password):
+    return default_pool().verify(pwhash, password)
+
+
+def needs_rehash(pwhash):
+    return default_pool().needs_rehash(pwhash)
@@ -0,0 +1,138 @@
+"""
+Live clock-in / clock-out punches with group commit.
+
+Request handlers hand punches to a PunchBuffer and block until they are
+durable, but never commit themselves: one flusher thread collects whatever
+arrived within PUNCH_FLUSH_INTERVAL seconds (or PUNCH_FLUSH_MAX punches) and
+writes the lot with a single INSERT and a single COMMIT
+(DatabaseManager.insert_punches). A burst of a thousand kiosk punches costs a
+handful of commits instead of a thousand.
+
+    buffer = PunchBuffer(get_pool)
+    buffer.submit([(user_id, 'in', datetime.now(), 'kiosk-3')])
+
+punch_events is append-only; the compact_punches job in jobs.py folds it into
+timesheet rows (DatabaseManager.compact_punches).
+
+    PUNCH_FLUSH_INTERVAL=0.02   # seconds a punch may wait for company
+    PUNCH_FLUSH_MAX=1000        # flush early once this many are waiting
+    PUNCH_COMMIT_TIMEOUT=5      # seconds submit() waits for the commit
+"""
+import logging
+import os
+import threading
+import time
+
+from db import DatabaseManager
+from metrics import registry as metrics
+
+logger = logging.getLogger('worklog.punches')
+
+FLUSH_INTERVAL = float(os.getenv('PUNCH_FLUSH_INTERVAL', 0.02))
+FLUSH_MAX = int(os.getenv('PUNCH_FLUSH_MAX', 1000))
+COMMIT_TIMEOUT = float(os.getenv('PUNCH_COMMIT_TIMEOUT', 5))
+
+metrics.describe('punch_flush_size', 'Punches written per group commit',
+                 buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000))
+
+
+class PunchNotCommitted(Exception):
+    """The flush failed or did not finish in time; the client should retry."""
+
+
+class _Ticket:
+    __slots__ = ('punches', 'done', 'error')
+
+    def __init__(self, punches):
+        self.punches = punches
+        self.done = threading.Event()
+        self.error = None
+
+
+class PunchBuffer:
+    """
+    :param pool_factory: Returns the connection pool (app.get_pool); called
+                         from the flusher thread on each flush
+    """
+
+    def __init__(self, pool_factory, flush_interval=FLUSH_INTERVAL, flush_max=FLUSH_MAX,
+                 commit_timeout=COMMIT_TIMEOUT):
+        self.pool_factory = pool_factory
+        self.flush_interval = flush_interval
+        self.flush_max = flush_max
+        self.commit_timeout = commit_timeout
+        self._pending = []
+        self._pending_count = 0
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+        self.stats = {'submitted': 0, 'flushes': 0, 'failed_flushes': 0}
+
+    def submit(self, punches):
+        """
+        Queue (user_id, kind, punched_at, source) tuples and wait for their
+        group commit. Raises PunchNotCommitted if that fails or times out;
+        resubmitting is safe since duplicates are ignored on insert.
+        """
+        ticket = _Ticket(list(punches))
+        with self._cond:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True, name='punch-flusher')
+                self._thread.start()
+            self._pending.append(ticket)
+            self._pending_count += len(ticket.punches)
+            self.stats['submitted'] += len(ticket.punches)
+            self._cond.notify()
+
+        if not ticket.done.wait(self.commit_timeout):
+            raise PunchNotCommitted("punch commit timed out")
+        if ticket.error is not None:
+            raise PunchNotCommitted(str(ticket.error))
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    def _take_batch(self):
+        with self._cond:
+            while not self._pending and not self._stopped:
+                self._cond.wait()
+            # Give concurrent requests a moment to join this commit
+            deadline = time.monotonic() + self.flush_interval
+            while self._pending_count < self.flush_max and not self._stopped:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch, self._pending, self._pending_count = self._pending, [], 0
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch:
+                self._flush(batch)
+            elif self._stopped:
+                return
+
+    def _flush(self, batch):
+        punches = [punch for ticket in batch for punch in ticket.punches]
+        error = db = None
+        try:
+            db = DatabaseManager(pool=self.pool_factory())
+            db.insert_punches(punches)
+        except Exception as e:
+            logger.exception("flush of %d punches failed", len(punches))
+            error = e
+        finally:
+            if db is not None:
+                db.close()
+
+        self.stats['flushes'] += 1
+        if error is not None:
+            self.stats['failed_flushes'] += 1
+        metrics.observe('punch_flush_size', len(punches))
+        for ticket in batch:
+            ticket.error = error
+            ticket.done.set()
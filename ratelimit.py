@@ -0,0 +1,149 @@
+"""
+Token-bucket rate limiting for the login and OTP endpoints.
+
+Each rule allows `burst` hits at once, refilled at `rate` tokens per second,
+and is tracked separately per identity (client IP, email, user id). Routes
+check before doing any database or hashing work:
+
+    retry_after = ratelimit.check(('login_ip', ip), ('login_email', email))
+    if retry_after:
+        ...  # 429
+
+Buckets live in a bounded in-process LRU. With RATE_LIMIT_PATH set they are
+kept in a sqlite file instead, so every worker process on the host shares
+the same budget (same idea as cache.SqliteBackend).
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from metrics import registry as metrics
+
+Rule = namedtuple('Rule', 'rate burst')
+
+
+def per_minute(count, burst=None):
+    return Rule(count / 60.0, burst or count)
+
+
+def per_hour(count, burst=None):
+    return Rule(count / 3600.0, burst or count)
+
+
+RULES = {
+    # Password guessing: per client and per targeted account
+    'login_ip': per_minute(30),
+    'login_email': per_minute(5),
+    # Every send hashes a new OTP and costs SMTP quota
+    'otp_send_ip': per_hour(20, burst=5),
+    'otp_send_email': per_hour(6, burst=3),
+    # Guessing a 6 digit code
+    'otp_verify_user': per_hour(30, burst=10),
+}
+
+metrics.describe('rate_limited_total', 'Requests rejected by a rate limit rule')
+
+
+def _take(tokens, updated, rule, cost, now):
+    """Refill then spend. :return: (tokens_left, retry_after_seconds)"""
+    tokens = min(rule.burst, tokens + (now - updated) * rule.rate)
+    if tokens >= cost:
+        return tokens - cost, 0.0
+    return tokens, (cost - tokens) / rule.rate
+
+
+class MemoryBucketStore:
+    """Buckets as (tokens, updated) tuples in an LRU; an evicted bucket is simply full again."""
+
+    def __init__(self, maxsize=100_000):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rule, cost=1.0):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (rule.burst, now))
+            tokens, retry_after = _take(tokens, updated, rule, cost, now)
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return retry_after
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class SqliteBucketStore:
+    """Buckets in a sqlite file shared by the worker processes on one host."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._conn().execute("""
+            CREATE TABLE IF NOT EXISTS rate_buckets (
+                key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL
+            )
+        """)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, rule, cost=1.0):
+        # Wall clock: monotonic time is not comparable across processes
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM rate_buckets WHERE key = ?", (key,)).fetchone()
+            tokens, updated = row if row else (rule.burst, now)
+            tokens, retry_after = _take(tokens, min(updated, now), rule, cost, now)
+            conn.execute("INSERT OR REPLACE INTO rate_buckets VALUES (?, ?, ?)", (key, tokens, now))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return retry_after
+
+    def reset(self):
+        self._conn().execute("DELETE FROM rate_buckets")
+
+
+def store_from_env():
+    path = os.getenv('RATE_LIMIT_PATH')
+    if path:
+        return SqliteBucketStore(path)
+    return MemoryBucketStore(int(os.getenv('RATE_LIMIT_MAX_KEYS', 100_000)))
+
+
+ENABLED = os.getenv('RATE_LIMIT_ENABLED', '1') != '0'
+store = store_from_env()
+
+
+def check(*hits):
+    """
+    Spend one token from each (rule_name, identity) bucket; identities that
+    are None/empty are skipped. All buckets are charged even when one of
+    them is already empty.
+
+    :return: Seconds until the most limited bucket allows another hit (0 if allowed)
+    """
+    if not ENABLED:
+        return 0
+    retry_after = 0.0
+    for rule_name, identity in hits:
+        if not identity:
+            continue
+        wait = store.take(f"{rule_name}:{str(identity).strip().lower()}", RULES[rule_name])
+        if wait:
+            metrics.inc('rate_limited_total', {'rule': rule_name})
+            retry_after = max(retry_after, wait)
+    return int(retry_after) + 1 if retry_after else 0
@@ -13,20 +13,77 @@ CREATE TABLE users (
     role user_role NOT NULL DEFAULT 'user',
     is_verified BOOLEAN DEFAULT FALSE,
     is_active BOOLEAN DEFAULT TRUE,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()   -- name/role/status changes; dashboard ETags
 );
 
--- 4️ Timesheet table
+-- Renames and role changes are usually made by hand, so a trigger keeps
+-- updated_at honest. Password and session bookkeeping do not count.
+CREATE OR REPLACE FUNCTION touch_user_updated_at() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.updated_at := now();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER users_touch_updated_at
+    BEFORE UPDATE OF username, email, role, is_verified, is_active ON users
+    FOR EACH ROW
+    WHEN (ROW(OLD.username, OLD.email, OLD.role, OLD.is_verified, OLD.is_active)
+          IS DISTINCT FROM ROW(NEW.username, NEW.email, NEW.role, NEW.is_verified, NEW.is_active))
+    EXECUTE FUNCTION touch_user_updated_at();
+
+-- 4️ Timesheet table, range partitioned by year of work_date (timesheet_y2025, ...).
+-- Partitions are created ahead by the maintain_timesheet_partitions job and
+-- closed years can be archived (DatabaseManager.archive_timesheet_year).
+-- Reads bounded by work_date only touch the partitions in range.
+-- Existing databases: migrations/001_partition_timesheet.sql rebuilds the table.
 CREATE TABLE timesheet (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
     clock_in TIME NOT NULL,
     clock_out TIME NOT NULL,
     work_duration INTERVAL NOT NULL DEFAULT '00:00',
     work_date DATE NOT NULL,
     task_description TEXT NOT NULL,
+    PRIMARY KEY (id, work_date),
     UNIQUE (user_id, work_date)
-);	
+) PARTITION BY RANGE (work_date);
+
+-- Years taken out of timesheet by DatabaseManager.archive_timesheet_year
+-- (moved to the timesheet_archive schema or dumped to a file); never recreated
+CREATE TABLE timesheet_archived_years (
+    year INTEGER PRIMARY KEY,
+    location TEXT NOT NULL,
+    archived_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Create the partition for one year if it is missing; TRUE when created.
+-- Archived years raise object_not_in_prerequisite_state instead.
+CREATE OR REPLACE FUNCTION ensure_timesheet_partition(year INTEGER) RETURNS BOOLEAN AS $$
+BEGIN
+    IF to_regclass(format('timesheet_y%s', year)) IS NOT NULL THEN
+        RETURN FALSE;
+    END IF;
+    -- Two first writes of a new year: the second waits here, then finds the table
+    PERFORM pg_advisory_xact_lock(hashtext('timesheet_partition'), year);
+    IF EXISTS (SELECT 1 FROM timesheet_archived_years a WHERE a.year = ensure_timesheet_partition.year) THEN
+        RAISE EXCEPTION 'timesheet year % is archived', ensure_timesheet_partition.year
+            USING ERRCODE = 'object_not_in_prerequisite_state';
+    END IF;
+    IF to_regclass(format('timesheet_y%s', year)) IS NOT NULL THEN
+        RETURN FALSE;
+    END IF;
+    EXECUTE format(
+        'CREATE TABLE %I PARTITION OF timesheet FOR VALUES FROM (%L) TO (%L)',
+        format('timesheet_y%s', year), make_date(year, 1, 1), make_date(year + 1, 1, 1)
+    );
+    RETURN TRUE;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT ensure_timesheet_partition(year)
+FROM generate_series(2020, extract(year FROM CURRENT_DATE)::int + 1) AS year;
 
 -- 5️ OTP table
 CREATE TABLE user_otp (
@@ -44,6 +101,105 @@ CREATE TABLE user_otp (
 ALTER TABLE users
 ALTER COLUMN password_hash TYPE TEXT;
 
+-- 6️ Outbound email queue, drained by the workers in mailer.py
+CREATE TABLE email_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    to_email VARCHAR(255) NOT NULL,
+    subject TEXT NOT NULL,
+    body TEXT NOT NULL,
+    status VARCHAR(10) NOT NULL DEFAULT 'pending',   -- pending / sent / failed
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    sent_at TIMESTAMP
+);
+
+CREATE INDEX email_outbox_due_idx ON email_outbox (next_attempt_at) WHERE status = 'pending';
+
+-- Serves verify_otp's "latest unused OTP for this user and purpose" lookup
+CREATE INDEX user_otp_active_idx ON user_otp (user_id, purpose, created_at DESC) WHERE is_used = FALSE;
+
+-- 7️ Hours per user and week/month, kept current by DatabaseManager.refresh_summaries
+-- (backfill an existing database with DatabaseManager().rebuild_summaries())
+CREATE TABLE timesheet_summary (
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    period VARCHAR(5) NOT NULL,              -- week / month
+    period_start DATE NOT NULL,
+    days_worked INTEGER NOT NULL,
+    weekdays_worked INTEGER NOT NULL,
+    total_seconds BIGINT NOT NULL,           -- net of the daily break
+    overtime_seconds BIGINT NOT NULL,
+    PRIMARY KEY (period, period_start, user_id)
+);
+
+-- 8️ Server-side sessions (sessions.py); sid is a SHA-256 of the cookie value
+CREATE TABLE user_sessions (
+    sid CHAR(64) PRIMARY KEY,
+    user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,   -- NULL before login
+    data JSONB NOT NULL,
+    expires_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX user_sessions_user_idx ON user_sessions (user_id) WHERE user_id IS NOT NULL;
+CREATE INDEX user_sessions_expires_idx ON user_sessions (expires_at);
+
+-- 9️ Per-user change counter for timesheet rows, bumped with timesheet_summary;
+-- dashboard ETags / Last-Modified are derived from it
+CREATE TABLE timesheet_versions (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    version BIGINT NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL
+);
+
+-- 10 Bearer tokens for the JSON API (api.py); only the SHA-256 is stored
+CREATE TABLE api_tokens (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    name VARCHAR(100) NOT NULL,
+    token_hash CHAR(64) NOT NULL UNIQUE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_used_at TIMESTAMP,
+    revoked_at TIMESTAMP
+);
+
+CREATE INDEX api_tokens_user_idx ON api_tokens (user_id) WHERE revoked_at IS NULL;
+
+-- 11 Raw clock-in / clock-out punches (punches.py). Append-only; the
+-- compact_punches job folds them into timesheet and stamps compacted_at.
+-- The UNIQUE constraint makes a client retrying a punch harmless.
+CREATE TYPE punch_kind AS ENUM ('in', 'out');
+
+CREATE TABLE punch_events (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    kind punch_kind NOT NULL,
+    punched_at TIMESTAMP NOT NULL,
+    source VARCHAR(100),
+    received_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    compacted_at TIMESTAMP,
+    UNIQUE (user_id, kind, punched_at)
+);
+
+CREATE INDEX punch_events_pending_idx ON punch_events (user_id, punched_at) WHERE compacted_at IS NULL;
+
+-- 12 Task description search (DatabaseManager.search_logs): a generated
+-- tsvector for word / phrase queries, trigrams for substring matches
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE timesheet
+ADD COLUMN task_tsv tsvector
+GENERATED ALWAYS AS (to_tsvector('english', task_description)) STORED;
+
+CREATE INDEX timesheet_task_tsv_idx ON timesheet USING GIN (task_tsv);
+CREATE INDEX timesheet_task_trgm_idx ON timesheet USING GIN (task_description gin_trgm_ops);
+
+-- 13 User picker typeahead (DatabaseManager.search_users): prefix lookups on
+-- username / email, trigrams for substrings of the name
+CREATE INDEX users_username_prefix_idx ON users (lower(username) text_pattern_ops);
+CREATE INDEX users_email_prefix_idx ON users (lower(email) text_pattern_ops);
+CREATE INDEX users_username_trgm_idx ON users USING GIN (username gin_trgm_ops);
+
 
 ---------------------------------------------------------------------------
 --Only for testing purpose
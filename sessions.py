@@ -0,0 +1,136 @@
+"""
+Server-side sessions: the cookie carries only a random session id, the data
+lives in the user_sessions table (behind db.session_cache).
+
+    app.session_interface = ServerSideSessionInterface(get_db)
+
+Only sessions that changed are written back, so most requests (dashboard
+reads) cost one cached lookup and no serialization. The table stores a
+SHA-256 of the id, never the id itself, and the id is rotated whenever the
+session is cleared (login), so a pre-login id cannot be fixed on a victim.
+Revoking is a DELETE: logout, and every session of a user on password reset
+(DatabaseManager.revoke_user_sessions). Expired rows are removed by the
+purge_sessions job in jobs.py.
+"""
+import hashlib
+import secrets
+from datetime import datetime, timedelta
+
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+from db import session_cache
+
+UNCACHED = object()
+
+
+def new_sid():
+    return secrets.token_urlsafe(32)
+
+
+def sid_key(sid):
+    """What user_sessions.sid stores for a cookie value."""
+    return hashlib.sha256(sid.encode()).hexdigest()
+
+
+class ServerSession(CallbackDict, SessionMixin):
+
+    def __init__(self, initial=None, sid=None, new=False, expires_at=None):
+        def on_update(session):
+            session.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid or new_sid()
+        self.new = new
+        self.expires_at = expires_at
+        self.previous_sid = None
+        self.modified = False
+
+    def clear(self):
+        # New identity for a new login; the old row is dropped on save
+        if not self.new and self.previous_sid is None:
+            self.previous_sid = self.sid
+        self.sid = new_sid()
+        super().clear()
+
+
+class SessionStore:
+    """
+    The framework-independent half: what to write, when, and with which
+    expiry. `lifetime` is how long an untouched session stays valid.
+    """
+
+    def __init__(self, lifetime=timedelta(hours=12)):
+        self.lifetime = lifetime
+
+    def cached(self, sid):
+        """
+        load_session()'s result straight from db.session_cache, so a cached
+        session needs no database connection; UNCACHED when not cached.
+        """
+        entry = session_cache.get(('session', sid_key(sid)), UNCACHED)
+        if entry is UNCACHED or entry is None:
+            return entry
+        return entry if entry[1] > datetime.now() else None
+
+    def open(self, sid, loaded):
+        """loaded is load_session()'s result for sid_key(sid)."""
+        if sid and loaded is not None:
+            data, expires_at = loaded
+            return ServerSession(data, sid=sid, expires_at=expires_at)
+        return ServerSession(new=True)
+
+    def plan(self, session):
+        """
+        :return: ('delete' | 'save' | None, expires_at). Unmodified sessions
+                 are only re-saved once half their lifetime has passed, to
+                 slide the expiry forward without a write per request.
+        """
+        if not session:
+            return ('delete' if not session.new and session.modified else None), None
+        now = datetime.now()
+        if not session.modified and session.expires_at is not None \
+                and session.expires_at - now > self.lifetime / 2:
+            return None, session.expires_at
+        return 'save', now + self.lifetime
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """
+    Flask session interface backed by DatabaseManager.load_session and
+    friends. db_factory returns the request's DatabaseManager (app.get_db).
+    """
+
+    def __init__(self, db_factory, lifetime=timedelta(hours=12)):
+        self.db_factory = db_factory
+        self.store = SessionStore(lifetime)
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        loaded = self.store.cached(sid) if sid else None
+        if loaded is UNCACHED:
+            loaded = self.db_factory().load_session(sid_key(sid))
+        return self.store.open(sid, loaded)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        action, expires_at = self.store.plan(session)
+
+        if session.previous_sid:
+            self.db_factory().delete_session(sid_key(session.previous_sid))
+        if action == 'delete':
+            if not session.previous_sid:
+                self.db_factory().delete_session(sid_key(session.sid))
+            response.delete_cookie(name, domain=domain, path=path)
+        elif action == 'save':
+            self.db_factory().save_session(sid_key(session.sid), session.get('user_id'),
+                                           dict(session), expires_at)
+            response.set_cookie(
+                name, session.sid,
+                expires=expires_at if session.permanent else None,
+                httponly=self.get_cookie_httponly(app),
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+                domain=domain, path=path,
+            )
@@ -0,0 +1,192 @@
+"""
+Prepared statements for DatabaseManager's fixed SQL.
+
+Hot queries are declared once, at import time, with the usual psycopg2
+placeholders:
+
+    LOGIN_USER_SQL = statements.declare('login_user', "SELECT ... FROM users WHERE email = %s")
+
+and run as before: self.cursor.execute(LOGIN_USER_SQL, (email,)). The
+instrumented cursors in db.py PREPARE a statement the first time a pooled
+connection runs it and send `EXECUTE login_user (...)` from then on, so
+Postgres parses and plans it once per connection instead of once per call
+(and may settle on a cached generic plan after five executions). Generated
+SQL (dashboard_query, log_rows_query) goes through statements.for_sql(),
+which names each distinct text the first time it is seen.
+
+A Statement is still a str: with prepared statements switched off, on a
+plain psycopg2 connection or on a named cursor it runs as literal SQL.
+
+    DB_PREPARED_STATEMENTS=0         # e.g. behind PgBouncer transaction pooling
+    DB_MAX_PREPARED_STATEMENTS=200   # distinct texts past this run unprepared
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_INERROR, connection as BaseConnection
+
+from metrics import registry as metrics
+
+logger = logging.getLogger('worklog.db')
+
+ENABLED = os.getenv('DB_PREPARED_STATEMENTS', '1') != '0'
+MAX_STATEMENTS = int(os.getenv('DB_MAX_PREPARED_STATEMENTS', 200))
+
+_PLACEHOLDER = re.compile(r"%\((\w+)\)s|%s|%%")
+
+metrics.describe('db_statement_prepares_total', 'PREPAREs sent to Postgres, by statement')
+
+
+def to_positional(sql):
+    """
+    psycopg2 placeholders to PREPARE's: '%(a)s ... %s' style -> '$1 ... $n'.
+
+    :return: (sql, param_names, param_count); param_names is empty for
+             positional %s statements
+    """
+    names = []
+    positional = 0
+
+    def replace(match):
+        nonlocal positional
+        if match.group(0) == '%%':
+            return '%'
+        name = match.group(1)
+        if name is None:
+            positional += 1
+            return f"${positional}"
+        if name not in names:
+            names.append(name)
+        return f"${names.index(name) + 1}"
+
+    text = _PLACEHOLDER.sub(replace, sql)
+    if names and positional:
+        raise ValueError("statement mixes %s and %(name)s placeholders")
+    return text, names, len(names) or positional
+
+
+class Statement(str):
+    """SQL text plus what it takes to run it as a prepared statement."""
+
+    def __new__(cls, name, sql):
+        self = super().__new__(cls, sql)
+        self.name = name
+        self.prepare_sql, self.param_names, self.param_count = to_positional(sql)
+        placeholders = ', '.join(['%s'] * self.param_count)
+        self.execute_sql = f"EXECUTE {name} ({placeholders})" if self.param_count else f"EXECUTE {name}"
+        return self
+
+    def execute_args(self, params):
+        if self.param_names:
+            return tuple(params[name] for name in self.param_names)
+        return tuple(params or ())
+
+
+class PreparingConnection(BaseConnection):
+    """psycopg2 connection that remembers which statements it has prepared."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+class StatementRegistry:
+
+    def __init__(self, max_statements=MAX_STATEMENTS):
+        self.max_statements = max_statements
+        self._by_sql = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def declare(self, name, sql):
+        statement = Statement(name, sql)
+        with self._lock:
+            if name in self._stats:
+                raise ValueError(f"statement {name} declared twice")
+            self._add(statement)
+        return statement
+
+    def for_sql(self, sql):
+        """
+        The Statement for a generated query text, registered on first sight;
+        the text itself once max_statements distinct ones exist.
+        """
+        statement = self._by_sql.get(sql)
+        if statement is not None:
+            return statement
+        with self._lock:
+            statement = self._by_sql.get(sql)
+            if statement is None:
+                if len(self._stats) >= self.max_statements:
+                    return sql
+                statement = Statement('q_' + hashlib.sha1(sql.encode()).hexdigest()[:16], sql)
+                self._add(statement)
+        return statement
+
+    def _add(self, statement):
+        self._by_sql[str(statement)] = statement
+        self._stats[statement.name] = {
+            'sql': ' '.join(statement.split()),
+            'prepares': 0,
+            'executions': 0,
+            'unpreparable': False,
+        }
+
+    def prepared(self, cursor, statement, params):
+        """
+        :return: (sql, params) to send for statement on cursor: EXECUTE if
+                 the connection has it prepared (preparing it now if
+                 needed), else the statement text and params unchanged
+        """
+        conn = cursor.connection
+        prepared = getattr(conn, 'prepared', None)
+        stats = self._stats[statement.name]
+        if prepared is None or cursor.name is not None or stats['unpreparable']:
+            return statement, params
+        if statement.name not in prepared:
+            if not self._prepare(conn, statement):
+                return statement, params
+            prepared.add(statement.name)
+        with self._lock:
+            stats['executions'] += 1
+        return statement.execute_sql, statement.execute_args(params)
+
+    def _prepare(self, conn, statement):
+        if conn.get_transaction_status() == TRANSACTION_STATUS_INERROR:
+            return False
+        with conn.cursor() as cur:
+            # Savepoint so a statement Postgres refuses cannot abort the caller's transaction
+            if not conn.autocommit:
+                cur.execute("SAVEPOINT prepare_statement")
+            try:
+                cur.execute(f"PREPARE {statement.name} AS {statement.prepare_sql}")
+                ok = True
+            except psycopg2.errors.DuplicatePreparedStatement:
+                ok = True
+            except psycopg2.Error as e:
+                ok = False
+                if isinstance(e, psycopg2.ProgrammingError):
+                    # e.g. a parameter whose type Postgres cannot infer: stop trying
+                    self._stats[statement.name]['unpreparable'] = True
+                    logger.warning("statement %s runs unprepared: %s", statement.name, e)
+            if not conn.autocommit:
+                if not ok or conn.get_transaction_status() == TRANSACTION_STATUS_INERROR:
+                    cur.execute("ROLLBACK TO SAVEPOINT prepare_statement")
+                cur.execute("RELEASE SAVEPOINT prepare_statement")
+        if ok:
+            with self._lock:
+                self._stats[statement.name]['prepares'] += 1
+            metrics.inc('db_statement_prepares_total', {'statement': statement.name})
+        return ok
+
+    def stats(self):
+        """Per statement: sql, prepares (connections it went to), executions, unpreparable."""
+        with self._lock:
+            return {name: dict(stats) for name, stats in self._stats.items()}
+
+
+registry = StatementRegistry()
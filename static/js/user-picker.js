@@ -0,0 +1,81 @@
+// Typeahead for the senior/admin user fields on the dashboard. Each
+// [data-user-picker] element holds a search input, a hidden user_id input and
+// a .user-picker-menu; suggestions come from data-source (/users/search).
+(function () {
+    'use strict';
+
+    function setup(picker) {
+        var input = picker.querySelector('input[type=search]');
+        var hidden = picker.querySelector('input[type=hidden]');
+        var menu = picker.querySelector('.user-picker-menu');
+        var timer = null;
+        var controller = null;
+
+        function close() {
+            menu.classList.add('d-none');
+            menu.innerHTML = '';
+        }
+
+        function render(users) {
+            menu.innerHTML = '';
+            users.forEach(function (user) {
+                var item = document.createElement('button');
+                item.type = 'button';
+                item.className = 'list-group-item list-group-item-action';
+                item.textContent = user.username + ' (' + user.email + ')';
+                // mousedown fires before the input's blur closes the menu
+                item.addEventListener('mousedown', function (event) {
+                    event.preventDefault();
+                    input.value = user.username;
+                    hidden.value = user.id;
+                    input.classList.remove('is-invalid');
+                    close();
+                });
+                menu.appendChild(item);
+            });
+            menu.classList.toggle('d-none', users.length === 0);
+        }
+
+        function search() {
+            var query = input.value.trim();
+            if (controller) {
+                controller.abort();
+            }
+            if (!query) {
+                close();
+                return;
+            }
+            controller = new AbortController();
+            fetch(picker.dataset.source + '?q=' + encodeURIComponent(query), {
+                credentials: 'same-origin',
+                signal: controller.signal
+            })
+                .then(function (response) { return response.ok ? response.json() : {users: []}; })
+                .then(function (data) { render(data.users); })
+                .catch(function () {});
+        }
+
+        input.addEventListener('input', function () {
+            hidden.value = '';  // the typed text no longer names the chosen user
+            clearTimeout(timer);
+            timer = setTimeout(search, 150);
+        });
+        input.addEventListener('blur', close);
+        input.addEventListener('keydown', function (event) {
+            if (event.key === 'Escape') {
+                close();
+            }
+        });
+
+        if (picker.hasAttribute('data-required')) {
+            picker.closest('form').addEventListener('submit', function (event) {
+                if (!hidden.value) {
+                    event.preventDefault();
+                    input.classList.add('is-invalid');
+                }
+            });
+        }
+    }
+
+    document.querySelectorAll('[data-user-picker]').forEach(setup);
+})();
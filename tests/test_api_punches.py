@@ -0,0 +1,32 @@
+"""parse_punch: who a punch is for."""
+from datetime import datetime
+
+import pytest
+
+from api import ApiError, parse_punch
+
+NOW = datetime(2026, 3, 2, 9, 0)
+USER = {'user_id': 12, 'role': 'user'}
+ADMIN = {'user_id': 1, 'role': 'admin'}
+
+
+@pytest.mark.parametrize('value', [None, 12, '12', ' 12 '])
+def test_own_user_id_in_any_form_is_the_caller(value):
+    assert parse_punch({'kind': 'in', 'user_id': value}, USER, NOW) == (12, 'in', NOW)
+
+
+def test_user_cannot_punch_for_someone_else():
+    with pytest.raises(ApiError) as exc:
+        parse_punch({'kind': 'in', 'user_id': '13'}, USER, NOW)
+    assert exc.value.status == 403
+
+
+def test_admin_punches_for_string_user_id():
+    assert parse_punch({'kind': 'out', 'user_id': '13'}, ADMIN, NOW) == (13, 'out', NOW)
+
+
+@pytest.mark.parametrize('value', ['abc', '', [12], {'id': 12}])
+def test_bad_user_id_is_a_400(value):
+    with pytest.raises(ApiError) as exc:
+        parse_punch({'kind': 'in', 'user_id': value}, ADMIN, NOW)
+    assert exc.value.status == 400
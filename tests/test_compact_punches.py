@@ -0,0 +1,116 @@
+"""compact_punches with a punch in an archived year, on a stub connection."""
+from datetime import datetime
+
+import psycopg2.errors
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+import db
+
+ARCHIVED_YEAR = 2012
+
+
+class StubCursor:
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.connection = conn
+        self.rows = []
+
+    def execute(self, query, params=None):
+        if isinstance(query, bytes):
+            query = query.decode()   # execute_values sends the built statement as bytes
+        self.conn.executed.append((query, params))
+        self.rows = []
+        if query is db.ENSURE_PARTITION_SQL and params[0].year == ARCHIVED_YEAR:
+            raise psycopg2.errors.ObjectNotInPrerequisiteState()
+        if 'FROM punch_events' in query and 'FOR UPDATE SKIP LOCKED' in query:
+            self.rows = self.conn.events
+
+    def mogrify(self, template, args):
+        return repr(args).encode()
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class StubConnection:
+    closed = 0
+    encoding = 'UTF8'
+
+    def __init__(self, events):
+        self.events = events
+        self.executed = []
+        self.commits = 0
+
+    def cursor(self, name=None, cursor_factory=None):
+        return StubCursor(self)
+
+    def get_transaction_status(self):
+        return TRANSACTION_STATUS_IDLE
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+
+class StubPool:
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def getconn(self):
+        return self.conn
+
+    def putconn(self, conn, close=False):
+        pass
+
+
+def punch(event_id, kind, at):
+    return {'id': event_id, 'user_id': 7, 'kind': kind, 'punched_at': at}
+
+
+def compact(events):
+    conn = StubConnection(events)
+    manager = db.DatabaseManager(pool=StubPool(conn))
+    result = manager.compact_punches()
+    return result, conn
+
+
+def statements(conn, needle):
+    return [(query, params) for query, params in conn.executed if needle in query]
+
+
+def test_archived_year_punches_are_dropped_and_marked_compacted():
+    (folded, dropped), conn = compact([
+        punch(1, 'in', datetime(ARCHIVED_YEAR, 3, 1, 9)),
+        punch(2, 'out', datetime(ARCHIVED_YEAR, 3, 1, 17)),
+    ])
+
+    assert (folded, dropped) == (0, 2)
+    assert not statements(conn, 'ON CONFLICT (user_id, work_date)')
+    [(_, params)] = statements(conn, 'SET compacted_at')
+    assert params == ([1, 2],)
+    assert conn.commits == 1
+
+
+def test_archived_year_does_not_block_the_rest_of_the_batch():
+    (folded, dropped), conn = compact([
+        punch(1, 'in', datetime(ARCHIVED_YEAR, 3, 1, 9)),
+        punch(2, 'out', datetime(ARCHIVED_YEAR, 3, 1, 17)),
+        punch(3, 'in', datetime(2026, 3, 2, 9)),
+        punch(4, 'out', datetime(2026, 3, 2, 17)),
+    ])
+
+    assert (folded, dropped) == (1, 2)
+    [(insert, _)] = statements(conn, 'ON CONFLICT (user_id, work_date)')
+    assert '2026' in insert and '2012' not in insert
+    [(_, params)] = statements(conn, 'SET compacted_at')
+    assert params == ([1, 2, 3, 4],)
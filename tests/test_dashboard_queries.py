@@ -0,0 +1,126 @@
+"""
+Statements per dashboard render, counted on a stub connection.
+
+A full render is two statements: the stamp (timesheet_versions and
+users.updated_at) that decides the conditional GET, then load_dashboard's
+single query. A 304 stops after the stamp. Folding the stamp into the
+dashboard query would make every 304 pay for the whole page.
+"""
+import pytest
+from flask.sessions import SecureCookieSessionInterface
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+import app as appmod
+import db
+
+
+class StubCursor:
+    users_stamp = '1:1700000000'
+
+    def __init__(self, executed):
+        self.executed = executed
+        self.row = None
+
+    def execute(self, query, params=None):
+        self.executed.append(query)
+        if query is db.DASHBOARD_STAMP_SQL:
+            self.row = {'versions': '1:7', 'users': self.users_stamp, 'updated_at': None}
+        else:
+            self.row = {'username': 'ann', 'logs': [], 'target_username': None, 'target_logs': None}
+
+    def fetchone(self):
+        return self.row
+
+    def fetchall(self):
+        return [self.row]
+
+    def close(self):
+        pass
+
+
+class StubConnection:
+    closed = 0
+
+    def __init__(self):
+        self.executed = []
+
+    def cursor(self, name=None, cursor_factory=None):
+        return StubCursor(self.executed)
+
+    def get_transaction_status(self):
+        return TRANSACTION_STATUS_IDLE
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+class StubPool:
+
+    def __init__(self):
+        self.conn = StubConnection()
+
+    def getconn(self):
+        return self.conn
+
+    def putconn(self, conn, close=False):
+        pass
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    stub = StubPool()
+    monkeypatch.setattr(appmod, 'get_pool', lambda: stub)
+    monkeypatch.setattr(appmod.app, 'session_interface', SecureCookieSessionInterface())
+    return stub
+
+
+def login(client, user_id=1, role='user'):
+    with client.session_transaction() as session:
+        session.update(user_id=user_id, user_role=role, username='ann')
+
+
+def test_dashboard_render_is_stamp_plus_one_query(pool):
+    client = appmod.app.test_client()
+    login(client)
+
+    response = client.get('/dashboard')
+
+    assert response.status_code == 200
+    assert len(pool.conn.executed) == 2
+    assert pool.conn.executed[0] is db.DASHBOARD_STAMP_SQL
+
+
+def test_dashboard_with_selected_user_is_still_two_queries(pool):
+    client = appmod.app.test_client()
+    login(client, role='admin')
+
+    response = client.get('/dashboard?user_id=2')
+
+    assert response.status_code == 200
+    assert len(pool.conn.executed) == 2
+
+
+def test_unchanged_dashboard_answers_304_after_the_stamp(pool):
+    client = appmod.app.test_client()
+    login(client)
+    etag = client.get('/dashboard').headers['ETag']
+    pool.conn.executed.clear()
+
+    response = client.get('/dashboard', headers={'If-None-Match': etag})
+
+    assert response.status_code == 304
+    assert pool.conn.executed == [db.DASHBOARD_STAMP_SQL]
+
+
+def test_renamed_user_gets_a_fresh_dashboard(pool, monkeypatch):
+    client = appmod.app.test_client()
+    login(client)
+    etag = client.get('/dashboard').headers['ETag']
+    monkeypatch.setattr(StubCursor, 'users_stamp', '1:1700000060')
+
+    response = client.get('/dashboard', headers={'If-None-Match': etag})
+
+    assert response.status_code == 200
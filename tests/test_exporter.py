@@ -0,0 +1,42 @@
+"""Export cells that a spreadsheet would evaluate are written as text."""
+import csv
+import io
+from decimal import Decimal
+
+import pytest
+
+import exporter
+
+
+def exported(rows):
+    body = b''.join(exporter.csv_chunks(['user', 'task', 'hours'], rows)).decode('utf-8')
+    return list(csv.reader(io.StringIO(body)))[1:]
+
+
+def test_formula_cells_are_prefixed():
+    rows = exported([
+        ('=HYPERLINK("http://x")', '+1', '-2'),
+        ('@SUM(A1)', '\tx', 'plain'),
+    ])
+    assert rows == [
+        ["'=HYPERLINK(\"http://x\")", "'+1", "'-2"],
+        ["'@SUM(A1)", "'\tx", 'plain'],
+    ]
+
+
+def test_other_values_are_unchanged():
+    assert exported([('ann', 'wrote a=b', Decimal('-1.5'))]) == [['ann', 'wrote a=b', '-1.5']]
+
+
+def test_xlsx_cells_are_escaped():
+    openpyxl = pytest.importorskip('openpyxl')
+    with exporter.xlsx_file(['user', 'task'], [('ann', '=1+1')]) as fh:
+        sheet = openpyxl.load_workbook(fh).active
+        assert [cell.value for cell in sheet[2]] == ['ann', "'=1+1"]
+
+
+def test_xlsx_refuses_more_than_max_rows():
+    pytest.importorskip('openpyxl')
+    rows = iter([('ann', 'a'), ('bob', 'b'), ('cid', 'c')])
+    with pytest.raises(exporter.ExportTooLarge):
+        exporter.xlsx_file(['user', 'task'], rows, max_rows=2)
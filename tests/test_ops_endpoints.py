@@ -0,0 +1,60 @@
+"""Operational endpoints answer admins and OPS_TOKEN holders only."""
+import pytest
+from flask.sessions import SecureCookieSessionInterface
+
+import app as appmod
+
+OPS_ENDPOINTS = ['/pool/stats', '/db/statements', '/metrics']
+
+
+class StubPool:
+
+    def stats(self):
+        return {'in_use': 0}
+
+
+class StubDb:
+
+    def get_prepared_statements(self):
+        return []
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(appmod, 'get_pool', lambda: StubPool())
+    monkeypatch.setattr(appmod, 'get_db', lambda: StubDb())
+    monkeypatch.setattr(appmod, 'OPS_TOKEN', 'ops-secret')
+    monkeypatch.setattr(appmod.app, 'session_interface', SecureCookieSessionInterface())
+    return appmod.app.test_client()
+
+
+def login(client, role):
+    with client.session_transaction() as session:
+        session.update(user_id=1, user_role=role, username='ann')
+
+
+@pytest.mark.parametrize('path', OPS_ENDPOINTS)
+def test_anonymous_is_forbidden(client, path):
+    assert client.get(path).status_code == 403
+
+
+@pytest.mark.parametrize('path', OPS_ENDPOINTS)
+def test_non_admin_is_forbidden(client, path):
+    login(client, 'senior')
+    assert client.get(path).status_code == 403
+
+
+@pytest.mark.parametrize('path', OPS_ENDPOINTS)
+def test_wrong_token_is_forbidden(client, path):
+    assert client.get(path, headers={'Authorization': 'Bearer nope'}).status_code == 403
+
+
+@pytest.mark.parametrize('path', OPS_ENDPOINTS)
+def test_admin_session_is_allowed(client, path):
+    login(client, 'admin')
+    assert client.get(path).status_code == 200
+
+
+@pytest.mark.parametrize('path', OPS_ENDPOINTS)
+def test_ops_token_is_allowed(client, path):
+    assert client.get(path, headers={'Authorization': 'Bearer ops-secret'}).status_code == 200
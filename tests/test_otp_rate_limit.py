@@ -0,0 +1,48 @@
+"""OTP guesses are charged to one otp_verify_user bucket per account, by user id."""
+import pytest
+from flask.sessions import SecureCookieSessionInterface
+
+import app as appmod
+
+
+class StubDb:
+
+    def get_user_by_email(self, email):
+        return {'id': 5, 'username': 'ann', 'email': email}
+
+    def verify_otp(self, user_id, otp, purpose='verify_email'):
+        return False, "Invalid OTP"
+
+
+@pytest.fixture
+def client(monkeypatch):
+    charged = []
+
+    def check(*hits):
+        charged.extend(hits)
+        return 0
+
+    monkeypatch.setattr(appmod, 'get_db', lambda: StubDb())
+    monkeypatch.setattr(appmod.ratelimit, 'check', check)
+    monkeypatch.setattr(appmod.app, 'session_interface', SecureCookieSessionInterface())
+    client = appmod.app.test_client()
+    client.charged = charged
+    return client
+
+
+def test_registration_otp_is_keyed_by_user_id(client):
+    with client.session_transaction() as session:
+        session.update(email='ann@example.com', register_user_id=5, step=2)
+
+    client.post('/register', data={'step': 2, 'action': 'verify', 'otp': '000000'})
+
+    assert client.charged == [('otp_verify_user', 5)]
+
+
+def test_password_reset_otp_uses_the_same_bucket(client):
+    with client.session_transaction() as session:
+        session.update(step='forgot_otp', reset_user_id=5, reset_email='ann@example.com')
+
+    client.post('/login', data={'otp': '000000'})
+
+    assert client.charged == [('otp_verify_user', 5)]